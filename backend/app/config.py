@@ -6,8 +6,9 @@ load_dotenv()
 
 # Path configurations
 BASE_DIR = Path(__file__).resolve().parent.parent
-DOCUMENT_PATH = BASE_DIR / "storage"
-FAISS_INDEX_PATH = BASE_DIR / "faiss_index"
+DOCUMENT_PATH = Path(os.getenv("DOCUMENT_PATH", BASE_DIR / "storage"))
+FAISS_INDEX_PATH = Path(os.getenv("FAISS_INDEX_PATH", BASE_DIR / "faiss_index"))
+EMBEDDING_CACHE_PATH = Path(os.getenv("EMBEDDING_CACHE_PATH", BASE_DIR / "embedding_cache.sqlite3"))
 
 # Create directories if they don't exist
 DOCUMENT_PATH.mkdir(exist_ok=True)
@@ -18,7 +19,78 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 GOOGLE_MODEL="gemini-2.0-flash-thinking-exp-01-21"
 GOOGLE_EMBEDDING_MODEL="models/text-embedding-004"
-MAX_FILE_SIZE = 2 * 1024 * 1024  # 2MB
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))  # Outstanding LLM calls per worker
+
+# LLM routing: "auto" sends short lookups to the fast model and analytical questions or long
+# contexts to GOOGLE_MODEL; "fast" or "reasoning" send everything to one of them
+GOOGLE_FAST_MODEL = os.getenv("GOOGLE_FAST_MODEL", "gemini-2.0-flash")
+LLM_ROUTING = os.getenv("LLM_ROUTING", "auto")
+LLM_ROUTE_QUESTION_TOKENS = int(os.getenv("LLM_ROUTE_QUESTION_TOKENS", 40))  # Longer questions need the reasoning model
+LLM_ROUTE_CONTEXT_TOKENS = int(os.getenv("LLM_ROUTE_CONTEXT_TOKENS", 2000))  # So do contexts longer than this
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", 60))  # Deadline for a whole answer
+# Hedging: a call slower than this percentile of the model's recent calls gets a second call to the fast model
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", 0.95))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20))  # Calls to a model before its calls are hedged
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", 200))  # Recent calls per model the percentile is taken over
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 200_000))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 100))  # Chunks per embedding request
+CHUNK_SIZE_TOKENS = int(os.getenv("CHUNK_SIZE_TOKENS", 400))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", 60))
+MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", 2 * 1024 * 1024))  # 2MB
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 256 * 1024))  # Upload bytes held in memory before each write
+
+# Retrieval: "hybrid" fuses vector and BM25 rankings, "vector" or "keyword" use one of them
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", 4))  # Chunks returned per query
+RETRIEVAL_FETCH_K = int(os.getenv("RETRIEVAL_FETCH_K", 20))  # Candidates per ranking before fusion
+# Concurrent chat questions are embedded and searched together; a batch size of 1 turns this off
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", 32))
+QUERY_BATCH_WAIT_MS = float(os.getenv("QUERY_BATCH_WAIT_MS", 5))  # How long the first question waits for others
+
+# Re-ranking: over-fetch candidates and pick the prompt's chunks by maximal marginal relevance
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "true").lower() == "true"
+RERANK_FETCH_K = int(os.getenv("RERANK_FETCH_K", 20))  # Candidates handed to the re-ranker
+RERANK_LAMBDA = float(os.getenv("RERANK_LAMBDA", 0.7))  # 1 ranks by relevance only, lower values favour diversity
+RERANK_MIN_RELEVANCE = float(os.getenv("RERANK_MIN_RELEVANCE", 0.5))  # Fraction of the best candidate's relevance a chunk needs
+RERANK_DUPLICATE_SIMILARITY = float(os.getenv("RERANK_DUPLICATE_SIMILARITY", 0.95))  # Cosine above which a chunk is a near-duplicate
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", 50))  # Past this, remaining picks follow relevance order
+RERANK_CROSS_ENCODER = os.getenv("RERANK_CROSS_ENCODER", "")  # Optional sentence-transformers cross-encoder model
+
+# Vector index: "flat" (exact), "ivf_flat", "ivf_pq" or "hnsw". Stores start flat and are
+# retrained into the configured type once enough vectors exist for training.
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "flat")
+VECTOR_INDEX_NLIST = int(os.getenv("VECTOR_INDEX_NLIST", 1024))  # IVF clusters
+VECTOR_INDEX_NPROBE = int(os.getenv("VECTOR_INDEX_NPROBE", 32))  # IVF clusters searched per query
+VECTOR_INDEX_PQ_M = int(os.getenv("VECTOR_INDEX_PQ_M", 0))  # Bytes per PQ code; 0 derives it from the memory budget
+VECTOR_INDEX_HNSW_M = int(os.getenv("VECTOR_INDEX_HNSW_M", 32))  # HNSW graph degree
+VECTOR_INDEX_EF_SEARCH = int(os.getenv("VECTOR_INDEX_EF_SEARCH", 64))  # HNSW search breadth
+VECTOR_INDEX_MEMORY_MB = int(os.getenv("VECTOR_INDEX_MEMORY_MB", 0))  # 0 means no budget
+# Filtered searches over at most this many vectors score them directly instead of walking the index
+VECTOR_FILTER_EXACT_MAX = int(os.getenv("VECTOR_FILTER_EXACT_MAX", 2000))
+
+# Index persistence: writes append to a log that is compacted into a new snapshot once it
+# outgrows both the minimum and INDEX_COMPACT_RATIO times the snapshot size
+INDEX_COMPACT_MIN_BYTES = int(os.getenv("INDEX_COMPACT_MIN_BYTES", 64 * 1024 * 1024))
+INDEX_COMPACT_RATIO = float(os.getenv("INDEX_COMPACT_RATIO", 1.0))
+INDEX_MMAP = os.getenv("INDEX_MMAP", "true").lower() == "true"  # Memory-map the snapshot index until the first write
+INDEX_PRELOAD = os.getenv("INDEX_PRELOAD", "true").lower() == "true"  # Load the index in the background at startup
+INDEX_RECONCILE = os.getenv("INDEX_RECONCILE", "true").lower() == "true"  # Index new or changed stored files at startup
+
+# Prompt context: ranked chunks are packed into this many tokens, cut at sentence boundaries
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", 3000))
+
+# Chat answer cache
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 1000))  # 0 disables the cache
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", 3600))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", 0))  # Cosine threshold for near-duplicate questions; 0 matches exact questions only
+
+# Background ingestion
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", 2))  # Concurrent upload pipelines
+# Extraction processes; 0 extracts in the job thread, the default on single-core hosts where a pool only adds overhead
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", os.cpu_count() if (os.cpu_count() or 1) > 1 else 0))
+EXTRACTION_PAGES_PER_TASK = int(os.getenv("EXTRACTION_PAGES_PER_TASK", 50))  # PDF pages per extraction task
+INGESTION_JOB_HISTORY = int(os.getenv("INGESTION_JOB_HISTORY", 1000))  # Finished jobs kept for status queries
 ALLOWED_FILE_TYPES = {
     "application/pdf": ".pdf",
     "application/vnd.openxmlformats-officedocument.wordprocessingml.document": ".docx",
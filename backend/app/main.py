@@ -1,8 +1,11 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from app.routers import documents, chat
-from app.config import BASE_DIR
+from app.config import BASE_DIR, INDEX_PRELOAD, INDEX_RECONCILE
+from app.services import metrics
 import logging
+import threading
 
 app = FastAPI(title="Document Search Bot", version="1.0.0")
 
@@ -12,7 +15,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allow all HTTP methods (GET, POST, OPTIONS, etc.)
     allow_headers=["*"],  # Allow all headers
+    expose_headers=["X-Request-ID", "Server-Timing"],
 )
+# Added last so it is the outermost middleware and times the whole request
+app.add_middleware(metrics.RequestMetricsMiddleware)
 
 # Configure logging
 logging.basicConfig(
@@ -24,10 +30,22 @@ logging.basicConfig(
 app.include_router(documents.router)
 app.include_router(chat.router)
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    # Prometheus text format; every worker process reports its own counts
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.on_event("startup")
 async def startup_event():
     logging.info("Application startup: Initializing services")
+    if INDEX_RECONCILE:
+        # Loads each collection's index too, then queues only the stored files new or changed since they were indexed
+        threading.Thread(target=documents.ingestion_manager.reconcile_all, name="index-reconcile", daemon=True).start()
+    elif INDEX_PRELOAD:
+        # Loaded off the event loop so requests are served at once; the first one using the index waits for it
+        threading.Thread(target=documents.vector_manager.refresh, name="index-preload", daemon=True).start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    logging.info("Application shutdown: Cleaning up resources")
\ No newline at end of file
+    logging.info("Application shutdown: Cleaning up resources")
+    documents.ingestion_manager.shutdown()
\ No newline at end of file
@@ -1,28 +1,185 @@
+import json
+import time
+import asyncio
+import logging
+from typing import List, Optional
 from fastapi import APIRouter, Body, HTTPException
-from app.services.vector_store import VectorStoreManager
-from app.services.llm_setup import LLMManager
+from fastapi.responses import StreamingResponse
+from app.config import (ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_SIMILARITY,
+                        CONTEXT_MAX_TOKENS, RETRIEVAL_K)
+from app.services.vector_store import VectorStoreManager, check_collection
+from app.services.hybrid_search import FanOutRetriever
+from app.services.llm_setup import LLMManager, LLMTimeout
+from app.services.answer_cache import AnswerCache
+from app.services.context_builder import ContextBuilder, PackedContext
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 vector_manager = VectorStoreManager()
 llm_manager = LLMManager()
+answer_cache = AnswerCache(ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_SIMILARITY)
+context_builder = ContextBuilder(CONTEXT_MAX_TOKENS)
+
+def _managers(collections: Optional[List[str]]) -> List[VectorStoreManager]:
+    # The default collection unless the request names others; unknown names are a 404, not a new collection
+    if not collections:
+        return [vector_manager]
+    names = list(dict.fromkeys(collections))
+    try:
+        for name in names:
+            check_collection(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    missing = [name for name in names if name not in VectorStoreManager.collections()]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Unknown collection(s): {', '.join(missing)}")
+    return [VectorStoreManager(name) for name in names]
+
+async def _retrieve_context(user_message: str, files: Optional[List[str]] = None,
+                            file_types: Optional[List[str]] = None,
+                           collections: Optional[List[str]] = None):
+    # Retrieve relevant context, after picking up index changes made by other workers
+    managers = _managers(collections)
+    await asyncio.gather(*(manager.arefresh() for manager in managers))
+    retrievers = [retriever for retriever in (manager.scoped_retriever(files, file_types) for manager in managers)
+                  if retriever is not None]
+    if not retrievers:
+        return [], _notice("No documents have been uploaded yet.")
+    retrievers = [retriever for retriever in retrievers
+                  if retriever.allowed_ids is None or retriever.allowed_ids]
+    if not retrievers:
+        return [], _notice("No uploaded documents match the selected files or file types.")
+    # Several collections are searched concurrently and merged into one ranking
+    retriever = retrievers[0] if len(retrievers) == 1 else FanOutRetriever(retrievers=retrievers, k=RETRIEVAL_K)
+    with metrics.timed("retrieval"):
+        retrieved_docs = await retriever.ainvoke(user_message)
+    with metrics.timed("context_packing"):
+        # The token budget, not a fixed count, decides how many of the ranked chunks reach the prompt
+        context = context_builder.build(retrieved_docs)
+    return retrieved_docs, context
+
+def _notice(text: str) -> PackedContext:
+    return PackedContext(text, [], 0, False)
+
+def _usage(context: PackedContext, user_message: str, llm_seconds: Optional[float]) -> dict:
+    # Reported with every answer; llm_seconds is None when the answer came from the cache
+    usage = {
+        "prompt_tokens": llm_manager.prompt_tokens(context.text, user_message),
+        "context_tokens": context.tokens,
+        "context_truncated": context.truncated,
+        "llm_seconds": None if llm_seconds is None else round(llm_seconds, 3),
+        "cached": llm_seconds is None,
+    }
+    if llm_seconds is not None:
+        llm_manager.record(usage["prompt_tokens"], llm_seconds)
+    logger.info(f"Chat answered (request_id={metrics.current_request_id()}): {usage}")
+    return usage
+
+async def _cached_answer(user_message: str, retrieved_docs):
+    # Returns the cache key parts alongside the hit so a miss can be stored under the same key
+    chunk_ids = [doc.id for doc in retrieved_docs]
+    if not answer_cache.enabled:
+        return chunk_ids, None, None
+    vector = None
+    if answer_cache.similarity_threshold > 0:
+        vector = await vector_manager.aembed_query(user_message)
+    return chunk_ids, vector, answer_cache.get(user_message, chunk_ids, vector)
+
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 @router.post("/")
-async def chat_with_bot(user_message: str = Body(..., embed=True)):
+async def chat_with_bot(user_message: str = Body(..., embed=True),
+                       files: Optional[List[str]] = Body(None, embed=True),
+                       file_types: Optional[List[str]] = Body(None, embed=True),
+                       collections: Optional[List[str]] = Body(None, embed=True)):
     try:
-        # Retrieve relevant context
-        if vector_manager.retriever is None:
-            context = "No documents have been uploaded yet."
-        else:
-            retrieved_docs = vector_manager.retriever.invoke(user_message)
-            context = "\n".join([doc.page_content for doc in retrieved_docs[:3]])
-        
+        retrieved_docs, context = await _retrieve_context(user_message, files, file_types, collections)
+        chunk_ids, vector, cached = await _cached_answer(user_message, retrieved_docs)
+        if cached is not None:
+            return {"response": cached, "citations": context.citations,
+                    "usage": _usage(context, user_message, None)}
+
         # Generate AI response
-        response = llm_manager.generate_response(context, user_message)
-        
-        return {"response": response}
+        start = time.perf_counter()
+        with metrics.timed("llm"):
+            response = await llm_manager.agenerate_response(context.text, user_message)
+        elapsed = time.perf_counter() - start
+        answer_cache.put(user_message, chunk_ids, response, elapsed, vector)
+
+        return {"response": response, "citations": context.citations,
+                "usage": _usage(context, user_message, elapsed)}
     
+    except HTTPException as http_exc:
+        raise http_exc
+    except LLMTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing chat request: {str(e)}"
+        )
+
+@router.post("/stream")
+async def chat_with_bot_stream(user_message: str = Body(..., embed=True),
+                              files: Optional[List[str]] = Body(None, embed=True),
+                              file_types: Optional[List[str]] = Body(None, embed=True),
+                              collections: Optional[List[str]] = Body(None, embed=True)):
+    try:
+        retrieved_docs, context = await _retrieve_context(user_message, files, file_types, collections)
+        chunk_ids, vector, cached = await _cached_answer(user_message, retrieved_docs)
+    except HTTPException as http_exc:
+        raise http_exc
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error processing chat request: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+    sources = list(dict.fromkeys(
+        citation["filename"] for citation in context.citations if citation["filename"] is not None
+    ))
+
+    async def event_stream():
+        # Sources and citations go out before the LLM starts so the UI can render them immediately
+        yield _sse_event("sources", {"sources": sources})
+        yield _sse_event("citations", {"citations": context.citations})
+        if cached is not None:
+            yield _sse_event("token", {"token": cached})
+            yield _sse_event("done", {"usage": _usage(context, user_message, None)})
+            return
+
+        tokens = []
+        start = time.perf_counter()
+        try:
+            async for token in llm_manager.astream_response(context.text, user_message):
+                if not tokens:
+                    metrics.record("llm_first_token", time.perf_counter() - start)
+                tokens.append(token)
+                yield _sse_event("token", {"token": token})
+        except Exception as e:
+            metrics.STAGE_ERRORS.inc(stage="llm")
+            # Headers are already sent, so errors have to be reported in-band
+            yield _sse_event("error", {"detail": f"Error processing chat request: {str(e)}"})
+            return
+        elapsed = time.perf_counter() - start
+        metrics.record("llm", elapsed)
+        answer_cache.put(user_message, chunk_ids, "".join(tokens), elapsed, vector)
+        yield _sse_event("done", {"usage": _usage(context, user_message, elapsed)})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/cache/stats")
+async def answer_cache_stats():
+    return answer_cache.stats()
+
+@router.get("/stats")
+async def chat_stats():
+    # Averages over the answers this worker generated, cached answers excluded, and recent latencies per model
+    return llm_manager.stats()
@@ -1,97 +1,257 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, status
+from fastapi import APIRouter, Request, UploadFile, File, HTTPException, status
+from app.services.vector_store import (VectorStoreManager, DEFAULT_COLLECTION, check_collection,
+                                       collection_document_path)
+from app.services.ingestion import IngestionManager
+from app.services import uploads
 from app.services.document_processor import DocumentProcessor
-from app.services.vector_store import VectorStoreManager
-from app.config import DOCUMENT_PATH,ALLOWED_FILE_TYPES,MAX_FILE_SIZE
-import shutil
+from app.config import ALLOWED_FILE_TYPES,MAX_FILE_SIZE,UPLOAD_CHUNK_SIZE
+from pathlib import Path
+from typing import List
 import os
+import asyncio
+import logging
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+ZIP_FILE_TYPES = {"application/zip", "application/x-zip-compressed"}
+# Room for the multipart boundaries and part headers around the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+# The body is parsed by hand, so the form is described for the docs explicitly
+UPLOAD_FORM_SCHEMA = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object", "required": ["file"], "properties": {"file": {"type": "string", "format": "binary"}}
+}}}}}
 
 router = APIRouter(prefix="/documents", tags=["documents"])
 vector_manager = VectorStoreManager()
+ingestion_manager = IngestionManager()
 
-@router.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+@router.post("/upload", status_code=status.HTTP_202_ACCEPTED, openapi_extra=UPLOAD_FORM_SCHEMA)
+async def upload_file(request: Request, collection: str = DEFAULT_COLLECTION):
+    # The body is streamed straight to disk: memory stays at UPLOAD_CHUNK_SIZE whatever the file size
+    temp_path = None
     try:
-        # File validation
-        if file.content_type not in ALLOWED_FILE_TYPES:
+        document_path = _document_path(collection)
+        # A body the client declares too large is refused before any of it is read
+        content_length = request.headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > MAX_FILE_SIZE + MULTIPART_OVERHEAD:
+            raise _too_large("File size")
+
+        events = uploads.iter_file_field(request.stream(), request.headers.get("content-type", ""), "file")
+        _, (filename, content_type) = await events.__anext__()
+        # File validation, before anything is written
+        if content_type not in ALLOWED_FILE_TYPES:
             raise HTTPException(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, 
                               detail="Unsupported file type")
-        
-        # File validation: size check
-        file_size = 0
-        file.file.seek(0, os.SEEK_END)
-        file_size = file.file.tell()
-        #print(file_size)
-        file.file.seek(0)
-        #print(file.file)
-        if file_size > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                detail="File size exceeds 2MB limit"
-            )
-
-        # Save file
-        file_path = DOCUMENT_PATH / file.filename
-        with file_path.open("wb+") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        # Process document
-        text = DocumentProcessor.extract_text(str(file_path), file.filename)
-        chunks = DocumentProcessor.chunk_text(text)
-        
-        # Update vector store
-        vector_manager.update_index(chunks, {"filename": file.filename})
-        
-        return {"message": f"File {file.filename} processed successfully"}
+        filename = os.path.basename(filename)
+        if not filename or filename.startswith("."):
+            raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid file name")
+
+        # Hashed and size-checked as it arrives, then renamed into place in one step
+        temp_path, fingerprint = await uploads.write_temp(
+            (data async for _, data in events), document_path, MAX_FILE_SIZE, UPLOAD_CHUNK_SIZE,
+            DocumentProcessor.file_type(filename)
+        )
+        file_path = document_path / filename
+        fingerprint = await uploads.commit(temp_path, file_path, fingerprint)
+        temp_path = None
+
+        # Extraction, chunking and embedding continue in the background
+        job = ingestion_manager.submit(str(file_path), filename, fingerprint, collection)
+
+        return {"message": f"File {filename} accepted for processing", "job_id": job.id,
+                "collection": collection}
+    except uploads.UploadTooLarge:
+        raise _too_large("File size")
+    except (uploads.MultipartError, StopAsyncIteration) as e:
+        raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f"Invalid upload: {str(e) or 'no file'}")
     except HTTPException as http_exc:
         raise http_exc  # ✅ Return correct 415 or 413 error
     except Exception as e:
         raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, 
                           detail=str(e))
+    finally:
+        await uploads.discard(temp_path)
+
+@router.post("/upload/batch", status_code=status.HTTP_202_ACCEPTED)
+async def upload_batch(files: List[UploadFile] = File(...), collection: str = DEFAULT_COLLECTION):
+    try:
+        document_path = _document_path(collection)
+        # Validate every file (and zip member) before anything is written
+        pending = []
+        for file in files:
+            if file.content_type in ZIP_FILE_TYPES or file.filename.lower().endswith(".zip"):
+                pending.extend(_zip_members(file))
+                continue
+            if file.content_type not in ALLOWED_FILE_TYPES:
+                raise HTTPException(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                                    detail=f"Unsupported file type: {file.filename}")
+            file.file.seek(0, os.SEEK_END)
+            file_size = file.file.tell()
+            file.file.seek(0)
+            _check_size(file.filename, file_size)
+            pending.append((file.filename, file.file))
+
+        if not pending:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="No documents in the upload")
+
+        # Everything is written to temporary files first, so a failure leaves no file behind
+        staged = []
+        try:
+            for filename, source in pending:
+                try:
+                    temp_path, fingerprint = await uploads.write_temp(
+                        uploads.iter_upload(source, UPLOAD_CHUNK_SIZE), document_path, MAX_FILE_SIZE,
+                        UPLOAD_CHUNK_SIZE, DocumentProcessor.file_type(filename)
+                    )
+                except uploads.UploadTooLarge:
+                    raise _too_large(f"{filename}: file size")
+                staged.append((temp_path, filename, fingerprint))
+
+            saved, fingerprints = [], {}
+            for temp_path, filename, fingerprint in staged:
+                file_path = document_path / filename
+                fingerprints[filename] = await uploads.commit(temp_path, file_path, fingerprint)
+                saved.append((str(file_path), filename))
+            staged = []
+        finally:
+            for temp_path, _, _ in staged:
+                await uploads.discard(temp_path)
+
+        # One job: parallel extraction, batched embedding and a single index save
+        job = ingestion_manager.submit_batch(saved, fingerprints, collection)
+
+        return {"message": f"{len(saved)} files accepted for processing", "job_id": job.id,
+                "collection": collection, "files": [filename for _, filename in saved]}
+    except HTTPException as http_exc:
+        raise http_exc
+    except Exception as e:
+        raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR,
+                          detail=str(e))
+
+def _document_path(collection: str) -> Path:
+    try:
+        return collection_document_path(collection)
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+def _existing_manager(collection: str) -> VectorStoreManager:
+    # Reading a collection must not create it
+    try:
+        check_collection(collection)
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if collection not in VectorStoreManager.collections():
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail=f"Collection {collection} not found")
+    return VectorStoreManager(collection)
+
+def _too_large(subject: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"{subject} exceeds {MAX_FILE_SIZE // (1024 * 1024)}MB limit"
+    )
+
+def _check_size(filename: str, file_size: int):
+    if file_size > MAX_FILE_SIZE:
+        raise _too_large(f"{filename}: file size")
+
+def _zip_members(file: UploadFile):
+    try:
+        archive = zipfile.ZipFile(file.file)
+    except zipfile.BadZipFile:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=f"Invalid zip archive: {file.filename}")
+
+    members = []
+    allowed_extensions = set(ALLOWED_FILE_TYPES.values())
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        # Never trust archive paths: keep only the base name
+        filename = os.path.basename(info.filename)
+        if not filename or filename.startswith("."):
+            continue
+        if os.path.splitext(filename)[1].lower() not in allowed_extensions:
+            raise HTTPException(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                                detail=f"Unsupported file type: {filename}")
+        _check_size(filename, info.file_size)
+        members.append((filename, archive.open(info)))
+    return members
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    job = ingestion_manager.get_job(job_id)
+    if job is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job.to_dict()
+
+@router.get("/collections")
+async def get_collections():
+    try:
+        return {"collections": await asyncio.to_thread(VectorStoreManager.collections)}
+    except Exception as e:
+        raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR,
+                          detail=str(e))
+
+@router.get("/manifest")
+async def get_manifest(collection: str = DEFAULT_COLLECTION):
+    # What is indexed: per file its sha256, size, mtime, chunk ids, extractor version and embedding model
+    try:
+        manager = _existing_manager(collection)
+        return {"collection": collection, "files": await asyncio.to_thread(manager.manifest)}
+    except HTTPException as http_exc:
+        raise http_exc
+    except Exception as e:
+        raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR,
+                          detail=str(e))
+
+@router.post("/reconcile", status_code=status.HTTP_202_ACCEPTED)
+async def reconcile_documents(collection: str = DEFAULT_COLLECTION):
+    # Index stored files that are new or changed, e.g. after copying files into the storage directory
+    try:
+        _existing_manager(collection)
+        job = await asyncio.to_thread(ingestion_manager.reconcile, collection)
+        if job is None:
+            return {"message": "Index is up to date", "job_id": None}
+        return {"message": f"{len(job.filenames)} files queued for checking", "job_id": job.id,
+                "files": job.filenames}
+    except HTTPException as http_exc:
+        raise http_exc
+    except Exception as e:
+        raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR,
+                          detail=str(e))
 
 @router.get("/getfile")  # Add this endpoint
-async def get_files():
+async def get_files(collection: str = DEFAULT_COLLECTION):
     try:
-        if not DOCUMENT_PATH.exists():
+        document_path = _document_path(collection)
+        if not document_path.exists():
             return {"files": []}
         
-        files = [f for f in os.listdir(DOCUMENT_PATH) if os.path.isfile(os.path.join(DOCUMENT_PATH, f))]
+        # Dot files are uploads still being written
+        files = [f for f in os.listdir(document_path)
+                 if os.path.isfile(os.path.join(document_path, f)) and not f.startswith(".")]
         return {"files": files}
+    except HTTPException as http_exc:
+        raise http_exc
     except Exception as e:
         raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, 
                           detail=str(e))
     
 @router.delete("/{filename}")
-async def delete_file(filename: str):
+async def delete_file(filename: str, collection: str = DEFAULT_COLLECTION):
     try:
         # Delete file
-        print("delete")
-        file_path = DOCUMENT_PATH / filename
+        file_path = _document_path(collection) / filename
         if not file_path.exists():
             raise HTTPException(status.HTTP_404_NOT_FOUND, 
                               detail="File not found")
         file_path.unlink()
-        print("file exisit")
-
-        # Retrieve remaining files
-        remaining_files = [f for f in os.listdir(DOCUMENT_PATH) if os.path.isfile(os.path.join(DOCUMENT_PATH, f))]
-        
-        # Clear vector store
-        vector_manager.clear_index()
+        logger.info(f"Deleted file {filename}")
 
         # Remove only the embeddings related to the deleted file
-        #vector_manager.remove_from_index({"filename": filename})
-
-        if remaining_files:  # Re-embed if other documents are present
-            try:
-                for file in remaining_files:
-                    file_full_path = DOCUMENT_PATH / file
-                    text = DocumentProcessor.extract_text(str(file_full_path), file)
-                    chunks = DocumentProcessor.chunk_text(text)
-                    vector_manager.update_index(chunks, {"filename": file})
-            except Exception as e:
-                print(e)
-            
-            #vector_manager.update_index(all_chunks, metadata_list)
-        
+        VectorStoreManager(collection).remove_from_index({"filename": filename})
+
         return {"message": f"File {filename} deleted successfully and embeddings updated"}
     except HTTPException as http_exc:
         raise http_exc  # ✅ Return correct 415 or 413 error
@@ -0,0 +1,419 @@
+import math
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from app.config import (VECTOR_INDEX_TYPE, VECTOR_INDEX_NLIST, VECTOR_INDEX_NPROBE, VECTOR_INDEX_PQ_M,
+                        VECTOR_INDEX_HNSW_M, VECTOR_INDEX_EF_SEARCH, VECTOR_INDEX_MEMORY_MB, INDEX_MMAP,
+                        VECTOR_FILTER_EXACT_MAX)
+from langchain_core.documents import Document
+from app.services.docstore import DOCSTORE_FILE, SQLiteDocstore
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+# faiss warns below 39 training points per centroid
+TRAINING_POINTS_PER_CENTROID = 39
+PQ_BITS = 8
+
+def index_type(index: faiss.Index) -> str:
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+def training_size(kind: str) -> int:
+    """
+    Vectors needed before an index of this type can be trained; until then the
+    store stays flat, which is exact and fast enough at that size.
+    """
+    if kind == "ivf_flat":
+        return VECTOR_INDEX_NLIST * TRAINING_POINTS_PER_CENTROID
+    if kind == "ivf_pq":
+        return max(VECTOR_INDEX_NLIST, 2 ** PQ_BITS) * TRAINING_POINTS_PER_CENTROID
+    return 0
+
+def pq_subquantizers(dim: int, count: int) -> int:
+    """
+    Bytes per PQ code: VECTOR_INDEX_PQ_M if set, otherwise the largest divisor of
+    the dimension that keeps `count` codes (plus their 8-byte ids) inside
+    VECTOR_INDEX_MEMORY_MB, or dim / 8 (a 32x reduction) without a budget.
+    """
+    if VECTOR_INDEX_PQ_M:
+        return VECTOR_INDEX_PQ_M
+    if VECTOR_INDEX_MEMORY_MB:
+        target = VECTOR_INDEX_MEMORY_MB * 1024 * 1024 // max(count, 1) - 8
+    else:
+        target = dim // 8
+    return max([m for m in range(1, dim + 1) if dim % m == 0 and m <= target] or [1])
+
+def estimated_bytes(index: faiss.Index) -> int:
+    kind = index_type(index)
+    count, dim = index.ntotal, index.d
+    if kind == "ivf_pq":
+        return count * (index.pq.M + 8) + index.nlist * dim * 4
+    if kind == "ivf_flat":
+        return count * (dim * 4 + 8) + index.nlist * dim * 4
+    if kind == "hnsw":
+        # Vectors plus their 2 * M level-0 neighbour links; upper levels are comparatively tiny
+        return count * (dim * 4 + index.hnsw.nb_neighbors(0) * 4)
+    return count * dim * 4
+
+def configure(index: faiss.Index) -> faiss.Index:
+    # Search-time knobs are applied on every build and load so config changes take effect
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = min(VECTOR_INDEX_NPROBE, index.nlist)
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = VECTOR_INDEX_EF_SEARCH
+    return index
+
+def build_index(kind: str, vectors: np.ndarray) -> faiss.Index:
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown vector index type {kind!r}, expected one of {INDEX_TYPES}")
+    count, dim = vectors.shape
+    if kind == "ivf_flat":
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(dim), dim, VECTOR_INDEX_NLIST)
+    elif kind == "ivf_pq":
+        index = faiss.IndexIVFPQ(faiss.IndexFlatL2(dim), dim, VECTOR_INDEX_NLIST,
+                                 pq_subquantizers(dim, count), PQ_BITS)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, VECTOR_INDEX_HNSW_M)
+    else:
+        index = faiss.IndexFlatL2(dim)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return configure(index)
+
+def filtered_search_parameters(index: faiss.Index, selector: faiss.IDSelector, allowed: int, k: int):
+    """
+    Search parameters that skip every vector outside `selector`. IVF probes more
+    lists the fewer vectors are allowed, so about as many allowed candidates are
+    scanned as an unfiltered query would scan in total.
+    """
+    if isinstance(index, faiss.IndexIVF):
+        nprobe = math.ceil(index.nprobe * index.ntotal / max(allowed, 1))
+        return faiss.SearchParametersIVF(sel=selector, nprobe=min(index.nlist, nprobe))
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=max(index.hnsw.efSearch, k))
+    return faiss.SearchParameters(sel=selector)
+
+def reconstruct_all(index: faiss.Index) -> np.ndarray:
+    if isinstance(index, faiss.IndexIVF):
+        # IVF lists are keyed by id, so reconstruction needs a temporary id -> list map
+        index.make_direct_map()
+        try:
+            return index.reconstruct_n(0, index.ntotal)
+        finally:
+            index.set_direct_map_type(faiss.DirectMap.NoMap)
+    return index.reconstruct_n(0, index.ntotal)
+
+def remove_positions(index: faiss.Index, positions: List[int]) -> faiss.Index:
+    """
+    Remove vectors by position and renumber the rest to stay contiguous, which is
+    what the langchain store's index_to_docstore_id mapping assumes.
+
+    HNSW graphs cannot drop nodes, so they are rebuilt from the remaining vectors,
+    an O(N log N) graph build; the store only does that when compacting and keeps
+    deleted nodes as tombstones in between.
+    """
+    removed = np.unique(np.asarray(positions, dtype=np.int64))
+    if isinstance(index, faiss.IndexHNSW):
+        keep = np.setdiff1d(np.arange(index.ntotal, dtype=np.int64), removed)
+        vectors = index.reconstruct_n(0, index.ntotal)[keep]
+        rebuilt = faiss.IndexHNSWFlat(index.d, VECTOR_INDEX_HNSW_M)
+        rebuilt.add(vectors)
+        return configure(rebuilt)
+
+    index.remove_ids(faiss.IDSelectorBatch(removed))
+    if isinstance(index, faiss.IndexIVF):
+        # Flat indexes shift the remaining vectors down; IVF keeps the old ids, so shift them here
+        invlists = index.invlists
+        for list_no in range(index.nlist):
+            size = invlists.list_size(list_no)
+            if not size:
+                continue
+            ids_ptr = invlists.get_ids(list_no)
+            ids = faiss.rev_swig_ptr(ids_ptr, size)
+            ids -= np.searchsorted(removed, ids)
+            invlists.release_ids(list_no, ids_ptr)
+    return index
+
+class ANNVectorStore(FAISS):
+    """
+    langchain FAISS store whose index type follows VECTOR_INDEX_TYPE.
+
+    New stores start flat; `migrate` retrains into the configured type once enough
+    vectors exist, which also converts an existing flat index on load. Deletes keep
+    positions contiguous for flat and IVF indexes. An HNSW delete only unmaps the
+    nodes and adds them to a tombstone selector that every search excludes; the
+    graph is rebuilt without them by `purge`, which saving runs, or once they
+    outnumber the live nodes, so deletes cost O(deleted) and rebuilds stay amortised.
+
+    Saved stores keep their documents in SQLite instead of a pickle. With INDEX_MMAP
+    a loaded index is memory-mapped and only copied into memory before its first
+    change, since faiss cannot grow or shrink a mapped index.
+    """
+    _mapped = False
+    _positions: Optional[Dict[str, int]] = None
+    # Deleted HNSW nodes still in the graph, and the (batch, not) selector pair that skips them
+    _tombstones: Optional[np.ndarray] = None
+    _tombstone_selectors: Optional[Tuple[faiss.IDSelector, faiss.IDSelector]] = None
+    # Readers share the store; only one of them builds an IVF index's id -> list map
+    _direct_map_lock = threading.Lock()
+
+    @classmethod
+    def from_embeddings(cls, text_embeddings, embedding, metadatas=None, ids=None, **kwargs) -> "ANNVectorStore":
+        kwargs.setdefault("docstore", SQLiteDocstore())
+        return super().from_embeddings(text_embeddings, embedding, metadatas=metadatas, ids=ids, **kwargs)
+
+    def save_local(self, folder_path: str, index_name: str = "index") -> None:
+        # Snapshots never carry tombstones, so a loaded store's positions are contiguous
+        self.purge()
+        path = Path(folder_path)
+        path.mkdir(parents=True, exist_ok=True)
+        if isinstance(self.index, faiss.IndexIVF):
+            self.index.set_direct_map_type(faiss.DirectMap.NoMap)
+        faiss.write_index(self.index, str(path / f"{index_name}.faiss"))
+        docstore = self.docstore
+        if not isinstance(docstore, SQLiteDocstore):
+            # Stores loaded from a pickled docstore move to SQLite on their next save
+            docstore = SQLiteDocstore()
+            docstore.add({doc_id: self.docstore.search(doc_id) for doc_id in self.index_to_docstore_id.values()})
+        docstore.write(path / DOCSTORE_FILE, self.index_to_docstore_id)
+
+    @classmethod
+    def load_local(cls, folder_path: str, embeddings, index_name: str = "index", **kwargs) -> "ANNVectorStore":
+        path = Path(folder_path)
+        if not (path / DOCSTORE_FILE).exists():
+            # Written by FAISS.save_local, with the docstore pickled next to the index
+            return super().load_local(folder_path, embeddings, index_name, **kwargs)
+        index = faiss.read_index(str(path / f"{index_name}.faiss"), faiss.IO_FLAG_MMAP_IFC if INDEX_MMAP else 0)
+        store = cls(embeddings, configure(index), SQLiteDocstore(path / DOCSTORE_FILE),
+                    SQLiteDocstore.read_positions(path / DOCSTORE_FILE))
+        store._mapped = INDEX_MMAP
+        return store
+
+    def _writable(self):
+        # Mapped vectors are views of the file; faiss aborts the process if asked to resize one
+        if self._mapped:
+            self.index = configure(faiss.deserialize_index(faiss.serialize_index(self.index)))
+            self._mapped = False
+        self._positions = None
+        if isinstance(self.index, faiss.IndexIVF):
+            # Built for reconstruction between writes; it would not follow the renumbering on delete
+            self.index.set_direct_map_type(faiss.DirectMap.NoMap)
+
+    def _search(self, vectors: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if self._tombstone_selectors is None:
+            return self.index.search(vectors, k)
+        params = filtered_search_parameters(self.index, self._tombstone_selectors[1],
+                                            len(self.index_to_docstore_id), k)
+        return self.index.search(vectors, k, params=params)
+
+    def _bury(self, positions: Iterable[int]):
+        # Caller holds the write side; the nodes stay in the graph but no longer map to a document
+        for position in positions:
+            del self.index_to_docstore_id[position]
+        dead = np.union1d(self._tombstones if self._tombstones is not None else [],
+                          np.fromiter(positions, dtype=np.int64)).astype(np.int64)
+        self._tombstones = dead
+        if len(dead) > len(self.index_to_docstore_id):
+            # Searches slow down and lose recall as a graph fills with dead nodes
+            self.purge()
+            return
+        batch = faiss.IDSelectorBatch(dead)
+        self._tombstone_selectors = (batch, faiss.IDSelectorNot(batch))
+
+    def purge(self):
+        """
+        Rebuild an HNSW graph without its deleted nodes and renumber the rest
+        contiguously. A full graph build, so it runs when compacting rather than on
+        every delete.
+        """
+        if self._tombstones is None:
+            return
+        self._writable()
+        self.index = remove_positions(self.index, self._tombstones)
+        remaining_ids = [id_ for _, id_ in sorted(self.index_to_docstore_id.items())]
+        self.index_to_docstore_id = {i: id_ for i, id_ in enumerate(remaining_ids)}
+        self._tombstones = self._tombstone_selectors = None
+        self._positions = None
+
+    def _position_map(self) -> Dict[str, int]:
+        # Rebuilt after each write
+        if self._positions is None:
+            self._positions = {doc_id: position for position, doc_id in self.index_to_docstore_id.items()}
+        return self._positions
+
+    def positions_of(self, ids: Iterable[str]) -> np.ndarray:
+        # Ids no longer in the store are skipped
+        position_map = self._position_map()
+        positions = [position_map[doc_id] for doc_id in ids if doc_id in position_map]
+        return np.sort(np.asarray(positions, dtype=np.int64))
+
+    def vectors_of(self, ids: Sequence[str]) -> np.ndarray:
+        # The vectors stored for these docstore ids, in order, so callers never re-embed a chunk
+        position_map = self._position_map()
+        positions = np.asarray([position_map[doc_id] for doc_id in ids], dtype=np.int64)
+        if isinstance(self.index, faiss.IndexIVF) and self.index.direct_map.type == faiss.DirectMap.NoMap:
+            with self._direct_map_lock:
+                if self.index.direct_map.type == faiss.DirectMap.NoMap:
+                    self.index.make_direct_map()
+        return self.index.reconstruct_batch(positions)
+
+    def similarity_search_by_vectors(self, embeddings: Sequence[Sequence[float]], k: int = 4) -> List[List[Document]]:
+        # One faiss call for many queries: the index is scanned once for the whole matrix
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vectors)
+        _, found = self._search(vectors, k)
+        results = []
+        for row in found:
+            documents = []
+            for position in row:
+                if position == -1:
+                    continue
+                doc_id = self.index_to_docstore_id[int(position)]
+                doc = self.docstore.search(doc_id)
+                if not isinstance(doc, Document):
+                    raise ValueError(f"Could not find document for id {doc_id}, got {doc}")
+                documents.append(doc)
+            results.append(documents)
+        return results
+
+    def similarity_search_among(self, embedding: List[float], ids: Iterable[str], k: int = 4) -> List[Document]:
+        """
+        Nearest neighbours restricted to the given docstore ids.
+
+        The allowlist is applied inside the search rather than to its results, so
+        the top k always come from the allowed documents and the vectors outside it
+        are never scored. Small allowlists on flat and HNSW indexes are scanned
+        exactly from their stored vectors (VECTOR_FILTER_EXACT_MAX), which also
+        avoids HNSW dead ends in a sparse graph; larger ones use a faiss ID selector.
+        """
+        positions = self.positions_of(ids)
+        if not len(positions):
+            return []
+        vector = np.array([embedding], dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vector)
+        k = min(k, len(positions))
+        if len(positions) <= VECTOR_FILTER_EXACT_MAX and not isinstance(self.index, faiss.IndexIVF):
+            _, found = faiss.knn(vector, self.index.reconstruct_batch(positions), k)
+            found = positions[found[0]]
+        else:
+            selector = faiss.IDSelectorBatch(positions)
+            params = filtered_search_parameters(self.index, selector, len(positions), k)
+            found = self.index.search(vector, k, params=params)[1][0]
+
+        documents = []
+        for position in found:
+            if position == -1:
+                continue
+            doc_id = self.index_to_docstore_id[int(position)]
+            doc = self.docstore.search(doc_id)
+            if not isinstance(doc, Document):
+                raise ValueError(f"Could not find document for id {doc_id}, got {doc}")
+            documents.append(doc)
+        return documents
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4, filter=None,
+                                               fetch_k: int = 20, **kwargs) -> List[Tuple[Document, float]]:
+        if self._tombstone_selectors is None:
+            return super().similarity_search_with_score_by_vector(embedding, k, filter=filter, fetch_k=fetch_k,
+                                                                  **kwargs)
+        # langchain's search would return tombstoned nodes, which map to no document
+        vector = np.array([embedding], dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vector)
+        scores, found = self._search(vector, k if filter is None else fetch_k)
+        filter_func = self._create_filter_func(filter) if filter is not None else None
+        docs = []
+        for score, position in zip(scores[0], found[0]):
+            if position == -1:
+                continue
+            doc_id = self.index_to_docstore_id[int(position)]
+            doc = self.docstore.search(doc_id)
+            if not isinstance(doc, Document):
+                raise ValueError(f"Could not find document for id {doc_id}, got {doc}")
+            if filter_func is None or filter_func(doc.metadata):
+                docs.append((doc, score))
+        score_threshold = kwargs.get("score_threshold")
+        if score_threshold is not None:
+            # Tombstones only exist on HNSW indexes, which rank by L2 distance
+            docs = [(doc, score) for doc, score in docs if score <= score_threshold]
+        return docs[:k]
+
+    def _add(self, add, *args, **kwargs) -> List[str]:
+        # langchain numbers new vectors from len(index_to_docstore_id), which tombstones make too small
+        self._writable()
+        start, index_to_docstore_id = self.index.ntotal, self.index_to_docstore_id
+        self.index_to_docstore_id = {}
+        try:
+            ids = add(*args, **kwargs)
+            index_to_docstore_id.update({start + position: id_ for position, id_ in self.index_to_docstore_id.items()})
+        finally:
+            self.index_to_docstore_id = index_to_docstore_id
+        return ids
+
+    def add_embeddings(self, text_embeddings, metadatas=None, ids=None, **kwargs) -> List[str]:
+        return self._add(super().add_embeddings, text_embeddings, metadatas=metadatas, ids=ids, **kwargs)
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs) -> List[str]:
+        return self._add(super().add_texts, texts, metadatas=metadatas, ids=ids, **kwargs)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs) -> Optional[bool]:
+        if ids is None:
+            raise ValueError("No ids provided to delete.")
+        self._writable()
+        missing_ids = set(ids).difference(self.index_to_docstore_id.values())
+        if missing_ids:
+            raise ValueError(f"Some specified ids do not exist in the current store. Ids not found: {missing_ids}")
+
+        reversed_index = {id_: idx for idx, id_ in self.index_to_docstore_id.items()}
+        index_to_delete = {reversed_index[id_] for id_ in ids}
+        self.docstore.delete(ids)
+        if isinstance(self.index, faiss.IndexHNSW):
+            self._bury(index_to_delete)
+            return True
+        self.index = remove_positions(self.index, list(index_to_delete))
+
+        remaining_ids = [id_ for i, id_ in sorted(self.index_to_docstore_id.items()) if i not in index_to_delete]
+        self.index_to_docstore_id = {i: id_ for i, id_ in enumerate(remaining_ids)}
+        return True
+
+    def migrate(self, kind: Optional[str] = None) -> bool:
+        kind = kind or VECTOR_INDEX_TYPE
+        current = index_type(self.index)
+        if current == kind or self.index.ntotal < training_size(kind):
+            configure(self.index)
+            return False
+        self.purge()
+        self._writable()
+        if current == "ivf_pq":
+            logger.warning("Rebuilding from an IVF-PQ index uses its lossy reconstructed vectors")
+        vectors = reconstruct_all(self.index)
+        self.index = build_index(kind, vectors)
+        logger.info(f"Migrated vector index from {current} to {kind} with {self.index.ntotal} vectors, "
+                    f"about {estimated_bytes(self.index) // (1024 * 1024)}MB")
+        return True
+
+    def index_stats(self) -> dict:
+        stats = {
+            "type": index_type(self.index),
+            "vectors": len(self.index_to_docstore_id),
+            "tombstones": len(self._tombstones) if self._tombstones is not None else 0,
+            "estimated_bytes": estimated_bytes(self.index),
+            "mapped": self._mapped,
+        }
+        if VECTOR_INDEX_MEMORY_MB and stats["estimated_bytes"] > VECTOR_INDEX_MEMORY_MB * 1024 * 1024:
+            logger.warning(f"Vector index uses about {stats['estimated_bytes'] // (1024 * 1024)}MB, "
+                           f"over the {VECTOR_INDEX_MEMORY_MB}MB budget")
+        return stats
@@ -0,0 +1,143 @@
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
+WORD_PATTERN = re.compile(r"\w+")
+
+class _Answer:
+    __slots__ = ("answer", "latency", "created_at", "chunk_key", "vector")
+
+    def __init__(self, answer: str, latency: float, chunk_key: Tuple[str, ...], vector: Optional[np.ndarray]):
+        self.answer = answer
+        self.latency = latency
+        self.created_at = time.monotonic()
+        self.chunk_key = chunk_key
+        self.vector = vector
+
+class AnswerCache:
+    """
+    In-memory LRU cache of chat answers keyed on the normalised question and the ids
+    of the chunks retrieved for it.
+
+    Chunk ids change whenever the documents behind them are re-indexed, so a changed
+    index misses instead of serving a stale answer. With a `similarity_threshold` a
+    question whose embedding is at least that cosine-similar to a cached question with
+    the same retrieved chunks reuses its answer too.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, similarity_threshold: float = 0.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, Tuple[str, ...]], _Answer]" = OrderedDict()
+        # Questions cached per retrieved chunk set, the candidates for a similarity match
+        self._by_chunks: Dict[Tuple[str, ...], List[Tuple[str, Tuple[str, ...]]]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def normalise(question: str) -> str:
+        # Case, punctuation and spacing do not change the question
+        return " ".join(WORD_PATTERN.findall(question.lower()))
+
+    @staticmethod
+    def _unit(vector: Optional[Sequence[float]]) -> Optional[np.ndarray]:
+        if vector is None:
+            return None
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def _expired(self, entry: _Answer) -> bool:
+        return time.monotonic() - entry.created_at > self.ttl_seconds
+
+    def _remove(self, key: Tuple[str, Tuple[str, ...]]):
+        entry = self._entries.pop(key)
+        siblings = self._by_chunks[entry.chunk_key]
+        siblings.remove(key)
+        if not siblings:
+            del self._by_chunks[entry.chunk_key]
+
+    def get(self, question: str, chunk_ids: Sequence[str],
+            vector: Optional[Sequence[float]] = None) -> Optional[str]:
+        chunk_key = tuple(chunk_ids)
+        key = (self.normalise(question), chunk_key)
+        with self._lock:
+            entry = self._entries.get(key)
+            match = "exact"
+            if entry is not None and self._expired(entry):
+                self._remove(key)
+                entry = None
+
+            if entry is None and self.similarity_threshold > 0 and vector is not None:
+                query = self._unit(vector)
+                best = self.similarity_threshold
+                for candidate in list(self._by_chunks.get(chunk_key, ())):
+                    cached = self._entries[candidate]
+                    if self._expired(cached):
+                        self._remove(candidate)
+                        continue
+                    if cached.vector is not None:
+                        score = float(np.dot(query, cached.vector))
+                        if score >= best:
+                            key, entry, best = candidate, cached, score
+                if entry is not None:
+                    self.similar_hits += 1
+                    match = "similar"
+
+            if entry is None:
+                self.misses += 1
+                metrics.ANSWER_CACHE_MISSES.inc()
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_seconds += entry.latency
+            metrics.ANSWER_CACHE_HITS.inc(match=match)
+            metrics.ANSWER_CACHE_SAVED_SECONDS.inc(entry.latency)
+            return entry.answer
+
+    def put(self, question: str, chunk_ids: Sequence[str], answer: str, latency: float,
+            vector: Optional[Sequence[float]] = None):
+        if not self.enabled:
+            return
+        chunk_key = tuple(chunk_ids)
+        key = (self.normalise(question), chunk_key)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Answer(answer, latency, chunk_key, self._unit(vector))
+            self._by_chunks.setdefault(chunk_key, []).append(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_chunks.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+            }
@@ -0,0 +1,105 @@
+from typing import Any, Dict, List, Sequence
+from langchain_core.documents import Document
+from app.services.document_processor import DocumentProcessor, SENTENCE_PATTERN, WORD_PATTERN
+
+# Shorter sentences (table cells, "Yes.") recur legitimately and are never treated as repeats
+MIN_DEDUPLICATED_TOKENS = 5
+# Locator keys cited for a snippet, in display order
+LOCATOR_KEYS = ("page", "page_end", "slide", "slide_end", "sheet", "row", "paragraph")
+
+class PackedContext:
+    def __init__(self, text: str, citations: List[Dict[str, Any]], tokens: int, truncated: bool):
+        self.text = text
+        self.citations = citations
+        self.tokens = tokens
+        self.truncated = truncated
+
+class ContextBuilder:
+    """
+    Packs ranked chunks into the prompt's context within a token budget.
+
+    Each chunk becomes a snippet headed by its number and source locator, e.g.
+    "[2] report.pdf, pages 3-4", which the answer can cite; the matching citation
+    carries the same number. Sentences already given by a higher-ranked snippet,
+    such as the overlap the chunker repeats between neighbouring chunks, are left
+    out. The snippet that would overflow the budget is cut at a sentence boundary
+    and the rest are dropped. Tokens are counted with the chunker's estimate.
+    """
+
+    def __init__(self, max_tokens: int):
+        self.max_tokens = max_tokens
+
+    @staticmethod
+    def _label(metadata: Dict[str, Any]) -> str:
+        parts = [str(metadata.get("filename", "unknown source"))]
+        for key, end_key in (("page", "page_end"), ("slide", "slide_end")):
+            if key in metadata:
+                end = metadata.get(end_key)
+                parts.append(f"{key}s {metadata[key]}-{end}" if end else f"{key} {metadata[key]}")
+        if "sheet" in metadata:
+            parts.append(f"sheet {metadata['sheet']}" + (f", row {metadata['row']}" if "row" in metadata else ""))
+        if "paragraph" in metadata:
+            parts.append(f"paragraph {metadata['paragraph']}")
+        return ", ".join(parts)
+
+    @staticmethod
+    def _key(sentence: str) -> str:
+        return " ".join(sentence.lower().split())
+
+    def build(self, documents: Sequence[Document]) -> PackedContext:
+        seen = set()
+        snippets, citations = [], []
+        used, truncated = 0, False
+        for doc in documents:
+            number = len(citations) + 1
+            header = f"[{number}] {self._label(doc.metadata)}"
+            budget = self.max_tokens - used - DocumentProcessor.count_tokens(header)
+
+            lines, tokens, full = [], 0, True
+            for line in doc.page_content.splitlines():
+                kept = []
+                for match in SENTENCE_PATTERN.finditer(line):
+                    sentence = match.group().strip()
+                    if not sentence:
+                        continue
+                    sentence_tokens = DocumentProcessor.count_tokens(sentence)
+                    key = self._key(sentence)
+                    if sentence_tokens >= MIN_DEDUPLICATED_TOKENS and key in seen:
+                        continue
+                    if tokens + sentence_tokens > budget:
+                        if not snippets and not lines and not kept:
+                            # Nothing fits otherwise: give the top chunk its first words rather than no context
+                            kept.extend(filter(None, [self._cut(sentence, budget)]))
+                        full = False
+                        break
+                    if sentence_tokens >= MIN_DEDUPLICATED_TOKENS:
+                        seen.add(key)
+                    kept.append(sentence)
+                    tokens += sentence_tokens
+                if kept:
+                    lines.append(" ".join(kept))
+                if not full:
+                    break
+
+            if lines:
+                text = "\n".join(lines)
+                snippets.append(f"{header}\n{text}")
+                used += DocumentProcessor.count_tokens(header) + DocumentProcessor.count_tokens(text)
+                citation = {"id": number, "chunk_id": doc.id, "filename": doc.metadata.get("filename")}
+                citation.update((key, doc.metadata[key]) for key in LOCATOR_KEYS if key in doc.metadata)
+                citations.append(citation)
+            if not full:
+                truncated = True
+                break
+        return PackedContext("\n\n".join(snippets), citations, used, truncated)
+
+    @staticmethod
+    def _cut(sentence: str, budget: int) -> str:
+        words, tokens = [], 0
+        for match in WORD_PATTERN.finditer(sentence):
+            word_tokens = DocumentProcessor.count_tokens(match.group())
+            if tokens + word_tokens > budget:
+                break
+            words.append(match.group())
+            tokens += word_tokens
+        return " ".join(words)
@@ -0,0 +1,103 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+DOCSTORE_FILE = "docstore.sqlite3"
+
+SCHEMA = """
+CREATE TABLE documents (id TEXT PRIMARY KEY, text TEXT NOT NULL, metadata TEXT NOT NULL);
+CREATE TABLE positions (position INTEGER PRIMARY KEY, id TEXT NOT NULL);
+"""
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """
+    Chunk texts and metadata read from a snapshot's SQLite file on demand, so loading
+    the index does not unpickle every document up front.
+
+    The file is never written after its snapshot is committed. Documents added or
+    deleted since are kept in memory until `write` folds them into the next snapshot.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path
+        self._conn = None
+        self._added: Dict[str, Document] = {}
+        self._deleted = set()
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        return self._conn
+
+    def open(self):
+        """
+        Open the snapshot's file now rather than on the first lookup. Another worker's
+        compaction may delete the snapshot as soon as the index lock is released, and
+        a file that is already open stays readable until it is closed.
+        """
+        if self.path is not None:
+            with self._lock:
+                self._connection()
+
+    def search(self, search: str) -> Union[str, Document]:
+        with self._lock:
+            doc = self._added.get(search)
+            if doc is not None:
+                return doc
+            if self.path is not None and search not in self._deleted:
+                row = self._connection().execute(
+                    "SELECT text, metadata FROM documents WHERE id = ?", (search,)
+                ).fetchone()
+                if row is not None:
+                    # Retrieval keys on document ids, and FAISS only passes on what the docstore returns
+                    return Document(id=search, page_content=row[0], metadata=json.loads(row[1]))
+        return f"ID {search} not found."
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        with self._lock:
+            self._added.update(texts)
+            self._deleted.difference_update(texts)
+
+    def delete(self, ids: List) -> None:
+        with self._lock:
+            for doc_id in ids:
+                if self._added.pop(doc_id, None) is None:
+                    self._deleted.add(doc_id)
+
+    def write(self, path: Path, index_to_docstore_id: Dict[int, str]):
+        # A copy of the current file plus the changes since; the caller commits it with its snapshot
+        conn = sqlite3.connect(str(path))
+        try:
+            if self.path is not None:
+                source = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+                try:
+                    source.backup(conn)
+                finally:
+                    source.close()
+            else:
+                conn.executescript(SCHEMA)
+            with self._lock:
+                added, deleted = dict(self._added), set(self._deleted)
+            conn.executemany("DELETE FROM documents WHERE id = ?", ((doc_id,) for doc_id in deleted))
+            conn.executemany(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?)",
+                ((doc_id, doc.page_content, json.dumps(doc.metadata)) for doc_id, doc in added.items())
+            )
+            conn.execute("DELETE FROM positions")
+            conn.executemany("INSERT INTO positions VALUES (?, ?)", index_to_docstore_id.items())
+            conn.commit()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def read_positions(path: Path) -> Dict[int, str]:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            return dict(conn.execute("SELECT position, id FROM positions ORDER BY position"))
+        finally:
+            conn.close()
@@ -1,68 +1,388 @@
 import os
+import re
 import math
+import time
 import logging
-from typing import List
+from collections import deque
+from concurrent.futures import Executor
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 from fastapi import HTTPException
-from app.config import DOCUMENT_PATH
+from app.config import DOCUMENT_PATH, CHUNK_SIZE_TOKENS, CHUNK_OVERLAP_TOKENS, EXTRACTION_PAGES_PER_TASK
+from app.services import metrics
 import PyPDF2
 import docx
-import pandas as pd
+import openpyxl
+import xlrd
 from pptx import Presentation
 
 logger = logging.getLogger(__name__)
 
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+LINE_PATTERN = re.compile(r"[^\n]*\n?")
+SENTENCE_PATTERN = re.compile(r"[^.!?]+(?:[.!?]+|$)")
+WORD_PATTERN = re.compile(r"\S+")
+BLOCK_SEPARATOR = "\n\n"
+
+# Rows per spreadsheet segment and paragraphs per Word segment
+SHEET_ROWS_PER_SEGMENT = 200
+DOCX_PARAGRAPHS_PER_SEGMENT = 100
+# Locator keys whose last value is recorded as `<key>_end` when a chunk spans segments
+SPAN_KEYS = ("page", "slide")
+
+# A segment is one page, slide, block of sheet rows or run of paragraphs, with where it came from
+Segment = Tuple[Dict[str, Any], str]
+# A slice of a document that can be extracted on its own: a range of PDF page indexes or a sheet name
+Part = Union[None, range, str]
+
 class DocumentProcessor:
     @staticmethod
-    def extract_text(file_path: str, filename: str) -> str:
+    def iter_segments(file_path: str, filename: str, part: Part = None) -> Iterator[Segment]:
+        """
+        Yield the document as (locator, text) segments, reading it one page, slide or
+        block of rows at a time so the whole text is never held in memory. `part`
+        restricts a PDF to a range of pages or a workbook to one sheet.
+        """
+        ext = os.path.splitext(filename)[1].lower()
+        if ext == ".pdf":
+            return DocumentProcessor._iter_pdf(file_path, part)
+        elif ext in [".doc", ".docx"]:
+            return DocumentProcessor._iter_docx(file_path)
+        elif ext == ".xlsx":
+            return DocumentProcessor._iter_xlsx(file_path, part)
+        elif ext == ".xls":
+            return DocumentProcessor._iter_xls(file_path, part)
+        elif ext in [".ppt", ".pptx"]:
+            return DocumentProcessor._iter_pptx(file_path)
+        raise ValueError("Unsupported file type")
+
+    @staticmethod
+    def file_type(filename: str) -> str:
+        # Recorded on every chunk and matched by /chat's file_types filter
+        return os.path.splitext(filename)[1].lower().lstrip(".")
+
+    @staticmethod
+    def split_parts(file_path: str, filename: str, pages_per_part: int = EXTRACTION_PAGES_PER_TASK) -> List[Part]:
+        """
+        Split a document into parts that can be extracted independently: page ranges
+        for PDFs, sheets for workbooks and the whole file for everything else.
+        """
         ext = os.path.splitext(filename)[1].lower()
+        if ext == ".pdf":
+            with open(file_path, "rb") as f:
+                pages = len(PyPDF2.PdfReader(f).pages)
+            if pages > pages_per_part:
+                return [range(start, min(start + pages_per_part, pages)) for start in range(0, pages, pages_per_part)]
+        elif ext == ".xlsx":
+            workbook = openpyxl.load_workbook(file_path, read_only=True)
+            try:
+                sheets = list(workbook.sheetnames)
+            finally:
+                workbook.close()
+            if len(sheets) > 1:
+                return sheets
+        elif ext == ".xls":
+            workbook = xlrd.open_workbook(file_path, on_demand=True)
+            try:
+                sheets = workbook.sheet_names()
+            finally:
+                workbook.release_resources()
+            if len(sheets) > 1:
+                return sheets
+        return [None]
+
+    @staticmethod
+    def extract_text(file_path: str, filename: str) -> str:
         try:
-            if ext == ".pdf":
-                return DocumentProcessor._extract_pdf(file_path)
-            elif ext in [".doc", ".docx"]:
-                return DocumentProcessor._extract_docx(file_path)
-            elif ext in [".xls", ".xlsx"]:
-                return DocumentProcessor._extract_excel(file_path)
-            elif ext in [".ppt", ".pptx"]:
-                return DocumentProcessor._extract_pptx(file_path)
-            raise HTTPException(status_code=415, detail="Unsupported file type")
+            return BLOCK_SEPARATOR.join(text for _, text in DocumentProcessor.iter_segments(file_path, filename))
         except Exception as e:
             logger.error(f"Error processing {filename}: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Error processing {filename}")
 
     @staticmethod
-    def _extract_pdf(file_path: str) -> str:
-        text = ""
+    def extract_chunks(file_path: str, filename: str, part: Part = None, chunk_size: int = CHUNK_SIZE_TOKENS,
+                       chunk_overlap: int = CHUNK_OVERLAP_TOKENS) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Extract and chunk a document, or one part of it, in one pass, returning
+        (chunk, locator) pairs. Time spent reading segments is recorded as the
+        extraction stage and the rest as chunking.
+        """
+        read_seconds = 0.0
+
+        def timed_segments():
+            nonlocal read_seconds
+            segments = DocumentProcessor.iter_segments(file_path, filename, part)
+            while True:
+                start = time.perf_counter()
+                segment = next(segments, None)
+                read_seconds += time.perf_counter() - start
+                if segment is None:
+                    return
+                yield segment
+
+        try:
+            start = time.perf_counter()
+            chunks = list(DocumentProcessor.iter_segment_chunks(timed_segments(), chunk_size, chunk_overlap))
+            file_type = DocumentProcessor.file_type(filename)
+            metrics.record("extraction", read_seconds, file_type)
+            metrics.record("chunking", time.perf_counter() - start - read_seconds, file_type)
+            return chunks
+        except Exception as e:
+            logger.error(f"Error processing {filename}: {str(e)}")
+            # A plain exception, unlike HTTPException, survives the trip back from a worker process
+            raise ValueError(f"Error processing {filename}") from None
+
+    @staticmethod
+    def extract_parallel(files: Iterable[Tuple[str, str]], executor: Optional[Executor] = None
+                         ) -> Iterator[Tuple[str, List[Tuple[str, Dict[str, Any]]], Optional[str]]]:
+        """
+        Extract and chunk many documents, yielding (filename, chunks, error) in input order.
+
+        With an executor (normally a ProcessPoolExecutor) every file is split into
+        page ranges or sheets and all parts of all files are submitted up front, so a
+        single large document spreads over the workers as well as a batch does; the
+        parts are reassembled in page/sheet order. Without one, files are extracted
+        one after another in the calling thread.
+        """
+        if executor is None:
+            for file_path, filename in files:
+                try:
+                    yield filename, DocumentProcessor.extract_chunks(file_path, filename), None
+                except HTTPException as e:
+                    yield filename, [], str(e.detail)
+                except Exception as e:
+                    yield filename, [], str(e)
+            return
+
+        submitted = []
+        for file_path, filename in files:
+            try:
+                parts = DocumentProcessor.split_parts(file_path, filename)
+            except Exception as e:
+                logger.error(f"Error processing {filename}: {str(e)}")
+                submitted.append((filename, None))
+                continue
+            submitted.append((filename, [
+                executor.submit(DocumentProcessor._extract_part, file_path, filename, part) for part in parts
+            ]))
+
+        for filename, futures in submitted:
+            if futures is None:
+                yield filename, [], f"Error processing {filename}"
+                continue
+            chunks = []
+            try:
+                for future in futures:
+                    part_chunks, stages = future.result()
+                    chunks.extend(part_chunks)
+                    metrics.replay(stages)
+            except Exception as e:
+                for future in futures:
+                    future.cancel()
+                yield filename, [], str(e)
+                continue
+            yield filename, chunks, None
+
+    @staticmethod
+    def _extract_part(file_path: str, filename: str, part: Part):
+        # Runs in a worker process, whose metrics nobody scrapes: the stage timings travel back with the chunks
+        with metrics.captured_stages() as stages:
+            chunks = DocumentProcessor.extract_chunks(file_path, filename, part)
+        return chunks, stages
+
+    @staticmethod
+    def _iter_pdf(file_path: str, pages: Optional[range] = None) -> Iterator[Segment]:
         with open(file_path, "rb") as f:
             reader = PyPDF2.PdfReader(f)
-            for page in reader.pages:
-                text += page.extract_text() or ""
-        return text
+            for index in pages if pages is not None else range(len(reader.pages)):
+                yield {"page": index + 1}, reader.pages[index].extract_text() or ""
 
     @staticmethod
-    def _extract_docx(file_path: str) -> str:
+    def _iter_docx(file_path: str) -> Iterator[Segment]:
         doc = docx.Document(file_path)
-        return "\n".join(para.text for para in doc.paragraphs)
+        lines: List[str] = []
+        first = 1
+        for number, para in enumerate(doc.paragraphs, start=1):
+            # Start a new segment at each heading so locators point at document sections
+            if lines and (para.style.name.startswith("Heading") or len(lines) >= DOCX_PARAGRAPHS_PER_SEGMENT):
+                yield {"paragraph": first}, "\n".join(lines)
+                lines = []
+            if not lines:
+                first = number
+            lines.append(para.text)
+        if lines:
+            yield {"paragraph": first}, "\n".join(lines)
+
+    @staticmethod
+    def _iter_sheet(sheet: str, rows: Iterable[Sequence[Any]]) -> Iterator[Segment]:
+        """
+        Render sheet rows as " | "-separated lines, the first non-empty row being the
+        header that is repeated at the top of every segment.
+        """
+        header: Optional[str] = None
+        lines: List[str] = []
+        first = 0
+        for number, row in enumerate(rows, start=1):
+            values = ["" if value is None else str(value) for value in row]
+            while values and not values[-1]:
+                values.pop()
+            if not values:
+                continue
+            line = " | ".join(values)
+            if header is None:
+                header = line
+                continue
+            if not lines:
+                first = number
+            lines.append(line)
+            if len(lines) >= SHEET_ROWS_PER_SEGMENT:
+                yield {"sheet": sheet, "row": first}, "\n".join([header] + lines)
+                lines = []
+        if lines:
+            yield {"sheet": sheet, "row": first}, "\n".join([header] + lines)
+        elif header is not None and not first:
+            yield {"sheet": sheet, "row": 1}, header
+
+    @staticmethod
+    def _iter_xlsx(file_path: str, sheet: Optional[str] = None) -> Iterator[Segment]:
+        # Read-only mode streams rows from the XML instead of loading every cell
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            for worksheet in workbook.worksheets if sheet is None else [workbook[sheet]]:
+                yield from DocumentProcessor._iter_sheet(worksheet.title, worksheet.iter_rows(values_only=True))
+        finally:
+            workbook.close()
 
     @staticmethod
-    def _extract_excel(file_path: str) -> str:
-        text = []
-        xl = pd.ExcelFile(file_path)
-        for sheet_name in xl.sheet_names:
-            df = xl.parse(sheet_name)
-            text.append(df.to_string())
-        return "\n".join(text)
+    def _iter_xls(file_path: str, sheet: Optional[str] = None) -> Iterator[Segment]:
+        workbook = xlrd.open_workbook(file_path, on_demand=True)
+        try:
+            for name in workbook.sheet_names() if sheet is None else [sheet]:
+                worksheet = workbook.sheet_by_name(name)
+                yield from DocumentProcessor._iter_sheet(name, (worksheet.row_values(i)
+                                                                for i in range(worksheet.nrows)))
+                workbook.unload_sheet(name)
+        finally:
+            workbook.release_resources()
 
     @staticmethod
-    def _extract_pptx(file_path: str) -> str:
+    def _iter_pptx(file_path: str) -> Iterator[Segment]:
         prs = Presentation(file_path)
-        text = []
-        for slide in prs.slides:
-            for shape in slide.shapes:
-                if hasattr(shape, "text"):
-                    text.append(shape.text)
-        return "\n".join(text)
+        for number, slide in enumerate(prs.slides, start=1):
+            yield {"slide": number}, "\n".join(shape.text for shape in slide.shapes if hasattr(shape, "text"))
+
+    @staticmethod
+    def count_tokens(text: str) -> int:
+        # Cheap, model-agnostic estimate: words and punctuation marks each count as one token
+        return sum(1 for _ in TOKEN_PATTERN.finditer(text))
+
+    @staticmethod
+    def _iter_units(text: str, max_tokens: int) -> Iterator[Tuple[str, int, str]]:
+        """
+        Yield (unit, tokens, separator) for every line of the text, where separator is
+        what joins the unit to the one before it.
+
+        Lines are the natural unit for sheet rows, bullet points and slide text; blank
+        lines mark paragraph, slide and sheet boundaries. Lines longer than the chunk
+        budget are split at sentence ends and, failing that, between words.
+        """
+        separator = BLOCK_SEPARATOR
+        for match in LINE_PATTERN.finditer(text):
+            line = match.group().strip()
+            if not line:
+                separator = BLOCK_SEPARATOR
+                continue
+
+            tokens = DocumentProcessor.count_tokens(line)
+            if tokens <= max_tokens:
+                yield line, tokens, separator
+                separator = "\n"
+                continue
+
+            for sentence_match in SENTENCE_PATTERN.finditer(line):
+                sentence = sentence_match.group().strip()
+                if not sentence:
+                    continue
+                tokens = DocumentProcessor.count_tokens(sentence)
+                if tokens <= max_tokens:
+                    yield sentence, tokens, separator
+                    separator = " "
+                    continue
+
+                words, window_tokens = [], 0
+                for word_match in WORD_PATTERN.finditer(sentence):
+                    word = word_match.group()
+                    word_tokens = DocumentProcessor.count_tokens(word)
+                    if words and window_tokens + word_tokens > max_tokens:
+                        yield " ".join(words), window_tokens, separator
+                        separator = " "
+                        words, window_tokens = [], 0
+                    words.append(word)
+                    window_tokens += word_tokens
+                if words:
+                    yield " ".join(words), window_tokens, separator
+                    separator = " "
+            separator = "\n"
+
+    @staticmethod
+    def iter_segment_chunks(segments: Iterable[Segment], chunk_size: int = CHUNK_SIZE_TOKENS,
+                            chunk_overlap: int = CHUNK_OVERLAP_TOKENS) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Pack lines into chunks of at most `chunk_size` tokens, repeating up to
+        `chunk_overlap` tokens of trailing lines at the start of the next chunk.
+
+        Segments are consumed lazily and each one starts a new block; a chunk that is
+        already half full is closed at a paragraph/page/slide/sheet boundary rather
+        than straddling it. Every chunk comes with the locator of the segment it starts
+        in, plus `page_end`/`slide_end` when it runs into a later page or slide.
+        """
+        chunk_overlap = min(chunk_overlap, chunk_size // 2)
+        current: Deque[Tuple[str, int, str, Dict[str, Any]]] = deque()
+        current_tokens = 0
+        fresh = 0  # Units in the current chunk that were not carried over as overlap
+
+        def render(units) -> Tuple[str, Dict[str, Any]]:
+            parts = []
+            for i, (unit, _, separator, _) in enumerate(units):
+                if i:
+                    parts.append(separator)
+                parts.append(unit)
+            locator = dict(units[0][3])
+            for key in SPAN_KEYS:
+                if key in locator and units[-1][3].get(key, locator[key]) != locator[key]:
+                    locator[f"{key}_end"] = units[-1][3][key]
+            return "".join(parts), locator
+
+        units = (
+            (unit, tokens, separator, locator)
+            for locator, text in segments
+            for unit, tokens, separator in DocumentProcessor._iter_units(text, chunk_size)
+        )
+        for unit, tokens, separator, locator in units:
+            boundary = separator == BLOCK_SEPARATOR and current_tokens >= chunk_size // 2
+            if fresh and (current_tokens + tokens > chunk_size or boundary):
+                yield render(current)
+                # Carry the tail of the emitted chunk over as overlap, except across a boundary
+                carried, carried_tokens = deque(), 0
+                while not boundary and current and carried_tokens + current[-1][1] <= chunk_overlap:
+                    carried.appendleft(current.pop())
+                    carried_tokens += carried[0][1]
+                current, current_tokens, fresh = carried, carried_tokens, 0
+                while current and current_tokens + tokens > chunk_size:
+                    current_tokens -= current.popleft()[1]
+            current.append((unit, tokens, separator, locator))
+            current_tokens += tokens
+            fresh += 1
+
+        if fresh:
+            yield render(current)
+
+    @staticmethod
+    def iter_chunks(text: str, chunk_size: int = CHUNK_SIZE_TOKENS,
+                    chunk_overlap: int = CHUNK_OVERLAP_TOKENS) -> Iterator[str]:
+        for chunk, _ in DocumentProcessor.iter_segment_chunks([({}, text)], chunk_size, chunk_overlap):
+            yield chunk
 
     @staticmethod
-    def chunk_text(text: str, chunk_size: int = 3500) -> List[str]:
-        words = text.split()
-        return [" ".join(words[i:i+chunk_size]) for i in range(0, len(words), chunk_size)]
\ No newline at end of file
+    def chunk_text(text: str, chunk_size: int = CHUNK_SIZE_TOKENS,
+                   chunk_overlap: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
+        return list(DocumentProcessor.iter_chunks(text, chunk_size, chunk_overlap))
@@ -0,0 +1,189 @@
+import hashlib
+import inspect
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
+def embed_queries(embeddings: Embeddings, texts: List[str]) -> List[List[float]]:
+    """
+    Embed questions with one request where the backend allows it. Google's batch
+    endpoint is told they are queries, which its single-text call means to do but
+    does not pass on; other backends embed questions and documents alike.
+    """
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(texts)
+    metrics.EMBEDDING_BATCH_SIZE.observe(len(texts), kind="query")
+    with metrics.timed("query_embedding"):
+        if "task_type" in inspect.signature(embeddings.embed_documents).parameters:
+            return embeddings.embed_documents(texts, task_type="RETRIEVAL_QUERY")
+        if len(texts) == 1:
+            return [embeddings.embed_query(texts[0])]
+        return embeddings.embed_documents(texts)
+
+class CachedEmbeddings(Embeddings):
+    """
+    Persistent embedding cache keyed by sha256 of the embedding model and chunk text.
+
+    Chunk vectors are stored as float32 blobs in SQLite; once more than `max_entries`
+    vectors are cached the least recently used ones are evicted. Query vectors are
+    kept in a small in-memory LRU instead so one-off questions never evict chunks.
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str, path: Path, max_entries: int,
+                 max_query_entries: int = 1024):
+        self.embeddings = embeddings
+        self.model = model
+        self.path = path
+        self.max_entries = max_entries
+        self.max_query_entries = max_query_entries
+        self.hits = 0
+        self.misses = 0
+        # Questions are counted apart: they hit the in-memory LRU, not the SQLite cache
+        self.query_hits = 0
+        self.query_misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._entries = 0
+        self._clock = 0
+        # Recency updates are buffered and written together with the next insert
+        self._touched: Dict[str, int] = {}
+        self._queries: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened on first use so importing the app does not create the cache file
+        if self._conn is None:
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used INTEGER NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+            self._conn.commit()
+            self._entries, self._clock = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(MAX(last_used), 0) FROM embeddings"
+            ).fetchone()
+        return self._conn
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        conn = self._connection()
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        # Stay well below SQLite's bound-parameter limit
+        for start in range(0, len(unique_keys), 500):
+            batch = unique_keys[start:start + 500]
+            rows = conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                batch
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        if found:
+            self._clock += 1
+            self._touched.update(dict.fromkeys(found, self._clock))
+        return found
+
+    def _store(self, vectors: Dict[str, List[float]]):
+        conn = self._connection()
+        if self._touched:
+            conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(clock, key) for key, clock in self._touched.items()]
+            )
+            self._touched.clear()
+        self._clock += 1
+        conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+            [(key, np.asarray(vector, dtype=np.float32).tobytes(), self._clock)
+             for key, vector in vectors.items()]
+        )
+        self._entries += len(vectors)
+        if self._entries > self.max_entries:
+            # The running count is approximate (replaced keys, other writers); recount before evicting
+            self._entries = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if self._entries > self.max_entries:
+                conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (self._entries - self.max_entries,)
+                )
+                self._entries = self.max_entries
+        conn.commit()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        with self._lock:
+            cached = self._lookup(keys)
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in cached:
+                    missing.setdefault(key, text)
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            # Round through float32 so fresh and cached results are identical
+            computed = {key: np.asarray(vector, dtype=np.float32).tolist()
+                        for key, vector in zip(missing.keys(), vectors)}
+            with self._lock:
+                self._store(computed)
+            cached.update(computed)
+
+        logger.debug(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses")
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed many questions in one request. Single and batched questions go through
+        here alike, so a question gets the same vector either way.
+        """
+        found = {}
+        with self._lock:
+            for text in texts:
+                vector = self._queries.get(text)
+                if vector is not None:
+                    self._queries.move_to_end(text)
+                    found[text] = vector
+
+            missing = list(dict.fromkeys(text for text in texts if text not in found))
+            self.query_hits += len(texts) - len(missing)
+            self.query_misses += len(missing)
+
+        if missing:
+            vectors = embed_queries(self.embeddings, missing)
+            with self._lock:
+                for text, vector in zip(missing, vectors):
+                    found[text] = self._queries[text] = vector
+                while len(self._queries) > self.max_query_entries:
+                    self._queries.popitem(last=False)
+        return [found[text] for text in texts]
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            query_total = self.query_hits + self.query_misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "query_hits": self.query_hits,
+                "query_misses": self.query_misses,
+                "query_hit_rate": self.query_hits / query_total if query_total else 0.0,
+                "entries": self._entries,
+                "max_entries": self.max_entries,
+            }
@@ -0,0 +1,337 @@
+import os
+import re
+import json
+import math
+import heapq
+import asyncio
+import logging
+import threading
+from collections import Counter
+from contextlib import nullcontext
+from pathlib import Path
+from typing import AbstractSet, Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+logger = logging.getLogger(__name__)
+
+TERM_PATTERN = re.compile(r"\w+")
+
+class KeywordIndex:
+    """
+    In-memory BM25 inverted index over chunk texts, keyed by docstore id.
+
+    Postings map each term to {doc_id: term frequency}, so adding or removing a
+    document only touches its own terms and a query only reads the postings of its
+    terms. Persisted as JSON next to the FAISS index.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, min_relative_score: float = 0.1):
+        self.k1 = k1
+        self.b = b
+        self.min_relative_score = min_relative_score
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._lengths: Dict[str, int] = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return TERM_PATTERN.findall(text.lower())
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def doc_ids(self) -> set:
+        with self._lock:
+            return set(self._lengths)
+
+    def add(self, doc_ids: Iterable[str], texts: Iterable[str]):
+        with self._lock:
+            for doc_id, text in zip(doc_ids, texts):
+                terms = self.tokenize(text)
+                self._lengths[doc_id] = len(terms)
+                self._total_length += len(terms)
+                for term, tf in Counter(terms).items():
+                    self._postings.setdefault(term, {})[doc_id] = tf
+
+    def remove(self, doc_ids: Iterable[str]):
+        # Term lists are not stored per document, so scan postings once for the whole batch
+        removed = set()
+        with self._lock:
+            for doc_id in doc_ids:
+                length = self._lengths.pop(doc_id, None)
+                if length is not None:
+                    self._total_length -= length
+                    removed.add(doc_id)
+            if not removed:
+                return
+            for term in list(self._postings):
+                postings = self._postings[term]
+                for doc_id in removed.intersection(postings):
+                    del postings[doc_id]
+                if not postings:
+                    del self._postings[term]
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._lengths.clear()
+            self._total_length = 0
+
+    def search(self, query: str, k: int, allowed: Optional[AbstractSet[str]] = None) -> List[Tuple[str, float]]:
+        """
+        Top-k BM25 matches, scoring the rarest terms first.
+
+        A term adds at most idf * (k1 + 1) to any document, so once the k-th best
+        score beats what all remaining terms could add, documents not yet seen cannot
+        reach the top k and common terms only update the existing candidates. With
+        fewer than k candidates the same applies to documents that could not reach
+        `min_relative_score` of the best one, so such weak matches may be left out.
+
+        `allowed` restricts the matches to those docstore ids; a term's postings are
+        then read through whichever of the two is smaller.
+        """
+        with self._lock:
+            count = len(self._lengths)
+            if not count:
+                return []
+            average_length = self._total_length / count
+            terms = sorted(
+                (postings for postings in map(self._postings.get, set(self.tokenize(query))) if postings),
+                key=len
+            )
+            idfs = [math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5)) for postings in terms]
+            remaining = sum(idfs) * (self.k1 + 1)
+
+            scores: Dict[str, float] = {}
+            for postings, idf in zip(terms, idfs):
+                top = heapq.nlargest(k, scores.values())
+                floor = top[-1] if len(top) >= k else (top[0] * self.min_relative_score if top else 0.0)
+                if floor > remaining:
+                    matches = [(doc_id, postings[doc_id]) for doc_id in scores if doc_id in postings]
+                elif allowed is None:
+                    matches = postings.items()
+                elif len(allowed) < len(postings):
+                    matches = [(doc_id, postings[doc_id]) for doc_id in allowed if doc_id in postings]
+                else:
+                    matches = [(doc_id, tf) for doc_id, tf in postings.items() if doc_id in allowed]
+                for doc_id, tf in matches:
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+                remaining -= idf * (self.k1 + 1)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def save(self, path: Path):
+        with self._lock:
+            data = {"k1": self.k1, "b": self.b, "lengths": self._lengths, "postings": self._postings}
+            tmp_path = path.with_suffix(".tmp")
+            with tmp_path.open("w", encoding="utf-8") as f:
+                json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "KeywordIndex":
+        with path.open("r", encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(k1=data["k1"], b=data["b"])
+        index._lengths = data["lengths"]
+        index._postings = data["postings"]
+        index._total_length = sum(index._lengths.values())
+        return index
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever over the FAISS store and the keyword index.
+
+    mode="vector" is plain similarity search, mode="keyword" is BM25 only and never
+    calls the embedding API, and mode="hybrid" merges the top `fetch_k` of both
+    rankings with reciprocal-rank fusion: score = sum of 1 / (rrf_k + rank).
+    With `allowed_ids` set, both rankings only consider those docstore ids. With a
+    `reranker`, it gets an over-fetched candidate list with the candidates' stored
+    vectors and picks the k results.
+
+    The query is embedded first; the index itself is only read under `lock`'s read
+    side, which the async path takes on a worker thread. With a `batcher` the async
+    path hands the query to it, to be embedded and searched along with concurrent ones.
+    """
+    vectorstore: Any
+    keyword_index: Any
+    lock: Any = None
+    allowed_ids: Optional[AbstractSet[str]] = None
+    reranker: Any = None
+    batcher: Any = None
+    mode: str = "hybrid"
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+
+    def _keyword_documents(self, query: str, k: int) -> List[Tuple[Document, float]]:
+        documents = []
+        for doc_id, score in self.keyword_index.search(query, k, self.allowed_ids):
+            doc = self.vectorstore.docstore.search(doc_id)
+            if isinstance(doc, Document):
+                # Docstore entries carry no id; callers use it to key on the retrieved chunks
+                documents.append((Document(id=doc_id, page_content=doc.page_content, metadata=doc.metadata), score))
+        return documents
+
+    def _vector_documents(self, vector: List[float], k: int) -> List[Document]:
+        if self.allowed_ids is None:
+            return self.vectorstore.similarity_search_by_vector(vector, k=k)
+        return self.vectorstore.similarity_search_among(vector, self.allowed_ids, k=k)
+
+    def _fuse(self, rankings: List[List[Document]], k: int) -> List[Document]:
+        scores: Dict[str, float] = {}
+        documents: Dict[str, Document] = {}
+        for ranking in rankings:
+            for rank, doc in enumerate(ranking, start=1):
+                scores[doc.id] = scores.get(doc.id, 0.0) + 1 / (self.rrf_k + rank)
+                documents.setdefault(doc.id, doc)
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        return [documents[doc_id] for doc_id in ranked[:k]]
+
+    def _candidate_k(self) -> int:
+        return self.k if self.reranker is None else max(self.k, self.reranker.fetch_k)
+
+    def _vector_k(self) -> int:
+        # Vector hits wanted from the index; 0 in keyword mode
+        if self.mode == "keyword":
+            return 0
+        return self._candidate_k() if self.mode == "vector" else max(self._candidate_k(), self.fetch_k)
+
+    def _candidates(self, query: str, vector: Optional[List[float]],
+                    vector_documents: Optional[List[Document]] = None) -> Tuple[List[Document], Dict[str, float]]:
+        """
+        Candidates in ranked order and the BM25 score of each one the keyword search found.
+        """
+        # Caller holds the read lock; vector_documents are this query's hits from a batched search
+        k = self._candidate_k()
+        if vector_documents is None and self.mode != "keyword":
+            vector_documents = self._vector_documents(vector, self._vector_k())
+        if self.mode == "vector":
+            return vector_documents[:k], {}
+        keyword_hits = self._keyword_documents(query, k if self.mode == "keyword" else max(k, self.fetch_k))
+        keyword_scores = {doc.id: score for doc, score in keyword_hits}
+        if self.mode == "keyword":
+            return [doc for doc, _ in keyword_hits], keyword_scores
+        return self._fuse([vector_documents[:self._vector_k()], [doc for doc, _ in keyword_hits]], k), keyword_scores
+
+    def _search(self, query: str, vector: Optional[List[float]]) -> List[Document]:
+        return self.search_batch([(self, query, vector)])[0]
+
+    @staticmethod
+    def search_batch(requests: List[Tuple["HybridRetriever", str, Optional[List[float]]]]) -> List[List[Document]]:
+        """
+        Answer many (retriever, query, query vector) requests at once.
+
+        Requests against the same store share one hold of its read lock, and their
+        unfiltered vector searches run as a single faiss search over the matrix of
+        query vectors. Scoped (allowed_ids) searches and keyword rankings stay per
+        request, and re-ranking runs after the lock is released.
+        """
+        results: List[Optional[List[Document]]] = [None] * len(requests)
+        groups: Dict[int, List[int]] = {}
+        for i, (retriever, _, _) in enumerate(requests):
+            groups.setdefault(id(retriever.vectorstore), []).append(i)
+
+        for indexes in groups.values():
+            first = requests[indexes[0]][0]
+            batched = [i for i in indexes if requests[i][0].allowed_ids is None and requests[i][0]._vector_k()]
+            stored = {}
+            with first.lock.read() if first.lock is not None else nullcontext():
+                hits = {}
+                if batched:
+                    k = max(requests[i][0]._vector_k() for i in batched)
+                    rows = first.vectorstore.similarity_search_by_vectors([requests[i][2] for i in batched], k=k)
+                    hits = dict(zip(batched, rows))
+                for i in indexes:
+                    retriever, query, vector = requests[i]
+                    results[i], keyword_scores = retriever._candidates(query, vector, hits.get(i))
+                    if retriever.reranker is not None:
+                        stored[i] = (retriever.vectorstore.vectors_of([doc.id for doc in results[i]]),
+                                     [keyword_scores.get(doc.id, 0.0) for doc in results[i]])
+            # Re-ranking only works on the copies taken above, so writers need not wait for it.
+            # Hybrid candidates are scored by cosine and by BM25, so neither kind of evidence is lost
+            for i, (vectors, keyword_scores) in stored.items():
+                retriever, query, vector = requests[i]
+                results[i] = retriever.reranker.rerank(query, vector, results[i], vectors, retriever.k,
+                                                       keyword_scores if retriever.mode == "hybrid" else None)
+        return results
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        vector = None if self.mode == "keyword" else self.vectorstore._embed_query(query)
+        return self._search(query, vector)
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        if self.batcher is not None:
+            return await self.batcher.retrieve(self, query)
+        vector = None if self.mode == "keyword" else await self.vectorstore._aembed_query(query)
+        return await asyncio.to_thread(self._search, query, vector)
+
+class FanOutRetriever(BaseRetriever):
+    """
+    Searches several collections' retrievers at once and merges their results.
+
+    The question is embedded once and every collection is searched concurrently, so
+    latency follows the slowest targeted collection rather than their total size.
+    The per-collection rankings are merged with reciprocal-rank fusion together with
+    one global ranking by cosine similarity between the query and each result's
+    stored vector: the collections share an embedding model, so that is the score
+    they have in common, while each collection's own order keeps its keyword and
+    re-ranking evidence. In keyword mode the collections' rankings are interleaved.
+    """
+    retrievers: List[HybridRetriever]
+    k: int = 4
+    rrf_k: int = 60
+
+    @property
+    def _mode(self) -> str:
+        return self.retrievers[0].mode
+
+    def _similarity_ranking(self, rankings: List[List[Document]], vector: List[float]) -> List[Document]:
+        query = np.asarray(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1
+        scored = []
+        for retriever, ranking in zip(self.retrievers, rankings):
+            if not ranking:
+                continue
+            try:
+                with retriever.lock.read() if retriever.lock is not None else nullcontext():
+                    stored = retriever.vectorstore.vectors_of([doc.id for doc in ranking])
+            except KeyError:
+                # Deleted by a write since it was found; it still takes part through its collection's ranking
+                continue
+            norms = np.linalg.norm(stored, axis=1)
+            similarities = stored @ query / np.where(norms == 0, 1, norms)
+            scored.extend(zip(similarities.tolist(), range(len(scored), len(scored) + len(ranking)), ranking))
+        return [doc for _, _, doc in sorted(scored, key=lambda item: (-item[0], item[1]))]
+
+    def _merge(self, rankings: List[List[Document]], vector: Optional[List[float]]) -> List[Document]:
+        rankings = list(rankings)
+        if vector is not None:
+            rankings.append(self._similarity_ranking(rankings, vector))
+        return HybridRetriever._fuse(self, rankings, self.k)
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        vector = None if self._mode == "keyword" else self.retrievers[0].vectorstore._embed_query(query)
+        return self._merge([retriever._search(query, vector) for retriever in self.retrievers], vector)
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        first = self.retrievers[0]
+        vector = None
+        if self._mode != "keyword":
+            vector = await (first.batcher.embed(first, query) if first.batcher is not None
+                            else first.vectorstore._aembed_query(query))
+        if first.batcher is not None:
+            rankings = await asyncio.gather(*(first.batcher.search(retriever, query, vector)
+                                              for retriever in self.retrievers))
+        else:
+            rankings = await asyncio.gather(*(asyncio.to_thread(retriever._search, query, vector)
+                                              for retriever in self.retrievers))
+        return await asyncio.to_thread(self._merge, rankings, vector)
@@ -0,0 +1,157 @@
+import os
+import json
+import shutil
+import struct
+import zlib
+import logging
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Every record: payload length and CRC32, then a length-prefixed JSON header and the raw vectors
+RECORD_HEADER = struct.Struct("<II")
+JSON_LENGTH = struct.Struct("<I")
+CURRENT_FILE = "CURRENT"
+
+def snapshot_path(root: Path, generation: int) -> Path:
+    return root / f"snapshot-{generation:06d}"
+
+def log_path(root: Path, generation: int) -> Path:
+    return root / f"wal-{generation:06d}.log"
+
+def fsync_path(path: Path):
+    # Directories are fsynced too, so renames and new files inside them are durable
+    fd = os.open(str(path), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def read_generation(root: Path) -> Optional[int]:
+    """
+    Generation named by the CURRENT file, or None for an index written before
+    segments existed (or no index at all).
+    """
+    try:
+        return json.loads((root / CURRENT_FILE).read_text(encoding="utf-8"))["generation"]
+    except FileNotFoundError:
+        return None
+
+def write_generation(root: Path, generation: int):
+    # The commit point of a compaction: readers see either the old or the new generation
+    tmp_path = root / f"{CURRENT_FILE}.tmp"
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump({"generation": generation}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, root / CURRENT_FILE)
+    fsync_path(root)
+
+def remove_stale(root: Path, generation: int):
+    """
+    Delete snapshots and logs of other generations (finished or abandoned compactions)
+    and the files of the pre-segment layout.
+    """
+    keep = {snapshot_path(root, generation).name, log_path(root, generation).name, CURRENT_FILE}
+    for path in root.iterdir():
+        if path.name in keep:
+            continue
+        if path.is_dir() and path.name.startswith("snapshot-"):
+            shutil.rmtree(path, ignore_errors=True)
+        elif path.is_file() and (path.name.startswith("wal-") or path.suffix in (".faiss", ".pkl", ".json", ".tmp")):
+            try:
+                path.unlink(missing_ok=True)
+            except OSError:
+                # Still open in another worker on Windows; a later load removes it
+                pass
+
+class IndexLog:
+    """
+    Append-only write-ahead log of the index changes made since the last snapshot.
+
+    A record is durable once `append` returns. A crash can only leave a torn record at
+    the end of the file; `replay` stops at the first record whose length or CRC does
+    not check out and truncates the file there so later appends start clean.
+
+    `offset` is how much of the log this process has applied. Other worker processes
+    append to the same file, and `replay` picks up from there to follow them.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.offset = 0
+        self._file = None
+
+    def append(self, operation: dict, vectors: Optional[np.ndarray] = None):
+        header = dict(operation)
+        vector_bytes = b""
+        if vectors is not None:
+            vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+            header["shape"] = list(vectors.shape)
+            vector_bytes = vectors.tobytes()
+        header_bytes = json.dumps(header).encode("utf-8")
+        payload = JSON_LENGTH.pack(len(header_bytes)) + header_bytes + vector_bytes
+
+        if self._file is None:
+            self._file = self.path.open("ab")
+        self._file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.offset = self._file.tell()
+
+    def replay(self) -> Iterator[Tuple[dict, Optional[np.ndarray]]]:
+        if not self.path.exists():
+            return
+        with self.path.open("rb") as f:
+            offset = f.seek(self.offset)
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if not header:
+                    break
+                payload = b""
+                if len(header) == RECORD_HEADER.size:
+                    length, checksum = RECORD_HEADER.unpack(header)
+                    payload = f.read(length)
+                if not payload or len(payload) < length or zlib.crc32(payload) != checksum:
+                    logger.warning(f"Discarding torn index log tail at byte {offset} of {self.path.name}")
+                    self._truncate(offset)
+                    break
+
+                json_length = JSON_LENGTH.unpack_from(payload)[0]
+                operation = json.loads(payload[JSON_LENGTH.size:JSON_LENGTH.size + json_length])
+                vectors = None
+                if "shape" in operation:
+                    vectors = np.frombuffer(payload[JSON_LENGTH.size + json_length:],
+                                            dtype=np.float32).reshape(operation.pop("shape"))
+                yield operation, vectors
+                # Only counted as applied once the caller asks for the next record
+                offset = self.offset = f.tell()
+
+    def _truncate(self, offset: int):
+        with self.path.open("r+b") as f:
+            f.truncate(offset)
+            os.fsync(f.fileno())
+
+    def size(self) -> int:
+        try:
+            return self.path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def behind(self) -> bool:
+        # Another process appended records this one has not applied yet
+        return self.size() != self.offset
+
+    def create(self):
+        # An empty, durable log for a new generation, in place before CURRENT names it
+        with self.path.open("wb") as f:
+            os.fsync(f.fileno())
+        fsync_path(self.path.parent)
+        self.offset = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
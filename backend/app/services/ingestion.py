@@ -0,0 +1,248 @@
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from app.config import INGESTION_WORKERS, EXTRACTION_WORKERS, INGESTION_JOB_HISTORY, ALLOWED_FILE_TYPES
+from app.services import manifest
+from app.services.document_processor import DocumentProcessor
+from app.services.vector_store import VectorStoreManager, DEFAULT_COLLECTION, collection_document_path
+
+logger = logging.getLogger(__name__)
+
+class IngestionJob:
+    STAGES = ("queued", "extracting", "embedding", "indexing", "done")
+
+    def __init__(self, filenames: List[str], collection: str = DEFAULT_COLLECTION):
+        self.id = uuid.uuid4().hex
+        self.filenames = filenames
+        self.collection = collection
+        self.failed_files: Dict[str, str] = {}
+        # Files whose content is already indexed as is
+        self.skipped_files: List[str] = []
+        self.stage = "queued"
+        self.progress = 0.0
+        self.error: Optional[str] = None
+        self.chunks = 0
+        self.timings = {}
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._stage_started = time.perf_counter()
+
+    def enter(self, stage: str):
+        now = time.perf_counter()
+        self.timings[self.stage] = round(now - self._stage_started, 4)
+        self._stage_started = now
+        self.stage = stage
+        self.progress = self.STAGES.index(stage) / (len(self.STAGES) - 1)
+
+    def fail(self, error: str):
+        now = time.perf_counter()
+        self.timings[self.stage] = round(now - self._stage_started, 4)
+        self.stage = "failed"
+        self.error = error
+        self.finished_at = time.time()
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "filenames": self.filenames,
+            "collection": self.collection,
+            "failed_files": self.failed_files,
+            "skipped_files": self.skipped_files,
+            "stage": self.stage,
+            "progress": round(self.progress, 3),
+            "chunks": self.chunks,
+            "timings": self.timings,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+class IngestionManager:
+    """
+    Runs uploads through extraction, chunking, embedding and indexing off the request path.
+
+    Files are hashed first: one whose content, extractor and embedding model match
+    its manifest entry is skipped, and a changed one replaces its own chunks.
+
+    Each job runs on a small thread pool; the CPU-bound extraction, which streams each
+    document page by page into the chunker, is fanned out over a process pool by
+    page range, sheet and file (EXTRACTION_WORKERS=0 keeps it in the job thread).
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._jobs = OrderedDict()
+            cls._instance._lock = threading.Lock()
+            cls._instance._executor = ThreadPoolExecutor(
+                max_workers=INGESTION_WORKERS, thread_name_prefix="ingestion"
+            )
+            cls._instance.extraction_pool = (
+                ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS) if EXTRACTION_WORKERS > 0 else None
+            )
+        return cls._instance
+
+    def submit(self, file_path: str, filename: str, fingerprint: Optional[dict] = None,
+               collection: str = DEFAULT_COLLECTION) -> IngestionJob:
+        return self.submit_batch([(file_path, filename)], {filename: fingerprint} if fingerprint else None,
+                                 collection)
+
+    def submit_batch(self, files: List[Tuple[str, str]], fingerprints: Optional[Dict[str, dict]] = None,
+                     collection: str = DEFAULT_COLLECTION) -> IngestionJob:
+        """
+        A batch is one job: files are extracted in parallel and committed to
+        `collection` with a single index save. `fingerprints` are the
+        manifest.fingerprint of files hashed while they were uploaded, so they need
+        not be read again.
+        """
+        job = IngestionJob([filename for _, filename in files], collection)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, files, fingerprints or {})
+        logger.info(f"Queued ingestion job {job.id} for {len(files)} file(s)")
+        return job
+
+    def get_job(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self):
+        # Forget the oldest finished jobs once the history is full
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(0, len(self._jobs) - INGESTION_JOB_HISTORY)]:
+            del self._jobs[job_id]
+
+    def _changed_files(self, job: IngestionJob, files: List[Tuple[str, str]], fingerprints: Dict[str, dict],
+                       vector_manager: VectorStoreManager) -> Tuple[List[Tuple[str, str]], Dict[str, dict]]:
+        changed, entries, touched = [], {}, {}
+        for file_path, filename in files:
+            try:
+                file_fingerprint = fingerprints.get(filename)
+                if file_fingerprint is None or not manifest.looks_current(file_fingerprint, Path(file_path),
+                                                                          settings=False):
+                    # Not hashed on upload, or rewritten since
+                    file_fingerprint = manifest.fingerprint(Path(file_path))
+            except OSError as e:
+                job.failed_files[filename] = f"Could not read {filename}: {str(e)}"
+                continue
+            entry = vector_manager.manifest_entry(filename)
+            if manifest.is_current(entry, file_fingerprint):
+                job.skipped_files.append(filename)
+                if (entry["size"], entry["mtime_ns"]) != (file_fingerprint["size"], file_fingerprint["mtime_ns"]):
+                    # Same bytes rewritten: remember the new mtime so reconciling need not hash it again
+                    touched[filename] = {**entry, **file_fingerprint}
+                continue
+            changed.append((file_path, filename))
+            entries[filename] = manifest.new_entry(file_fingerprint)
+        if touched:
+            vector_manager.update_manifest(touched)
+        return changed, entries
+
+    def _extract_all(self, job: IngestionJob, files: List[Tuple[str, str]]) -> Tuple[List[str], List[dict]]:
+        chunks, metadatas = [], []
+        for filename, file_chunks, error in DocumentProcessor.extract_parallel(files, self.extraction_pool):
+            if error is not None:
+                job.failed_files[filename] = error
+                continue
+            if not file_chunks:
+                job.failed_files[filename] = "No text could be extracted from the document"
+                continue
+            file_metadata = {"filename": filename, "file_type": DocumentProcessor.file_type(filename),
+                             "uploaded_at": job.created_at}
+            for chunk, locator in file_chunks:
+                chunks.append(chunk)
+                # Locator keys say where in the file the chunk starts: page, slide, sheet and row, or paragraph
+                metadatas.append({**file_metadata, **locator})
+        return chunks, metadatas
+
+    def _run(self, job: IngestionJob, files: List[Tuple[str, str]], fingerprints: Dict[str, dict]):
+        vector_manager = VectorStoreManager(job.collection)
+        try:
+            job.enter("extracting")
+            changed, entries = self._changed_files(job, files, fingerprints, vector_manager)
+            if job.skipped_files:
+                logger.info(f"Ingestion job {job.id} skipped unchanged file(s): {job.skipped_files}")
+            if not changed and not job.failed_files:
+                job.enter("done")
+                job.finished_at = time.time()
+                return
+            chunks, metadatas = self._extract_all(job, changed)
+            if not chunks:
+                raise ValueError("; ".join(f"{name}: {error}" for name, error in job.failed_files.items()))
+            job.chunks = len(chunks)
+
+            job.enter("embedding")
+            embedding_start = job.progress
+            embedding_share = 1 / (len(IngestionJob.STAGES) - 1)
+
+            def on_batch(done: int, total: int):
+                job.progress = embedding_start + embedding_share * done / total
+
+            vectors = vector_manager.embed_chunks(chunks, progress=on_batch)
+
+            job.enter("indexing")
+            vector_manager.add_embeddings(chunks, vectors, metadatas,
+                                          {name: entry for name, entry in entries.items() if name not in job.failed_files})
+
+            job.enter("done")
+            job.finished_at = time.time()
+            logger.info(f"Ingestion job {job.id} for {len(files)} file(s) finished: {job.timings}")
+        except Exception as e:
+            job.fail(str(e))
+            logger.error(f"Ingestion job {job.id} failed: {str(e)}")
+
+    def reconcile(self, collection: str = DEFAULT_COLLECTION) -> Optional[IngestionJob]:
+        """
+        Bring a collection's index in line with its stored files, e.g. after a crash
+        or a bulk copy.
+
+        Stored files that are new, or whose size or mtime differ from their manifest
+        entry, are queued as one job, which hashes them and skips the ones whose
+        content turns out unchanged. Chunks of files no longer stored are removed.
+        """
+        try:
+            vector_manager = VectorStoreManager(collection)
+            indexed = vector_manager.manifest()
+            allowed_extensions = set(ALLOWED_FILE_TYPES.values())
+            directory = collection_document_path(collection)
+            stored = {
+                path.name: path for path in (directory.iterdir() if directory.is_dir() else ())
+                if path.is_file() and not path.name.startswith(".")
+                and path.suffix.lower() in allowed_extensions
+            }
+            for filename in sorted(indexed.keys() - stored.keys()):
+                logger.info(f"Reconcile {collection}: {filename} is no longer stored, removing its embeddings")
+                vector_manager.remove_from_index({"filename": filename})
+
+            pending = [(str(path), filename) for filename, path in sorted(stored.items())
+                       if not manifest.looks_current(indexed.get(filename), path)]
+            logger.info(f"Reconcile {collection}: {len(stored) - len(pending)} stored file(s) up to date, "
+                        f"{len(pending)} to check")
+            return self.submit_batch(pending, collection=collection) if pending else None
+        except Exception as e:
+            logger.error(f"Error reconciling stored documents of {collection} with the index: {str(e)}")
+            raise
+
+    def reconcile_all(self) -> List[IngestionJob]:
+        # Every collection in turn; one failing does not keep the others from being reconciled
+        jobs = []
+        for collection in VectorStoreManager.collections():
+            try:
+                job = self.reconcile(collection)
+            except Exception:
+                continue
+            if job is not None:
+                jobs.append(job)
+        return jobs
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self.extraction_pool is not None:
+            self.extraction_pool.shutdown(wait=False, cancel_futures=True)
@@ -1,23 +1,60 @@
-from langchain_openai import ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI
+import re
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
 from langchain.prompts import ChatPromptTemplate
-from app.config import OPENAI_API_KEY,GOOGLE_API_KEY,GOOGLE_MODEL
+from app.config import (GOOGLE_API_KEY, GOOGLE_MODEL, GOOGLE_FAST_MODEL, LLM_MAX_CONCURRENCY,
+                        LLM_ROUTING, LLM_ROUTE_QUESTION_TOKENS, LLM_ROUTE_CONTEXT_TOKENS, LLM_TIMEOUT_SECONDS,
+                        LLM_HEDGE_ENABLED, LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_SAMPLES, LLM_LATENCY_WINDOW)
+from app.services.document_processor import DocumentProcessor
+from app.services import metrics
+
+FAST = "fast"
+REASONING = "reasoning"
+# Questions asking for analysis rather than a lookup
+REASONING_PATTERN = re.compile(
+    r"\b(why|explain|compare|comparison|differences?|differ|versus|vs|analy[sz]e|analysis|evaluate|"
+    r"implications?|trade-?offs?|pros|cons|calculate|estimate|trend|summari[sz]e|step[- ]by[- ]step)\b",
+    re.IGNORECASE
+)
+
+class LLMTimeout(TimeoutError):
+    pass
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
 
 class LLMManager:
+    """
+    Answers with one of two models: the fast GOOGLE_FAST_MODEL for lookups and the
+    thinking GOOGLE_MODEL for questions that need reasoning or a long context (see
+    `route`).
+
+    Every answer has a deadline of `timeout` seconds. With `hedge` on, a call still
+    running after the LLM_HEDGE_PERCENTILE latency of its model's recent calls gets
+    a second call to the fast model; whichever answers first (for a stream, sends
+    its first token first) is used and the other is cancelled.
+    """
+
     def __init__(self):
-        """self.llm = ChatOpenAI(
-            api_key=OPENAI_API_KEY,
-            model_name="gpt-4o-mini",
-            temperature=0.3
-        )"""
-        self.llm = ChatGoogleGenerativeAI(
-            model=GOOGLE_MODEL, #"gemini-2.0-flash-thinking-exp-01-21", #"gemini-2.0-flash",
-            temperature=0,
-            max_tokens=None,
-            timeout=None,
-            max_retries=2,
-            # other params...
-        )
+        # The clients are built on first use so importing the routers stays cheap
+        self.llm = None
+        self.fast_llm = None
+        self.routing = LLM_ROUTING
+        self.timeout = LLM_TIMEOUT_SECONDS
+        self.hedge = LLM_HEDGE_ENABLED
+        self.max_concurrency = LLM_MAX_CONCURRENCY
+        self._semaphore = None
+        self._semaphore_loop = None
+        self._stats_lock = threading.Lock()
+        self._calls = 0
+        self._prompt_tokens = 0
+        self._seconds = 0.0
+        # Recent latencies of successful calls per route, of whole answers and of first streamed tokens
+        self._latencies: Dict[Tuple[str, str], deque] = {}
         self.prompt_template = ChatPromptTemplate.from_template("""
         You are a knowledgeable assistant skilled in extracting and synthesizing information from diverse document types such as PDFs, Word documents, Excel sheets, and PowerPoint presentations.
         Context:
@@ -26,16 +63,217 @@ class LLMManager:
         {question}
         Instructions:
         - Use only the information provided in the context to answer the question.
-        - Clearly reference or mention the source document type if applicable (e.g., "According to the PDF content..." or "Based on the Excel data...").
+        - Each context snippet starts with a number and its source, e.g. "[2] report.pdf, page 4". Cite the snippets you use by their number in square brackets, e.g. [2].
         - Provide a clear, concise, and well-reasoned answer.
         - If the context does not contain sufficient information to answer the question, state that explicitly.
 
         Answer:
         """)
 
-    def generate_response(self, context: str, question: str) -> str:
-        formatted_prompt = self.prompt_template.format(
+    def _client(self, route: str = REASONING):
+        if route == FAST:
+            if self.fast_llm is None:
+                self.fast_llm = self._build(GOOGLE_FAST_MODEL)
+            return self.fast_llm
+        if self.llm is None:
+            self.llm = self._build(GOOGLE_MODEL)
+        return self.llm
+
+    def _build(self, model: str):
+        # Imported here: the provider SDKs alone take about a second to import
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        return ChatGoogleGenerativeAI(
+            model=model,
+            temperature=0,
+            max_tokens=None,
+            # Backs up the deadline enforced around every call
+            timeout=self.timeout,
+            max_retries=2,
+            # other params...
+        )
+
+    def route(self, context: str, question: str) -> str:
+        """
+        FAST or REASONING. Questions asking why, to compare, explain or calculate,
+        long questions and long contexts go to the reasoning model; plain lookups
+        to the fast one.
+        """
+        if self.routing in (FAST, REASONING):
+            return self.routing
+        if (REASONING_PATTERN.search(question)
+                or DocumentProcessor.count_tokens(question) > LLM_ROUTE_QUESTION_TOKENS
+                or DocumentProcessor.count_tokens(context) > LLM_ROUTE_CONTEXT_TOKENS):
+            return REASONING
+        return FAST
+
+    def _format_prompt(self, context: str, question: str) -> str:
+        return self.prompt_template.format(
             context=context,
             question=question
         )
-        return self.llm.invoke(formatted_prompt).content
\ No newline at end of file
+
+    def prompt_tokens(self, context: str, question: str) -> int:
+        # The chunker's estimate, applied to the whole prompt including the template
+        return DocumentProcessor.count_tokens(self._format_prompt(context, question))
+
+    def record(self, prompt_tokens: int, seconds: float):
+        with self._stats_lock:
+            self._calls += 1
+            self._prompt_tokens += prompt_tokens
+            self._seconds += seconds
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            calls = self._calls
+            stats = {
+                "calls": calls,
+                "avg_prompt_tokens": round(self._prompt_tokens / calls, 1) if calls else 0.0,
+                "avg_latency_seconds": round(self._seconds / calls, 3) if calls else 0.0,
+            }
+            recent = {route: list(self._latencies.get((route, "answer"), ())) for route in (FAST, REASONING)}
+        stats["routes"] = {
+            route: {
+                "recent_calls": len(samples),
+                "p50_seconds": round(percentile(samples, 0.5), 3) if samples else None,
+                "p99_seconds": round(percentile(samples, 0.99), 3) if samples else None,
+                "hedge_after_seconds": self.hedge_delay(route),
+            }
+            for route, samples in recent.items()
+        }
+        return stats
+
+    def _observe(self, route: str, kind: str, seconds: float):
+        with self._stats_lock:
+            window = self._latencies.get((route, kind))
+            if window is None:
+                window = self._latencies[(route, kind)] = deque(maxlen=LLM_LATENCY_WINDOW)
+            window.append(seconds)
+
+    def hedge_delay(self, route: str, kind: str = "answer") -> Optional[float]:
+        # None until the route has enough recent calls for the percentile to mean something
+        if not self.hedge:
+            return None
+        with self._stats_lock:
+            samples = list(self._latencies.get((route, kind), ()))
+        if len(samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return round(percentile(samples, LLM_HEDGE_PERCENTILE), 3)
+
+    def _limiter(self) -> asyncio.Semaphore:
+        # asyncio primitives belong to one event loop; recreate the limiter if the loop changed
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def _race(self, route: str, call: Callable[[str], Awaitable], deadline: float, kind: str = "answer",
+                    discard: Optional[Callable[[object], Awaitable]] = None) -> Tuple[str, object]:
+        """
+        Await call(route) until `deadline` (event loop time), adding call(FAST) once
+        the first has taken longer than the route's hedge delay. Returns the route and
+        result of the first call to succeed and cancels the other; `discard` releases
+        the result of a call that finished but lost.
+        """
+        loop = asyncio.get_running_loop()
+        delay = self.hedge_delay(route, kind)
+        hedge_at = None if delay is None else loop.time() + delay
+        pending = {asyncio.ensure_future(call(route)): route}
+        winner, error, outcome = None, None, "cancelled"
+        try:
+            while pending and winner is None:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    outcome = "timeout"
+                    raise LLMTimeout(f"The LLM did not answer within {self.timeout:g} seconds")
+                wait = remaining if hedge_at is None else min(remaining, max(0.0, hedge_at - loop.time()))
+                done, _ = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                if not done and hedge_at is not None and loop.time() >= hedge_at:
+                    hedge_at = None
+                    metrics.LLM_HEDGES.inc(route=route)
+                    pending[asyncio.ensure_future(call(FAST))] = FAST
+                for task in done:
+                    task_route = pending.pop(task)
+                    if task.exception() is not None:
+                        error = task.exception()
+                        metrics.LLM_REQUESTS.inc(route=task_route, outcome="error")
+                    elif winner is None:
+                        winner = (task_route, task.result())
+                        metrics.LLM_REQUESTS.inc(route=task_route, outcome="won")
+                    else:
+                        # Both finished in the same instant; the second result is not used
+                        metrics.LLM_REQUESTS.inc(route=task_route, outcome="lost")
+                        if discard is not None:
+                            await discard(task.result())
+            if winner is None:
+                raise error
+            outcome = "lost"
+            return winner
+        finally:
+            for task in pending:
+                task.cancel()
+            for task_route, result in zip(pending.values(),
+                                          await asyncio.gather(*pending, return_exceptions=True)):
+                metrics.LLM_REQUESTS.inc(route=task_route, outcome=outcome)
+                if discard is not None and not isinstance(result, BaseException):
+                    await discard(result)
+
+    async def _answer(self, route: str, prompt: str) -> str:
+        async with self._limiter():
+            start = time.perf_counter()
+            response = await self._client(route).ainvoke(prompt)
+        self._observe(route, "answer", time.perf_counter() - start)
+        return response.content
+
+    async def _stream(self, route: str, prompt: str) -> AsyncIterator[str]:
+        async with self._limiter():
+            async for chunk in self._client(route).astream(prompt):
+                if chunk.content:
+                    yield chunk.content
+
+    async def _first_token(self, route: str, prompt: str):
+        # Opens a stream and waits for its first token; the stream is returned to be read on
+        stream = self._stream(route, prompt)
+        start = time.perf_counter()
+        try:
+            token = await stream.__anext__()
+        except StopAsyncIteration:
+            token = None
+        except BaseException:
+            await stream.aclose()
+            raise
+        self._observe(route, "first_token", time.perf_counter() - start)
+        return stream, token
+
+    def generate_response(self, context: str, question: str) -> str:
+        return self._client(self.route(context, question)).invoke(self._format_prompt(context, question)).content
+
+    async def agenerate_response(self, context: str, question: str) -> str:
+        prompt = self._format_prompt(context, question)
+        deadline = asyncio.get_running_loop().time() + self.timeout
+        _, answer = await self._race(self.route(context, question), lambda route: self._answer(route, prompt),
+                                     deadline)
+        return answer
+
+    async def astream_response(self, context: str, question: str) -> AsyncIterator[str]:
+        prompt = self._format_prompt(context, question)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        start = time.perf_counter()
+        # Hedged on the first token: once one stream has started answering, it is read to the end
+        route, (stream, token) = await self._race(
+            self.route(context, question), lambda route: self._first_token(route, prompt), deadline,
+            "first_token", lambda result: result[0].aclose()
+        )
+        try:
+            while token is not None:
+                yield token
+                try:
+                    token = await asyncio.wait_for(stream.__anext__(), max(0.0, deadline - loop.time()))
+                except StopAsyncIteration:
+                    token = None
+                except asyncio.TimeoutError:
+                    raise LLMTimeout(f"The LLM did not finish its answer within {self.timeout:g} seconds")
+            self._observe(route, "answer", time.perf_counter() - start)
+        finally:
+            await stream.aclose()
@@ -0,0 +1,57 @@
+import os
+import time
+import hashlib
+from pathlib import Path
+from typing import Any, Dict, Optional
+from app.config import GOOGLE_EMBEDDING_MODEL, CHUNK_SIZE_TOKENS, CHUNK_OVERLAP_TOKENS
+
+MANIFEST_FILE = "manifest.json"
+# Bump whenever extraction or chunking changes what a file turns into, so reconciling re-indexes every file
+EXTRACTOR_VERSION = 1
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def extractor_version() -> str:
+    # Chunking settings change the chunks as much as the code does
+    return f"{EXTRACTOR_VERSION}:{CHUNK_SIZE_TOKENS}:{CHUNK_OVERLAP_TOKENS}"
+
+def fingerprint(path: Path) -> Dict[str, Any]:
+    """
+    sha256, size and modification time of a stored document, read in blocks so
+    large files are never held in memory.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return {"sha256": digest.hexdigest(), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def new_entry(file_fingerprint: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        **file_fingerprint,
+        "extractor_version": extractor_version(),
+        "embedding_model": GOOGLE_EMBEDDING_MODEL,
+        "indexed_at": time.time(),
+    }
+
+def _settings_current(entry: Dict[str, Any]) -> bool:
+    return (entry.get("extractor_version") == extractor_version()
+            and entry.get("embedding_model") == GOOGLE_EMBEDDING_MODEL)
+
+def is_current(entry: Optional[Dict[str, Any]], file_fingerprint: Dict[str, Any]) -> bool:
+    # Indexed from the same bytes, with the extractor and embedding model in use now
+    return entry is not None and entry["sha256"] == file_fingerprint["sha256"] and _settings_current(entry)
+
+def looks_current(entry: Optional[Dict[str, Any]], path: Path, settings: bool = True) -> bool:
+    """
+    Cheap check from size and modification time alone, the way rsync skips files;
+    with `settings` the entry must also be from the current extractor and embedding
+    model. A False only means the file has to be hashed to find out.
+    """
+    if entry is None or (settings and not _settings_current(entry)):
+        return False
+    try:
+        stat = path.stat()
+    except OSError:
+        return False
+    return stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime_ns"]
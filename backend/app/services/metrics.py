@@ -0,0 +1,242 @@
+import re
+import time
+import uuid
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Seconds, from a cache lookup up to a long LLM answer or a large upload
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+# Accepted from the client as is; anything else gets a fresh id so logs cannot be forged
+REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9._:-]{1,64}")
+
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+_captured: ContextVar[Optional[List[Tuple[str, float, str]]]] = ContextVar("captured_stages", default=None)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    # Empty label values mean the same as an absent label, so they are left out
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values) if value]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(str(labels.get(name, "")) for name in self.labels), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_number(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: observations per bucket (the last one is +Inf), their sum and count
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bucket] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels: str) -> int:
+        series = self._series.get(tuple(str(labels.get(name, "")) for name in self.labels))
+        return series[2] if series else 0
+
+    def total(self, **labels: str) -> float:
+        series = self._series.get(tuple(str(labels.get(name, "")) for name in self.labels))
+        return series[1] if series else 0.0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (buckets, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, observed in zip(self.buckets + (float("inf"),), buckets):
+                    cumulative += observed
+                    le = "+Inf" if bound == float("inf") else _format_number(bound)
+                    labels = _format_labels(self.labels, key, f'le="{le}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_number(total)}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+class MetricsRegistry:
+    """
+    The metrics this worker process exposes on /metrics, in the Prometheus text
+    format. Each worker counts only its own requests and jobs.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "docbot_stage_seconds", "Time spent in each processing stage; format is the file type where it matters",
+    ("stage", "format"))
+STAGE_ERRORS = REGISTRY.counter("docbot_stage_errors_total", "Stages that raised an exception", ("stage",))
+EMBEDDING_BATCH_SIZE = REGISTRY.histogram(
+    "docbot_embedding_batch_size", "Texts per embedding request", ("kind",), SIZE_BUCKETS)
+LLM_REQUESTS = REGISTRY.counter(
+    "docbot_llm_requests_total", "LLM calls per model route by outcome: won, lost to a hedge, error or timeout",
+    ("route", "outcome"))
+LLM_HEDGES = REGISTRY.counter("docbot_llm_hedges_total", "Second calls made to the fast model", ("route",))
+ANSWER_CACHE_HITS = REGISTRY.counter(
+    "docbot_answer_cache_hits_total", "Chat answers served from the answer cache", ("match",))
+ANSWER_CACHE_MISSES = REGISTRY.counter("docbot_answer_cache_misses_total", "Chat answers the cache did not have")
+ANSWER_CACHE_SAVED_SECONDS = REGISTRY.counter(
+    "docbot_answer_cache_saved_seconds_total", "LLM time the cached answers took when they were generated")
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "docbot_http_request_seconds", "HTTP request duration, streamed bodies included", ("method", "route", "status"))
+
+def record(stage: str, seconds: float, format: str = ""):
+    """
+    Record a stage that took `seconds`. Stages run while serving a request are also
+    added to that request's timings.
+    """
+    captured = _captured.get()
+    if captured is not None:
+        captured.append((stage, seconds, format))
+        return
+    STAGE_SECONDS.observe(seconds, stage=stage, format=format)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+@contextmanager
+def timed(stage: str, format: str = ""):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        record(stage, time.perf_counter() - start, format)
+
+@contextmanager
+def captured_stages():
+    """
+    Collect the stages recorded inside the block instead of recording them, for
+    worker processes whose own metrics nobody scrapes; `replay` records them in the
+    parent.
+    """
+    stages = []
+    token = _captured.set(stages)
+    try:
+        yield stages
+    finally:
+        _captured.reset(token)
+
+def replay(stages: List[Tuple[str, float, str]]):
+    for stage, seconds, format in stages:
+        record(stage, seconds, format)
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+def server_timing(timings: Dict[str, float], total: float) -> str:
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+class RequestMetricsMiddleware:
+    """
+    Gives every HTTP request an id (the client's X-Request-ID when it sends a usable
+    one), times it, and adds X-Request-ID and Server-Timing headers with the stages
+    finished before the response started. One log line per request carries the id,
+    status, duration and every stage timing, including those of a streamed body.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = dict(scope.get("headers") or []).get(b"x-request-id", b"").decode("latin-1")
+        if not REQUEST_ID_PATTERN.fullmatch(request_id):
+            request_id = uuid.uuid4().hex
+        timings: Dict[str, float] = {}
+        id_token, timings_token = _request_id.set(request_id), _request_timings.set(timings)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_headers(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-request-id", request_id.encode("latin-1")))
+                headers.append((b"server-timing", server_timing(timings, time.perf_counter() - start).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            elapsed = time.perf_counter() - start
+            # The route template, not the path, so file names do not each become a series
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.observe(elapsed, method=scope["method"], route=route, status=str(status))
+            if route != "/metrics":
+                stages = " ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in timings.items())
+                logger.info(f"request_id={request_id} {scope['method']} {scope['path']} {status} "
+                            f"{elapsed * 1000:.1f}ms {stages}".rstrip())
+            _request_id.reset(id_token)
+            _request_timings.reset(timings_token)
@@ -0,0 +1,129 @@
+import asyncio
+import contextvars
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from app.services.embedding_cache import embed_queries
+from app.services.hybrid_search import HybridRetriever
+
+class MicroBatcher:
+    """
+    Collects items submitted concurrently on one event loop and hands them to
+    `handler` as a list, once `max_size` items are waiting or `max_wait_ms` after
+    the first one arrived, whichever comes first. Each caller gets its own result;
+    an exception from the handler is raised in every caller of that batch.
+    """
+
+    def __init__(self, handler: Callable[[List[Any]], Awaitable[List[Any]]], max_size: int, max_wait_ms: float):
+        self.handler = handler
+        self.max_size = max(1, max_size)
+        self.max_wait_ms = max_wait_ms
+        self.batches = 0
+        self.items = 0
+        self._pending = []
+        self._timer = None
+        self._loop = None
+        self._running = set()
+
+    async def submit(self, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Futures belong to one event loop; start over if the loop changed
+            self._pending, self._timer, self._loop = [], None, loop
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_ms / 1000, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            # A batch serves many requests, so it runs outside the context of the one that started it
+            task = contextvars.Context().run(asyncio.ensure_future, self._run(batch))
+            # The loop only keeps weak references to tasks
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch):
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            results = await self.handler([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+        }
+
+class QueryBatcher:
+    """
+    Micro-batches chat retrievals: questions arriving within a few milliseconds of
+    each other are embedded in one request, then searched together with
+    HybridRetriever.search_batch, one faiss search over all their vectors per
+    collection, with the collections searched concurrently.
+    """
+
+    def __init__(self, max_size: int, max_wait_ms: float):
+        self._embedder = MicroBatcher(self._embed, max_size, max_wait_ms)
+        self._searcher = MicroBatcher(self._search, max_size, max_wait_ms)
+
+    async def retrieve(self, retriever, query: str):
+        vector = None if retriever.mode == "keyword" else await self.embed(retriever, query)
+        return await self.search(retriever, query, vector)
+
+    async def embed(self, retriever, query: str) -> List[float]:
+        return await self._embedder.submit((retriever.vectorstore.embedding_function, query))
+
+    async def search(self, retriever, query: str, vector: Optional[List[float]]):
+        return await self._searcher.submit((retriever, query, vector))
+
+    @staticmethod
+    async def _embed(requests) -> List[List[float]]:
+        # Requests normally share one embedding client, but group them in case they do not
+        groups: Dict[int, List[int]] = {}
+        for i, (embeddings, _) in enumerate(requests):
+            groups.setdefault(id(embeddings), []).append(i)
+        vectors: List[Optional[List[float]]] = [None] * len(requests)
+        for indexes in groups.values():
+            embeddings = requests[indexes[0]][0]
+            # The same question asked of several collections is embedded once
+            texts = list(dict.fromkeys(requests[i][1] for i in indexes))
+            by_text = dict(zip(texts, await asyncio.to_thread(embed_queries, embeddings, texts)))
+            for i in indexes:
+                vectors[i] = by_text[requests[i][1]]
+        return vectors
+
+    @staticmethod
+    async def _search(requests):
+        groups: Dict[int, List[int]] = {}
+        for i, (retriever, _, _) in enumerate(requests):
+            groups.setdefault(id(retriever.vectorstore), []).append(i)
+        if len(groups) == 1:
+            return await asyncio.to_thread(HybridRetriever.search_batch, requests)
+        # Each collection is searched on its own thread; faiss releases the GIL while it scans
+        parts = await asyncio.gather(*(
+            asyncio.to_thread(HybridRetriever.search_batch, [requests[i] for i in indexes])
+            for indexes in groups.values()
+        ))
+        results = [None] * len(requests)
+        for indexes, part in zip(groups.values(), parts):
+            for i, result in zip(indexes, part):
+                results[i] = result
+        return results
+
+    def stats(self) -> dict:
+        return {"embedding": self._embedder.stats(), "search": self._searcher.stats()}
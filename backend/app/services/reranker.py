@@ -0,0 +1,118 @@
+import time
+import logging
+from typing import List, Optional, Sequence
+import numpy as np
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+class CrossEncoderScorer:
+    """
+    Local cross-encoder relevance model from sentence-transformers, loaded on first use
+    so the package is only needed when RERANK_CROSS_ENCODER is set.
+    """
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self._model = None
+
+    def score(self, query: str, texts: Sequence[str]) -> List[float]:
+        if self._model is None:
+            from sentence_transformers import CrossEncoder
+            self._model = CrossEncoder(self.model_name)
+        return [float(score) for score in self._model.predict([(query, text) for text in texts])]
+
+class Reranker:
+    """
+    Picks the chunks for the prompt from an over-fetched candidate list.
+
+    Relevance is the optional scorer's score (any object with `score(query, texts)`),
+    or else the cosine similarity between the query vector and the vectors already
+    stored for each chunk, so nothing is embedded again, or else the retrieval order.
+    Given BM25 `keyword_scores` as well (hybrid mode), a chunk's relevance is the
+    larger of its cosine and its share of the best BM25 score on the cosine scale,
+    so exact-term matches with weak embeddings are not lost.
+    Maximal marginal relevance then picks one chunk at a time by
+    lambda_mult * relevance - (1 - lambda_mult) * its highest similarity to a chunk
+    already picked. Chunks below `min_relevance` times the best relevance (only when
+    relevance is a real score, not the retrieval order; the best chunk always stays),
+    and chunks at least `duplicate_similarity` alike to a picked one, are never
+    picked, so fewer than k chunks come back when the rest would only repeat or dilute them.
+
+    Once `budget_ms` has passed since reranking started, the scorer is skipped and
+    the remaining slots are filled in relevance order.
+    """
+
+    def __init__(self, fetch_k: int = 20, lambda_mult: float = 0.7, min_relevance: float = 0.5,
+                 duplicate_similarity: float = 0.95, budget_ms: float = 50, scorer=None):
+        self.fetch_k = fetch_k
+        self.lambda_mult = lambda_mult
+        self.min_relevance = min_relevance
+        self.duplicate_similarity = duplicate_similarity
+        self.budget_ms = budget_ms
+        self.scorer = scorer
+
+    @staticmethod
+    def _normalize(values: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(values, axis=-1, keepdims=True)
+        return values / np.where(norms == 0, 1, norms)
+
+    def rerank(self, query: str, query_vector: Optional[Sequence[float]], documents: List[Document],
+               vectors: np.ndarray, k: int, keyword_scores: Optional[Sequence[float]] = None) -> List[Document]:
+        """
+        `documents` in retrieval order with their stored `vectors` and, optionally,
+        their BM25 scores (0 for chunks the keyword search did not find). Without a
+        `query_vector` (keyword mode) relevance follows the retrieval order and
+        nothing is dropped for low relevance, since rank positions say nothing about it.
+        """
+        deadline = time.perf_counter() + self.budget_ms / 1000
+        if not documents:
+            return []
+
+        # Identical texts (the same file uploaded twice, repeated boilerplate) never both make it
+        first_seen = {}
+        for i, doc in enumerate(documents):
+            first_seen.setdefault(doc.page_content, i)
+        keep = sorted(first_seen.values())
+        documents, vectors = [documents[i] for i in keep], self._normalize(np.asarray(vectors, dtype=np.float32)[keep])
+        if keyword_scores is not None:
+            keyword_scores = np.asarray(keyword_scores, dtype=np.float32)[keep]
+
+        relevance = None
+        if self.scorer is not None and time.perf_counter() < deadline:
+            try:
+                scores = np.asarray(self.scorer.score(query, [doc.page_content for doc in documents]))
+                spread = scores.max() - scores.min()
+                relevance = (scores - scores.min()) / spread if spread else np.ones(len(scores))
+            except Exception as e:
+                logger.error(f"Error scoring candidates with the re-ranker: {str(e)}")
+        if relevance is None and query_vector is not None:
+            relevance = vectors @ self._normalize(np.asarray(query_vector, dtype=np.float32))
+            if keyword_scores is not None and keyword_scores.max() > 0:
+                relevance = np.maximum(relevance, keyword_scores / keyword_scores.max() * max(relevance.max(), 0))
+        if relevance is None:
+            relevance = np.linspace(1, 0, len(documents), endpoint=False)
+            candidates = set(range(len(documents)))
+        else:
+            best = relevance.max()
+            candidates = set(np.flatnonzero(relevance >= min(self.min_relevance * best, best)).tolist())
+
+        picked: List[int] = []
+        redundancy = np.full(len(documents), -np.inf)
+        while candidates and len(picked) < k:
+            if time.perf_counter() >= deadline:
+                logger.debug(f"Re-ranking budget of {self.budget_ms}ms exhausted after {len(picked)} picks")
+                remaining = sorted(candidates, key=lambda i: relevance[i], reverse=True)
+                picked.extend(remaining[:k - len(picked)])
+                break
+            order = sorted(candidates)
+            if picked:
+                scores = self.lambda_mult * relevance[order] - (1 - self.lambda_mult) * redundancy[order]
+            else:
+                scores = relevance[order]
+            best = order[int(np.argmax(scores))]
+            picked.append(best)
+            candidates.discard(best)
+            redundancy = np.maximum(redundancy, vectors @ vectors[best])
+            candidates.difference_update(np.flatnonzero(redundancy >= self.duplicate_similarity).tolist())
+        return [documents[i] for i in picked]
@@ -0,0 +1,147 @@
+import os
+import uuid
+import asyncio
+import hashlib
+import logging
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional, Tuple
+import aiofiles
+import aiofiles.os
+from app.services import metrics
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart before 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+logger = logging.getLogger(__name__)
+
+# Uploads are written under a dot name first, which listings and reconcile ignore
+TEMP_PREFIX = ".upload-"
+
+class UploadTooLarge(Exception):
+    pass
+
+class MultipartError(Exception):
+    pass
+
+async def iter_file_field(body: AsyncIterator[bytes], content_type: str, field: str
+                          ) -> AsyncIterator[Tuple[str, object]]:
+    """
+    Read one file field of a multipart/form-data body as it arrives. Yields
+    ("headers", (filename, content_type)) once the part's headers are in, then
+    ("data", bytes) for each piece of its content, so the caller can reject the
+    part or stop reading at any point. Other fields are skipped.
+    """
+    _, options = parse_options_header(content_type)
+    boundary = options.get(b"boundary")
+    if not boundary:
+        raise MultipartError("Missing multipart boundary")
+
+    events = []
+    part = {"headers": {}, "field": b"", "value": b"", "wanted": False}
+
+    def on_part_begin():
+        part.update(headers={}, field=b"", value=b"", wanted=False)
+
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"], part["value"] = b"", b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        if disposition.get(b"name", b"").decode("utf-8") != field or b"filename" not in disposition:
+            return
+        part["wanted"] = True
+        events.append(("headers", (disposition[b"filename"].decode("utf-8"),
+                                   part["headers"].get(b"content-type", b"").decode("latin-1"))))
+
+    def on_part_data(data, start, end):
+        if part["wanted"]:
+            events.append(("data", bytes(data[start:end])))
+
+    def on_part_end():
+        if part["wanted"]:
+            events.append(("end", None))
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin, "on_header_field": on_header_field,
+        "on_header_value": on_header_value, "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished, "on_part_data": on_part_data, "on_part_end": on_part_end,
+    })
+    async for chunk in body:
+        parser.write(chunk)
+        pending, events[:] = list(events), []
+        for event in pending:
+            if event[0] == "end":
+                # The rest of the body is not needed
+                return
+            yield event
+    raise MultipartError(f"Missing file field '{field}'")
+
+async def write_temp(chunks: AsyncIterator[bytes], directory: Path, max_size: int, chunk_size: int,
+                     file_type: str = "") -> Tuple[Path, Dict[str, object]]:
+    """
+    Write `chunks` to a temporary file in `directory`, hashing them on the way and
+    giving up with UploadTooLarge as soon as more than `max_size` bytes arrived.
+    At most `chunk_size` bytes are held before they are written. Returns the temp
+    path and the content's fingerprint (sha256 and size); the time taken is
+    recorded as the upload_save stage of `file_type`.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    temp_path = directory / f"{TEMP_PREFIX}{uuid.uuid4().hex}.tmp"
+    digest = hashlib.sha256()
+    size = 0
+    buffer = bytearray()
+    try:
+        with metrics.timed("upload_save", file_type):
+            async with aiofiles.open(temp_path, "wb") as f:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > max_size:
+                        raise UploadTooLarge()
+                    digest.update(chunk)
+                    buffer += chunk
+                    if len(buffer) >= chunk_size:
+                        await f.write(bytes(buffer))
+                        buffer.clear()
+                if buffer:
+                    await f.write(bytes(buffer))
+                await f.flush()
+                # Durable before it is renamed into place, so a crash never leaves a truncated document
+                await asyncio.to_thread(os.fsync, f.fileno())
+    except BaseException:
+        await discard(temp_path)
+        raise
+    return temp_path, {"sha256": digest.hexdigest(), "size": size}
+
+async def commit(temp_path: Path, target: Path, fingerprint: Dict[str, object]) -> Dict[str, object]:
+    # Readers of DOCUMENT_PATH see the old file or the new one, never a partial one
+    await aiofiles.os.replace(temp_path, target)
+    stat = await aiofiles.os.stat(target)
+    return {**fingerprint, "mtime_ns": stat.st_mtime_ns}
+
+async def discard(temp_path: Optional[Path]):
+    if temp_path is None:
+        return
+    try:
+        await aiofiles.os.remove(temp_path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Could not remove temporary upload {temp_path}: {str(e)}")
+
+async def iter_upload(file, chunk_size: int) -> AsyncIterator[bytes]:
+    # An UploadFile or a zip member, read a chunk at a time off the event loop
+    read = file.read if asyncio.iscoroutinefunction(file.read) else (lambda n: asyncio.to_thread(file.read, n))
+    while True:
+        chunk = await read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
@@ -1,115 +1,586 @@
-import os
+import re
+import json
+import uuid
+import shutil
+import asyncio
 import logging
-from typing import List, Optional
-from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from app.config import FAISS_INDEX_PATH, OPENAI_API_KEY,GOOGLE_EMBEDDING_MODEL
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from app.config import (FAISS_INDEX_PATH, DOCUMENT_PATH, OPENAI_API_KEY,GOOGLE_EMBEDDING_MODEL,
+                        EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES, EMBEDDING_BATCH_SIZE,
+                        RETRIEVAL_MODE, RETRIEVAL_K, RETRIEVAL_FETCH_K, QUERY_BATCH_MAX_SIZE, QUERY_BATCH_WAIT_MS,
+                        RERANK_ENABLED, RERANK_FETCH_K, RERANK_LAMBDA, RERANK_MIN_RELEVANCE,
+                        RERANK_DUPLICATE_SIMILARITY, RERANK_BUDGET_MS, RERANK_CROSS_ENCODER,
+                        INDEX_COMPACT_MIN_BYTES, INDEX_COMPACT_RATIO)
+from app.services.embedding_cache import CachedEmbeddings
+from app.services.hybrid_search import KeywordIndex, HybridRetriever
+from app.services.ann_index import ANNVectorStore
+from app.services.docstore import DOCSTORE_FILE, SQLiteDocstore
+from app.services.reranker import CrossEncoderScorer, Reranker
+from app.services.query_batcher import QueryBatcher
+from app.services.document_processor import DocumentProcessor
+from app.services import manifest, metrics
+from app.services.manifest import MANIFEST_FILE
+from app.services.index_lock import LOCK_FILE, InterProcessLock, ReadWriteLock
+from app.services.index_log import (IndexLog, fsync_path, log_path, read_generation, remove_stale,
+                                    snapshot_path, write_generation)
 
 logger = logging.getLogger(__name__)
 
+DOC_ID_MAP_FILE = "doc_ids.json"
+KEYWORD_INDEX_FILE = "bm25.json"
+SNAPSHOT_FILES = ("index.faiss", "index.pkl", DOCSTORE_FILE, DOC_ID_MAP_FILE, KEYWORD_INDEX_FILE, MANIFEST_FILE)
+
+_embeddings = None
+
+def get_embeddings():
+    # One shared cache-backed client: unchanged chunks are never sent to the API twice
+    global _embeddings
+    if _embeddings is None:
+        # Imported on first use, like the chat client, to keep startup fast
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        _embeddings = CachedEmbeddings(
+            GoogleGenerativeAIEmbeddings(model=GOOGLE_EMBEDDING_MODEL),
+            model=GOOGLE_EMBEDDING_MODEL,
+            path=EMBEDDING_CACHE_PATH,
+            max_entries=EMBEDDING_CACHE_MAX_ENTRIES
+        )
+    return _embeddings
+
+_reranker = None
+
+def get_reranker() -> Optional[Reranker]:
+    # Shared like the embedding client, so a cross-encoder model is loaded once
+    global _reranker
+    if RERANK_ENABLED and _reranker is None:
+        _reranker = Reranker(
+            fetch_k=RERANK_FETCH_K,
+            lambda_mult=RERANK_LAMBDA,
+            min_relevance=RERANK_MIN_RELEVANCE,
+            duplicate_similarity=RERANK_DUPLICATE_SIMILARITY,
+            budget_ms=RERANK_BUDGET_MS,
+            scorer=CrossEncoderScorer(RERANK_CROSS_ENCODER) if RERANK_CROSS_ENCODER else None
+        )
+    return _reranker
+
+DEFAULT_COLLECTION = "default"
+COLLECTIONS_DIR = "collections"
+COLLECTION_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+def check_collection(name: str) -> str:
+    if not COLLECTION_PATTERN.fullmatch(name or ""):
+        raise ValueError(f"Invalid collection name: {name!r}; use up to 64 letters, digits, '-' or '_'")
+    return name
+
+def collection_document_path(name: str) -> Path:
+    # The default collection keeps the original layout; others live in a subdirectory of each root
+    check_collection(name)
+    return DOCUMENT_PATH if name == DEFAULT_COLLECTION else DOCUMENT_PATH / COLLECTIONS_DIR / name
+
 class VectorStoreManager:
-    _instance = None
+    """
+    One collection's FAISS store, its filename to docstore id map, the keyword index
+    and the manifest of the indexed files' hashes. There is one manager per
+    collection and process: VectorStoreManager() is the default collection, kept
+    directly in FAISS_INDEX_PATH, and VectorStoreManager(name) a named one, kept in
+    FAISS_INDEX_PATH/collections/<name>. Collections share nothing on disk, so a
+    write only ever locks, logs and compacts its own collection.
+
+    On disk the collection's directory holds a snapshot of all four per generation, a log of
+    the writes made since that snapshot and a CURRENT file naming the generation.
+    Writes only append to the log, so their cost does not grow with the index; once
+    the log is large enough it is compacted into the next generation's snapshot.
+
+    Nothing is read from disk until the index is first used (or preloaded by the
+    startup hook), so importing the app stays cheap however large the index is.
+
+    Several worker processes can share the directory. Writes hold the LOCK file and
+    first catch up with what other workers wrote; readers check the generation in
+    CURRENT and the log length before each query and reload or replay when another
+    worker moved them on. Within a process queries share a read lock and writes
+    take it exclusively.
+    """
+    _instances: Dict[str, "VectorStoreManager"] = {}
+    _instances_lock = threading.Lock()
+    collection = DEFAULT_COLLECTION
     _vectorstore = None
     _retriever = None
+    _doc_ids: Optional[Dict[str, List[str]]] = None
+    _keyword_index: Optional[KeywordIndex] = None
+    # Filename to sha256, size, mtime and the extractor and embedding model it was indexed with
+    _manifest: Optional[Dict[str, dict]] = None
+    _log: Optional[IndexLog] = None
+    _generation = 0
+    _snapshot_bytes = 0
+    _loaded = False
+    # Embeds and searches concurrent chat questions together, across collections
+    _batcher = QueryBatcher(QUERY_BATCH_MAX_SIZE, QUERY_BATCH_WAIT_MS) if QUERY_BATCH_MAX_SIZE > 1 else None
 
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-            cls._initialize_vectorstore()
-        return cls._instance
+    def __new__(cls, collection: str = DEFAULT_COLLECTION):
+        with cls._instances_lock:
+            instance = cls._instances.get(collection)
+            if instance is None:
+                instance = super().__new__(cls)
+                instance.collection = check_collection(collection)
+                # Queries read concurrently; ingestion jobs, deletes and reloads write exclusively
+                instance._lock = ReadWriteLock()
+                # Serialises writers across worker processes sharing the collection's directory
+                instance._file_lock = InterProcessLock()
+                cls._instances[collection] = instance
+            return instance
+
+    @property
+    def path(self) -> Path:
+        if self.collection == DEFAULT_COLLECTION:
+            return FAISS_INDEX_PATH
+        return FAISS_INDEX_PATH / COLLECTIONS_DIR / self.collection
 
     @classmethod
-    def _initialize_vectorstore(cls):
-        embeddings = GoogleGenerativeAIEmbeddings(model=GOOGLE_EMBEDDING_MODEL)
-        
+    def collections(cls) -> List[str]:
+        # The default collection, then every named one that has an index directory or stored files
+        names = set()
+        for root in (FAISS_INDEX_PATH / COLLECTIONS_DIR, DOCUMENT_PATH / COLLECTIONS_DIR):
+            if root.is_dir():
+                names.update(path.name for path in root.iterdir()
+                             if path.is_dir() and COLLECTION_PATTERN.fullmatch(path.name))
+        return [DEFAULT_COLLECTION] + sorted(names - {DEFAULT_COLLECTION})
+
+    @contextmanager
+    def _exclusive(self):
+        with self._lock.write():
+            with self._file_lock.hold(self.path / LOCK_FILE):
+                yield
+
+    def _stale(self) -> bool:
+        # Cheap enough for every query: one small read and one stat
+        if not self._loaded:
+            return True
+        return (read_generation(self.path) or 0) != self._generation or self._log.behind()
+
+    def refresh(self):
+        """
+        Load the index on first use, then follow the generations and log records
+        written by other worker processes.
+        """
+        if self._stale():
+            with self._exclusive():
+                self._sync()
+
+    async def arefresh(self):
+        # A reload can take a while; keep it off the event loop
+        if self._stale():
+            await asyncio.to_thread(self.refresh)
+
+    def _sync(self):
+        # Caller holds _exclusive()
+        if not self._loaded or (read_generation(self.path) or 0) != self._generation:
+            self._load()
+            return
+        replayed = self._replay()
+        if replayed:
+            logger.info(f"Applied {replayed} index log records written by other workers")
+            self._retriever = self._make_retriever() if self._vectorstore else None
+
+    def _replay(self) -> int:
+        replayed = 0
+        for operation, vectors in self._log.replay():
+            if operation["op"] == "add":
+                self._apply_add(operation["ids"], operation["texts"], vectors, operation["metadatas"],
+                                operation.get("replaced"), operation.get("manifest"))
+            elif operation["op"] == "manifest":
+                self._manifest.update(operation["manifest"])
+            else:
+                self._apply_delete(operation["filename"], operation["ids"])
+            replayed += 1
+        return replayed
+
+    def _load(self):
+        # Snapshot plus replayed log: every write acknowledged before a shutdown or crash
+        self._vectorstore = None
+        self._retriever = None
+        self._doc_ids = {}
+        self._keyword_index = KeywordIndex()
+        self._manifest = {}
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        generation = read_generation(self.path)
+        if generation is None:
+            # No CURRENT file: an index saved by save_local alone (or none yet) lives in the directory itself
+            self._generation, snapshot = 0, self.path
+        else:
+            self._generation, snapshot = generation, snapshot_path(self.path, generation)
+            remove_stale(self.path, generation)
+        self._log = IndexLog(log_path(self.path, self._generation))
+        self._snapshot_bytes = self._size_of(snapshot)
+
         try:
-            if not FAISS_INDEX_PATH.exists():
-                FAISS_INDEX_PATH.mkdir(parents=True, exist_ok=True)  # Ensure directory exists
-            
-            if any(FAISS_INDEX_PATH.iterdir()):
-                cls._vectorstore = FAISS.load_local(
-                    FAISS_INDEX_PATH, 
-                    embeddings,
+            if (snapshot / "index.faiss").exists():
+                self._vectorstore = ANNVectorStore.load_local(
+                    snapshot,
+                    get_embeddings(),
                     allow_dangerous_deserialization=True
                 )
-                logger.info("Loaded existing FAISS index")
+                if isinstance(self._vectorstore.docstore, SQLiteDocstore):
+                    # Still under the lock, so no compaction can have removed this snapshot yet
+                    self._vectorstore.docstore.open()
+                self._doc_ids.update(self._load_doc_ids(self._vectorstore, snapshot))
+                self._keyword_index = self._load_keyword_index(self._vectorstore, snapshot)
+                self._manifest.update(self._load_manifest(self._doc_ids, snapshot))
+                logger.info(f"Loaded existing FAISS index: {self._vectorstore.index_stats()}")
             else:
-                cls._vectorstore = None
                 logger.info("No existing FAISS index found")
+
+            replayed = self._replay()
+            if replayed:
+                logger.info(f"Replayed {replayed} index log records")
+
+            if self._vectorstore and self._vectorstore.migrate():
+                # An index built under another VECTOR_INDEX_TYPE is converted once and snapshotted
+                self._compact()
         except Exception as e:
             logger.error(f"Error loading FAISS index: {str(e)}")
-            cls._vectorstore = None
+            self._vectorstore = None
+            self._doc_ids.clear()
+            self._keyword_index.clear()
+            self._manifest.clear()
 
-        if cls._vectorstore:
-            cls._retriever = cls._vectorstore.as_retriever()
+        if self._vectorstore:
+            self._retriever = self._make_retriever()
+        self._loaded = True
 
-    def update_index(self, chunks: List[str], metadata: dict):
+    def _make_retriever(self) -> HybridRetriever:
+        return HybridRetriever(vectorstore=self._vectorstore, keyword_index=self._keyword_index, lock=self._lock,
+                               reranker=get_reranker(), batcher=self._batcher, mode=RETRIEVAL_MODE, k=RETRIEVAL_K,
+                               fetch_k=RETRIEVAL_FETCH_K)
+
+    @staticmethod
+    def _size_of(snapshot: Path) -> int:
+        return sum((snapshot / name).stat().st_size for name in SNAPSHOT_FILES if (snapshot / name).exists())
+
+    @staticmethod
+    def _load_doc_ids(vectorstore, snapshot: Path) -> Dict[str, List[str]]:
+        indexed_ids = set(vectorstore.index_to_docstore_id.values())
+        doc_id_map_path = snapshot / DOC_ID_MAP_FILE
+        if doc_id_map_path.exists():
+            try:
+                with doc_id_map_path.open("r", encoding="utf-8") as f:
+                    doc_ids = json.load(f)
+                # Snapshots from before the log could be written half-way, so check the map against the index
+                mapped_ids = [doc_id for ids in doc_ids.values() for doc_id in ids]
+                if len(mapped_ids) == len(indexed_ids) and set(mapped_ids) == indexed_ids:
+                    return doc_ids
+                logger.warning("Filename to docstore id mapping is out of step with the FAISS index")
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not read filename to docstore id mapping: {str(e)}")
+
+        # Missing or stale mapping: rebuild it from the docstore metadata
+        logger.info("Rebuilding filename to docstore id mapping from FAISS docstore")
+        doc_ids: Dict[str, List[str]] = {}
+        for doc_id in vectorstore.index_to_docstore_id.values():
+            doc = vectorstore.docstore.search(doc_id)
+            filename = getattr(doc, "metadata", {}).get("filename")
+            if filename is not None:
+                doc_ids.setdefault(filename, []).append(doc_id)
+        return doc_ids
+
+    @staticmethod
+    def _load_keyword_index(vectorstore, snapshot: Path) -> KeywordIndex:
+        indexed_ids = set(vectorstore.index_to_docstore_id.values())
+        keyword_index_path = snapshot / KEYWORD_INDEX_FILE
+        if keyword_index_path.exists():
+            try:
+                keyword_index = KeywordIndex.load(keyword_index_path)
+                if keyword_index.doc_ids() == indexed_ids:
+                    return keyword_index
+                logger.warning("Keyword index is out of step with the FAISS index")
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Could not read keyword index: {str(e)}")
+
+        # Missing or stale keyword index: rebuild it from the docstore texts
+        logger.info("Rebuilding keyword index from FAISS docstore")
+        keyword_index = KeywordIndex()
+        doc_ids = list(vectorstore.index_to_docstore_id.values())
+        keyword_index.add(doc_ids, [vectorstore.docstore.search(doc_id).page_content for doc_id in doc_ids])
+        return keyword_index
+
+    @staticmethod
+    def _load_manifest(doc_ids: Dict[str, List[str]], snapshot: Path) -> Dict[str, dict]:
+        manifest_path = snapshot / MANIFEST_FILE
+        if not manifest_path.exists():
+            # Indexed before the manifest existed: reconciling re-indexes these files once
+            return {}
+        try:
+            with manifest_path.open("r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read document manifest: {str(e)}")
+            return {}
+        # An entry only vouches for chunks that are actually indexed
+        return {filename: entry for filename, entry in entries.items() if doc_ids.get(filename)}
+
+    def compact(self):
+        with self._exclusive():
+            self._sync()
+            self._compact()
+
+    def _compact(self):
+        """
+        Snapshot the in-memory state as the next generation with an empty log.
+
+        Replacing CURRENT is the commit point: a crash before it leaves the previous
+        snapshot and log in charge, a crash after it only leaves files to clean up.
+        """
+        generation = self._generation + 1
+        snapshot = snapshot_path(self.path, generation)
+        self.path.mkdir(parents=True, exist_ok=True)
+        if snapshot.exists():
+            # Left behind by a compaction that crashed before committing
+            shutil.rmtree(snapshot)
+        snapshot.mkdir()
+        if self._vectorstore is not None:
+            self._vectorstore.save_local(snapshot)
+            # Documents now come from the new file, which frees the ones held since the last snapshot
+            self._vectorstore.docstore = SQLiteDocstore(snapshot / DOCSTORE_FILE)
+            self._vectorstore.docstore.open()
+            with (snapshot / DOC_ID_MAP_FILE).open("w", encoding="utf-8") as f:
+                json.dump(self._doc_ids, f)
+            self._keyword_index.save(snapshot / KEYWORD_INDEX_FILE)
+            with (snapshot / MANIFEST_FILE).open("w", encoding="utf-8") as f:
+                json.dump(self._manifest, f)
+        for path in snapshot.iterdir():
+            fsync_path(path)
+        fsync_path(snapshot)
+
+        log = IndexLog(log_path(self.path, generation))
+        log.create()
+        write_generation(self.path, generation)
+
+        self._log.close()
+        self._log, self._generation = log, generation
+        self._snapshot_bytes = self._size_of(snapshot)
+        remove_stale(self.path, generation)
+        logger.info(f"Compacted FAISS index into generation {generation} ({self._snapshot_bytes} bytes)")
+
+    def _compaction_due(self) -> bool:
+        # Each snapshot costs about its own size, so compacting in proportion to it keeps writes amortised O(1)
+        return self._log.size() > max(INDEX_COMPACT_MIN_BYTES, INDEX_COMPACT_RATIO * self._snapshot_bytes)
+
+    def _apply_add(self, ids: List[str], chunks: List[str], vectors, metadatas: List[dict],
+                   replaced: Optional[Dict[str, List[str]]] = None, entries: Optional[Dict[str, dict]] = None):
+        # A changed file's old chunks go in the same step its new ones come in
+        for filename, doc_ids in (replaced or {}).items():
+            self._apply_delete(filename, doc_ids)
+        if self._vectorstore is None:
+            logger.info("Creating new FAISS vector store")
+            self._vectorstore = ANNVectorStore.from_embeddings(
+                list(zip(chunks, vectors)),
+                get_embeddings(),
+                metadatas=metadatas,
+                ids=ids
+            )
+        else:
+            self._vectorstore.add_embeddings(
+                text_embeddings=list(zip(chunks, vectors)),
+                metadatas=metadatas,
+                ids=ids
+            )
+
+        for doc_id, metadata in zip(ids, metadatas):
+            filename = metadata.get("filename")
+            if filename is not None:
+                self._doc_ids.setdefault(filename, []).append(doc_id)
+        self._keyword_index.add(ids, chunks)
+        self._manifest.update(entries or {})
+
+    def _apply_delete(self, filename: str, doc_ids: List[str]):
+        indexed_ids = set(self._vectorstore.index_to_docstore_id.values()) if self._vectorstore else set()
+        doc_ids = [doc_id for doc_id in doc_ids if doc_id in indexed_ids]
+        if doc_ids and len(doc_ids) == len(indexed_ids):
+            self._vectorstore = None
+            self._doc_ids.clear()
+            self._keyword_index.clear()
+            self._manifest.clear()
+        elif doc_ids:
+            self._vectorstore.delete(doc_ids)
+            self._keyword_index.remove(doc_ids)
+        self._doc_ids.pop(filename, None)
+        self._manifest.pop(filename, None)
+
+    def embed_chunks(self, chunks: List[str], progress: Optional[Callable[[int, int], None]] = None) -> List[List[float]]:
+        # Embedding runs outside the write lock; batches keep each API request bounded
+        embeddings = get_embeddings()
+        vectors = []
+        for start in range(0, len(chunks), EMBEDDING_BATCH_SIZE):
+            batch = chunks[start:start + EMBEDDING_BATCH_SIZE]
+            metrics.EMBEDDING_BATCH_SIZE.observe(len(batch), kind="document")
+            with metrics.timed("embedding"):
+                vectors.extend(embeddings.embed_documents(batch))
+            if progress:
+                progress(len(vectors), len(chunks))
+        if hasattr(embeddings, "stats"):
+            logger.info(f"Embedding cache stats: {embeddings.stats()}")
+        return vectors
+
+    def add_embeddings(self, chunks: List[str], vectors: List[List[float]], metadatas: List[dict],
+                       entries: Optional[Dict[str, dict]] = None):
+        """
+        Index chunks. With manifest `entries` (filename to manifest.new_entry), each of
+        those files' previous chunks are replaced in the same logged step, and files
+        another worker already indexed from the same content are left alone.
+        """
         try:
             if not chunks:
                 raise ValueError("No text chunks provided for indexing")
-            
-            embeddings = GoogleGenerativeAIEmbeddings(model=GOOGLE_EMBEDDING_MODEL)
-
-            if self._vectorstore is None:
-                logger.info("Creating new FAISS vector store")
-                self._vectorstore = FAISS.from_texts(
-                    chunks, 
-                    embeddings, 
-                    metadatas=[metadata] * len(chunks)
-                )
-            else:
-                logger.info("Updating FAISS vector store")
-                self._vectorstore.add_texts(
-                    texts=chunks, 
-                    metadatas=[metadata] * len(chunks)
-                )
-            
-            # Ensure FAISS index directory exists before saving
-            FAISS_INDEX_PATH.mkdir(parents=True, exist_ok=True)
-            self._vectorstore.save_local(FAISS_INDEX_PATH)
-            self._retriever = self._vectorstore.as_retriever()
 
-            logger.info("FAISS index updated successfully")
+            with self._exclusive(), metrics.timed("index_write"):
+                # Other workers' writes come first, so the log stays in the order it is applied
+                self._sync()
+                record = {}
+                if entries:
+                    done = {filename for filename, entry in entries.items()
+                            if manifest.is_current(self._manifest.get(filename), entry)}
+                    if done:
+                        logger.info(f"Already indexed from the same content: {sorted(done)}")
+                        kept = [i for i, metadata in enumerate(metadatas) if metadata.get("filename") not in done]
+                        chunks, metadatas = [chunks[i] for i in kept], [metadatas[i] for i in kept]
+                        vectors = [vectors[i] for i in kept]
+                        entries = {filename: entry for filename, entry in entries.items() if filename not in done}
+                        if not chunks:
+                            return
+                    record["replaced"] = {filename: self._doc_ids[filename] for filename in entries
+                                          if self._doc_ids.get(filename)}
+                    record["manifest"] = entries
+
+                ids = [str(uuid.uuid4()) for _ in chunks]
+                # Logged before it is applied, so an acknowledged write survives a crash
+                self._log.append({"op": "add", "ids": ids, "texts": chunks, "metadatas": metadatas, **record},
+                                 np.asarray(vectors, dtype=np.float32))
+                self._apply_add(ids, chunks, vectors, metadatas, record.get("replaced"), record.get("manifest"))
+                # Retrains into VECTOR_INDEX_TYPE once the store is large enough; the new index is snapshotted
+                if self._vectorstore.migrate() or self._compaction_due():
+                    self._compact()
+                self._retriever = self._make_retriever()
+
+            logger.info(f"FAISS index updated successfully: {self._vectorstore.index_stats()}")
         except Exception as e:
             logger.error(f"Error updating FAISS index: {str(e)}")
             raise
 
+    async def aembed_query(self, text: str) -> List[float]:
+        # Served from the embedding client's query cache when the retriever just embedded it
+        return await get_embeddings().aembed_query(text)
+
+    def manifest_entry(self, filename: str) -> Optional[dict]:
+        self.refresh()
+        with self._lock.read():
+            entry = self._manifest.get(filename)
+            return dict(entry) if entry is not None else None
+
+    def manifest(self) -> Dict[str, dict]:
+        """
+        Every indexed file's manifest entry with its chunk ids. Files indexed before
+        the manifest existed, or without one, are listed with their chunk ids alone.
+        """
+        self.refresh()
+        with self._lock.read():
+            return {filename: {**self._manifest.get(filename, {}), "chunk_ids": list(doc_ids)}
+                    for filename, doc_ids in self._doc_ids.items()}
+
+    def update_manifest(self, entries: Dict[str, dict]):
+        # For files whose bytes are unchanged but whose size/mtime no longer match, e.g. after a copy
+        with self._exclusive():
+            self._sync()
+            entries = {filename: entry for filename, entry in entries.items() if self._doc_ids.get(filename)}
+            if entries:
+                self._log.append({"op": "manifest", "manifest": entries})
+                self._manifest.update(entries)
+
+    def update_index(self, chunks: List[str], metadata: dict):
+        if not chunks:
+            raise ValueError("No text chunks provided for indexing")
+        vectors = self.embed_chunks(chunks)
+        self.add_embeddings(chunks, vectors, [metadata] * len(chunks))
+
     def remove_from_index(self, metadata_filter: dict):
+        with self._exclusive(), metrics.timed("index_write"):
+            self._sync()
+            self._remove_from_index(metadata_filter)
+
+    def _remove_from_index(self, metadata_filter: dict):
         try:
             if not self._vectorstore:
-                raise ValueError("Vector store is not initialized")
-            print("remove")
-            doc_ids = self._vectorstore.docstore._dict.metadata#.search(metadata_filter)
-            print(doc_ids)
+                logger.warning(f"No embeddings found for filter: {metadata_filter}")
+                return
+
+            filename = metadata_filter.get("filename")
+            # Ignore ids the index no longer has so FAISS.delete cannot fail half-way
+            indexed_ids = set(self._vectorstore.index_to_docstore_id.values())
+            doc_ids = [doc_id for doc_id in self._doc_ids.get(filename, []) if doc_id in indexed_ids]
             if not doc_ids:
+                self._doc_ids.pop(filename, None)
                 logger.warning(f"No embeddings found for filter: {metadata_filter}")
                 return
-            
-            self._vectorstore.delete(doc_ids)
 
-            # Save updated FAISS index
-            FAISS_INDEX_PATH.mkdir(parents=True, exist_ok=True)
-            self._vectorstore.save_local(FAISS_INDEX_PATH)
+            if len(doc_ids) == len(self._vectorstore.index_to_docstore_id):
+                # Last document in the store: start an empty generation instead of logging the delete
+                self._clear_index()
+                logger.info(f"Removed embeddings for {metadata_filter}")
+                return
+
+            # Only the vectors belonging to this document are touched, nothing is re-embedded
+            self._log.append({"op": "delete", "filename": filename, "ids": doc_ids})
+            self._apply_delete(filename, doc_ids)
+            if self._compaction_due():
+                self._compact()
+            self._retriever = self._make_retriever()
 
-            logger.info(f"Removed embeddings for {metadata_filter}")
+            logger.info(f"Removed {len(doc_ids)} embeddings for {metadata_filter}")
         except Exception as e:
             logger.error(f"Error removing embeddings: {str(e)}")
             raise
 
     def clear_index(self):
+        with self._exclusive():
+            self._sync()
+            self._clear_index()
+
+    def _clear_index(self):
         try:
-            if FAISS_INDEX_PATH.exists():
-                for file in FAISS_INDEX_PATH.iterdir():
-                    if file.is_file():
-                        file.unlink()
-                logger.info("Cleared FAISS index files")
             self._vectorstore = None
             self._retriever = None
+            self._doc_ids.clear()
+            self._keyword_index.clear()
+            self._manifest.clear()
+            # Committing an empty generation drops the old files in one atomic step
+            self._compact()
+            logger.info("Cleared FAISS index")
         except Exception as e:
             logger.error(f"Error clearing FAISS index: {str(e)}")
             raise
 
     @property
     def retriever(self):
+        self.refresh()
         return self._retriever
+
+    def scoped_retriever(self, files: Optional[List[str]] = None, file_types: Optional[List[str]] = None):
+        """
+        The retriever, restricted to chunks of the named files and/or file types
+        (extensions such as "pdf"). Both filters must match when both are given;
+        empty or missing ones do not restrict anything.
+        """
+        retriever = self.retriever
+        if retriever is None or not (files or file_types):
+            return retriever
+        wanted_types = {file_type.lower().lstrip(".") for file_type in file_types or ()}
+        with self._lock.read():
+            allowed_ids = frozenset(
+                doc_id
+                for filename in (files if files else list(self._doc_ids))
+                if not wanted_types or DocumentProcessor.file_type(filename) in wanted_types
+                for doc_id in self._doc_ids.get(filename, ())
+            )
+        return retriever.model_copy(update={"allowed_ids": allowed_ids})
@@ -0,0 +1,80 @@
+"""
+Recall@k, single-query latency and memory of each VECTOR_INDEX_TYPE against exact
+flat search, with a sweep of the search-time knob (nprobe / efSearch).
+
+Vectors are drawn around random cluster centres so IVF partitions behave like they
+do on real embeddings.
+
+Run from the backend directory:
+    python -m benchmarks.bench_ann_index --vectors 200000 --dim 256
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=1024)
+    args = parser.parse_args()
+
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    import faiss
+    from app.services import ann_index
+
+    faiss.omp_set_num_threads(1)  # Per-query latency as one request sees it
+    rng = np.random.default_rng(0)
+    centres = rng.standard_normal((256, args.dim)).astype(np.float32)
+    vectors = centres[rng.integers(0, len(centres), args.vectors)] + 0.6 * rng.standard_normal(
+        (args.vectors, args.dim)).astype(np.float32)
+    queries = vectors[rng.choice(args.vectors, args.queries, replace=False)] + 0.1 * rng.standard_normal(
+        (args.queries, args.dim)).astype(np.float32)
+
+    exact = faiss.IndexFlatL2(args.dim)
+    exact.add(vectors)
+    _, truth = exact.search(queries, args.k)
+
+    ann_index.VECTOR_INDEX_NLIST = args.nlist
+    sweeps = {"flat": [None], "ivf_flat": [8, 32, 128], "ivf_pq": [8, 32, 128], "hnsw": [32, 64, 128]}
+    results = []
+    for kind, knobs in sweeps.items():
+        start = time.perf_counter()
+        index = ann_index.build_index(kind, vectors)
+        build_seconds = time.perf_counter() - start
+        for knob in knobs:
+            if kind.startswith("ivf"):
+                index.nprobe = knob
+            elif kind == "hnsw":
+                index.hnsw.efSearch = knob
+            latencies, found = [], []
+            for query in queries:
+                start = time.perf_counter()
+                _, ids = index.search(query[None, :], args.k)
+                latencies.append(time.perf_counter() - start)
+                found.append(ids[0])
+            recall = np.mean([len(set(f) & set(t)) / args.k for f, t in zip(found, truth)])
+            results.append({
+                "type": kind,
+                "search_param": knob,
+                "recall_at_k": round(float(recall), 3),
+                "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+                "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+                "estimated_mb": round(ann_index.estimated_bytes(index) / (1024 * 1024), 1),
+                "build_seconds": round(build_seconds, 1),
+            })
+
+    json.dump({"vectors": args.vectors, "dim": args.dim, "k": args.k, "results": results}, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Ingest throughput of /documents/upload (one job and index save per file) versus
+/documents/upload/batch (one job, batched embedding, one index save).
+
+Run from the backend directory:
+    python -m benchmarks.bench_batch_upload --files 50 --seed-chunks 20000
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--words", type=int, default=1500, help="Words per generated document")
+    parser.add_argument("--seed-chunks", type=int, default=20000, help="Chunks already in the index")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Seconds per embedding request")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_batch_")
+    os.environ["DOCUMENT_PATH"] = os.path.join(workdir, "storage")
+    os.environ["FAISS_INDEX_PATH"] = os.path.join(workdir, "faiss_index")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "cache.sqlite3")
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+
+    import docx
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.services import vector_store
+    from benchmarks.fakes import HashingEmbeddings
+
+    embeddings = HashingEmbeddings(latency=args.embedding_latency)
+    vector_store.get_embeddings = lambda: embeddings
+    manager = vector_store.VectorStoreManager()
+    client = TestClient(app)
+
+    rng = random.Random(0)
+    vocabulary = [f"word{i}" for i in range(5000)]
+    documents = []
+    for i in range(args.files):
+        document = docx.Document()
+        document.add_paragraph(" ".join(rng.choices(vocabulary, k=args.words)))
+        buffer = io.BytesIO()
+        document.save(buffer)
+        documents.append((f"doc{i}.docx", buffer.getvalue()))
+    docx_type = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+    def wait(job_id):
+        while True:
+            job = client.get(f"/documents/jobs/{job_id}").json()
+            if job["stage"] in ("done", "failed"):
+                return job
+            time.sleep(0.005)
+
+    def reset():
+        manager.clear_index()
+        for name in os.listdir(os.environ["DOCUMENT_PATH"]):
+            os.remove(os.path.join(os.environ["DOCUMENT_PATH"], name))
+        if args.seed_chunks:
+            seed = [f"seed chunk {i}" for i in range(args.seed_chunks)]
+            vectors = embeddings.embed_documents(seed)
+            manager.add_embeddings(seed, vectors, [{"filename": "seed"}] * len(seed))
+
+    reset()
+    start = time.perf_counter()
+    for filename, content in documents:
+        response = client.post("/documents/upload", files={"file": (filename, io.BytesIO(content), docx_type)})
+        wait(response.json()["job_id"])
+    single = time.perf_counter() - start
+
+    reset()
+    start = time.perf_counter()
+    response = client.post("/documents/upload/batch", files=[
+        ("files", (filename, io.BytesIO(content), docx_type)) for filename, content in documents
+    ])
+    wait(response.json()["job_id"])
+    batch = time.perf_counter() - start
+
+    json.dump({
+        "files": args.files,
+        "seed_chunks": args.seed_chunks,
+        "single_seconds": round(single, 3),
+        "batch_seconds": round(batch, 3),
+        "single_files_per_sec": round(args.files / single, 2),
+        "batch_files_per_sec": round(args.files / batch, 2),
+        "speedup": round(single / batch, 2),
+    }, sys.stdout, indent=2)
+    print()
+    manager.clear_index()
+
+if __name__ == "__main__":
+    main()
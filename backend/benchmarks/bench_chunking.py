@@ -0,0 +1,91 @@
+"""
+Retrieval precision and prompt size of the token-aware chunker versus the old
+3500-word splitter.
+
+A synthetic corpus hides one "fact" sentence per topic in filler paragraphs; each
+query asks for one fact. For the top-3 chunks we report whether the fact was
+retrieved (hit@3), the share of retrieved chunks that contain it (precision@3)
+and the prompt tokens those chunks would cost.
+
+Run from the backend directory:
+    python -m benchmarks.bench_chunking --documents 40
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+
+def legacy_chunk_text(text, chunk_size=3500):
+    words = text.split()
+    return [" ".join(words[i:i+chunk_size]) for i in range(0, len(words), chunk_size)]
+
+def build_corpus(documents, paragraphs, rng):
+    filler = [f"filler{i}" for i in range(3000)]
+    corpus, facts = [], []
+    for d in range(documents):
+        blocks = []
+        for p in range(paragraphs):
+            sentences = [" ".join(rng.choices(filler, k=rng.randint(8, 20))) + "." for _ in range(rng.randint(4, 9))]
+            if p % 3 == 0:
+                code = f"{d}x{p}"
+                sentences.insert(rng.randrange(len(sentences)),
+                                 f"The part number for widget W{code} is PN{code}Z and its supplier is Vendor{code}.")
+                facts.append((f"Which part number and supplier does widget W{code} use?", f"PN{code}Z"))
+            blocks.append(" ".join(sentences))
+        corpus.append("\n\n".join(blocks))
+    return corpus, facts
+
+def evaluate(name, chunker, corpus, facts, count_tokens):
+    import numpy as np
+    import faiss
+    from benchmarks.fakes import HashingEmbeddings
+
+    start = time.perf_counter()
+    chunks = [chunk for text in corpus for chunk in chunker(text)]
+    chunking_seconds = time.perf_counter() - start
+
+    embeddings = HashingEmbeddings().fit(chunks)
+    index = faiss.IndexFlatIP(embeddings.size)
+    index.add(np.asarray(embeddings.embed_documents(chunks), dtype=np.float32))
+
+    hits, precisions, prompt_tokens = 0, [], []
+    for question, answer in facts:
+        query = np.asarray([embeddings.embed_query(question)], dtype=np.float32)
+        _, ids = index.search(query, 3)
+        retrieved = [chunks[i] for i in ids[0] if i >= 0]
+        relevant = [answer in chunk for chunk in retrieved]
+        hits += any(relevant)
+        precisions.append(sum(relevant) / len(retrieved))
+        prompt_tokens.append(sum(count_tokens(chunk) for chunk in retrieved))
+
+    return {
+        "chunker": name,
+        "chunks": len(chunks),
+        "chunking_seconds": round(chunking_seconds, 3),
+        "hit_at_3": round(hits / len(facts), 3),
+        "precision_at_3": round(statistics.mean(precisions), 3),
+        "mean_prompt_tokens": round(statistics.mean(prompt_tokens), 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", type=int, default=40)
+    parser.add_argument("--paragraphs", type=int, default=30)
+    args = parser.parse_args()
+
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    from app.services.document_processor import DocumentProcessor
+
+    corpus, facts = build_corpus(args.documents, args.paragraphs, random.Random(0))
+    results = [
+        evaluate("legacy_3500_words", legacy_chunk_text, corpus, facts, DocumentProcessor.count_tokens),
+        evaluate("token_aware", DocumentProcessor.chunk_text, corpus, facts, DocumentProcessor.count_tokens),
+    ]
+    json.dump({"documents": args.documents, "queries": len(facts), "results": results}, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+End-to-end throughput, latency and memory of the real HTTP endpoints on
+synthetic corpora of increasing size, fully offline.
+
+For each size in `--sizes` the index and storage start empty, and that many
+PDF, DOCX, XLSX and PPTX documents are generated and sent to /documents/upload.
+The harness waits for every ingestion job, then asks `--queries` questions
+through /chat from `--concurrency` clients. Last, `--deletes` documents are
+removed with DELETE /documents/{filename}. Embeddings come from the
+deterministic HashingEmbeddings. The fast and the reasoning model are
+LatencyFakeChatModels with the given median latencies. The answer cache is
+off, so every question reaches retrieval and the LLM.
+
+Each size reports:
+- ingestion throughput, upload request p50/p99 and the mean index write;
+- chat throughput, p50/p99 and the retrieval p50/p99 taken from Server-Timing;
+- delete p50/p99;
+- the index size on disk;
+- peak RSS. It is the process peak so far, which is why sizes run smallest first.
+
+With `--baseline` the results are compared with an earlier run. The exit status
+is 1 when a throughput, p99 or peak RSS is worse by more than `--tolerance`, so
+a CI job can fail on a regression.
+
+Run from the backend directory:
+    python -m benchmarks.bench_end_to_end --sizes 20 80 320 --output results.json
+    python -m benchmarks.bench_end_to_end --sizes 20 80 320 --baseline results.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import logging
+import argparse
+import resource
+import tempfile
+
+CONTENT_TYPES = {
+    "pdf": "application/pdf",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "pptx": "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+}
+SERVER_TIMING_PATTERN = re.compile(r"(\w+);dur=([\d.]+)")
+# (section, key, True when higher is better) checked against a baseline
+WATCHED = [
+    ("ingest", "documents_per_second", True), ("ingest", "upload_p99_ms", False),
+    ("chat", "queries_per_second", True), ("chat", "p99_ms", False),
+    ("delete", "p99_ms", False), (None, "peak_rss_mb", False),
+]
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def directory_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+def write_corpus(directory: str, count: int, rng: random.Random, vocabulary, args):
+    """
+    `count` documents cycling through the formats, each about `--pages` pages,
+    slides or paragraphs of `--sentences` sentences; workbooks get `--rows` rows.
+    """
+    from benchmarks.corpus import sentences, write_pdf, write_workbook, write_document, write_presentation
+
+    documents = []
+    formats = list(CONTENT_TYPES)
+    for i in range(count):
+        file_type = formats[i % len(formats)]
+        filename = f"doc{i:05d}.{file_type}"
+        path = os.path.join(directory, filename)
+        parts = [sentences(rng, vocabulary, args.sentences) for _ in range(args.pages)]
+        if file_type == "pdf":
+            write_pdf(path, [[part[j:j + 90] for j in range(0, len(part), 90)] for part in parts])
+        elif file_type == "docx":
+            write_document(path, parts)
+        elif file_type == "xlsx":
+            write_workbook(path, args.rows, rng, vocabulary)
+        else:
+            write_presentation(path, [[f"Slide {j + 1}", part] for j, part in enumerate(parts)])
+        documents.append((filename, CONTENT_TYPES[file_type], path))
+    return documents
+
+def ingest(client, documents):
+    from app.services import metrics
+
+    writes = metrics.STAGE_SECONDS.count(stage="index_write")
+    write_seconds = metrics.STAGE_SECONDS.total(stage="index_write")
+    upload_latencies, job_ids = [], []
+    start = time.perf_counter()
+    for filename, content_type, path in documents:
+        with open(path, "rb") as f:
+            request_start = time.perf_counter()
+            response = client.post("/documents/upload", files={"file": (filename, f, content_type)})
+            upload_latencies.append(time.perf_counter() - request_start)
+        response.raise_for_status()
+        job_ids.append(response.json()["job_id"])
+
+    chunks, failed = 0, 0
+    for job_id in job_ids:
+        while True:
+            job = client.get(f"/documents/jobs/{job_id}").json()
+            if job["stage"] in ("done", "failed"):
+                break
+            time.sleep(0.005)
+        chunks += job["chunks"]
+        failed += job["stage"] == "failed"
+    elapsed = time.perf_counter() - start
+
+    writes = metrics.STAGE_SECONDS.count(stage="index_write") - writes
+    write_seconds = metrics.STAGE_SECONDS.total(stage="index_write") - write_seconds
+    return {
+        "seconds": round(elapsed, 3),
+        "documents_per_second": round(len(documents) / elapsed, 2),
+        "chunks_per_second": round(chunks / elapsed, 1),
+        "chunks": chunks,
+        "failed_documents": failed,
+        "upload_p50_ms": ms(percentile(upload_latencies, 0.5)),
+        "upload_p99_ms": ms(percentile(upload_latencies, 0.99)),
+        "index_writes": writes,
+        "index_write_mean_ms": ms(write_seconds / writes) if writes else None,
+    }
+
+async def chat(app, questions, concurrency):
+    import httpx
+
+    latencies, retrievals, errors = [], [], 0
+
+    async def user(async_client, offset):
+        nonlocal errors
+        for question in questions[offset::concurrency]:
+            start = time.perf_counter()
+            response = await async_client.post("/chat/", json={"user_message": question})
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+            stages = dict(SERVER_TIMING_PATTERN.findall(response.headers.get("server-timing", "")))
+            if "retrieval" in stages:
+                retrievals.append(float(stages["retrieval"]) / 1000)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as async_client:
+        start = time.perf_counter()
+        await asyncio.gather(*(user(async_client, i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return {
+        "queries": len(questions),
+        "errors": errors,
+        "queries_per_second": round(len(questions) / elapsed, 2),
+        "p50_ms": ms(percentile(latencies, 0.5)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "retrieval_p50_ms": ms(percentile(retrievals, 0.5)),
+        "retrieval_p99_ms": ms(percentile(retrievals, 0.99)),
+    }
+
+def delete(client, filenames):
+    latencies = []
+    for filename in filenames:
+        start = time.perf_counter()
+        client.delete(f"/documents/{filename}").raise_for_status()
+        latencies.append(time.perf_counter() - start)
+    return {"documents": len(filenames), "p50_ms": ms(percentile(latencies, 0.5)),
+            "p99_ms": ms(percentile(latencies, 0.99))}
+
+def compare(results, baseline, tolerance):
+    """
+    Regressions of `results` against `baseline`, matched by corpus size, as readable lines.
+    """
+    regressions = []
+    previous = {entry["documents"]: entry for entry in baseline["results"]}
+    for entry in results:
+        before = previous.get(entry["documents"])
+        if before is None:
+            continue
+        for section, key, higher_is_better in WATCHED:
+            new = (entry[section] if section else entry).get(key)
+            old = (before[section] if section else before).get(key)
+            if not new or not old:
+                continue
+            change = (old - new) / old if higher_is_better else (new - old) / old
+            if change > tolerance:
+                name = f"{section}.{key}" if section else key
+                regressions.append(f"{entry['documents']} documents: {name} {old} -> {new} ({change:.0%} worse)")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20, 80, 320], help="Documents per corpus")
+    parser.add_argument("--pages", type=int, default=5, help="Pages, slides or paragraphs per document")
+    parser.add_argument("--sentences", type=int, default=12, help="Sentences per page")
+    parser.add_argument("--rows", type=int, default=200, help="Rows per workbook")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--deletes", type=int, default=10)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="Seconds per embedding request")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Median seconds of the fast model")
+    parser.add_argument("--reasoning-latency", type=float, default=1.0, help="Median seconds of the reasoning model")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the results to this file")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_e2e_")
+    os.environ["DOCUMENT_PATH"] = os.path.join(workdir, "storage")
+    os.environ["FAISS_INDEX_PATH"] = os.path.join(workdir, "faiss_index")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "cache.sqlite3")
+    # Startup work would race with the first corpus
+    os.environ["INDEX_RECONCILE"] = "false"
+    os.environ["INDEX_PRELOAD"] = "false"
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.routers import chat as chat_router
+    from app.services import vector_store
+    from benchmarks.fakes import HashingEmbeddings, LatencyFakeChatModel
+
+    # A log line per request and job would bury the results and cost time of its own
+    logging.getLogger().setLevel(logging.WARNING)
+    embeddings = HashingEmbeddings(size=args.dim, latency=args.embedding_latency)
+    vector_store.get_embeddings = lambda: embeddings
+    chat_router.llm_manager.fast_llm = LatencyFakeChatModel(median=args.llm_latency, seed=args.seed)
+    chat_router.llm_manager.llm = LatencyFakeChatModel(median=args.reasoning_latency, seed=args.seed + 1)
+    chat_router.answer_cache.max_entries = 0
+    manager = vector_store.VectorStoreManager()
+
+    rng = random.Random(args.seed)
+    vocabulary = [f"term{i}" for i in range(5000)]
+    questions = [
+        f"{'Why' if i % 3 == 0 else 'What'} does the document say about {' '.join(rng.sample(vocabulary, 3))}?"
+        for i in range(args.queries)
+    ]
+
+    results = []
+    with TestClient(app) as client:
+        for size in sorted(args.sizes):
+            manager.clear_index()
+            shutil.rmtree(os.environ["DOCUMENT_PATH"], ignore_errors=True)
+            os.makedirs(os.environ["DOCUMENT_PATH"])
+            corpus_dir = tempfile.mkdtemp(dir=workdir)
+            documents = write_corpus(corpus_dir, size, rng, vocabulary, args)
+
+            entry = {"documents": size, "ingest": ingest(client, documents)}
+            entry["chat"] = asyncio.run(chat(app, questions, args.concurrency))
+            entry["index_bytes"] = directory_bytes(os.environ["FAISS_INDEX_PATH"])
+            deleted = [filename for filename, _, _ in documents[:args.deletes]]
+            entry["delete"] = delete(client, deleted)
+            entry["peak_rss_mb"] = peak_rss_mb()
+            results.append(entry)
+            shutil.rmtree(corpus_dir)
+            print(f"{size} documents done", file=sys.stderr)
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "results": results,
+    }
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"Regression: {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Peak memory and time of the old whole-document extractors versus streaming
+page/sheet segments into the chunker.
+
+Each measurement runs in a fresh interpreter so ru_maxrss is that run's peak.
+
+Run from the backend directory:
+    python -m benchmarks.bench_extraction --pages 500 --rows 100000
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+
+def legacy_chunks(file_path, filename):
+    # The extractors as they were: `text +=` per PDF page, DataFrame.to_string per sheet
+    import PyPDF2
+    import pandas as pd
+    from app.services.document_processor import DocumentProcessor
+
+    if filename.endswith(".pdf"):
+        text = ""
+        with open(file_path, "rb") as f:
+            for page in PyPDF2.PdfReader(f).pages:
+                text += page.extract_text() or ""
+    else:
+        xl = pd.ExcelFile(file_path)
+        text = "\n\n".join(xl.parse(sheet_name).to_string() for sheet_name in xl.sheet_names)
+    return DocumentProcessor.chunk_text(text)
+
+def streaming_chunks(file_path, filename):
+    from app.services.document_processor import DocumentProcessor
+    return DocumentProcessor.extract_chunks(file_path, filename)
+
+def child(mode, file_path):
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    import app.services.document_processor  # noqa: F401  Imports count towards the baseline
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    chunks = (legacy_chunks if mode == "legacy" else streaming_chunks)(file_path, os.path.basename(file_path))
+    seconds = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    json.dump({"chunks": len(chunks), "seconds": round(seconds, 3),
+               "peak_rss_mb": round(peak / 1024, 1), "extra_rss_mb": round((peak - baseline) / 1024, 1)}, sys.stdout)
+
+def measure(mode, file_path):
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_extraction", "--child", mode, file_path],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(*args.child)
+
+    from benchmarks.corpus import sentences, write_pdf, write_workbook
+
+    rng = random.Random(0)
+    vocabulary = [f"term{i}" for i in range(4000)]
+    workdir = tempfile.mkdtemp(prefix="bench_extraction_")
+    pdf_path = os.path.join(workdir, "report.pdf")
+    write_pdf(pdf_path, ([sentences(rng, vocabulary, 1) for _ in range(60)] for _ in range(args.pages)))
+    workbook_path = os.path.join(workdir, "orders.xlsx")
+    write_workbook(workbook_path, args.rows, rng, vocabulary)
+
+    results = {}
+    for name, path in (("pdf", pdf_path), ("xlsx", workbook_path)):
+        results[name] = {mode: measure(mode, path) for mode in ("legacy", "streaming")}
+    json.dump({"pages": args.pages, "rows": args.rows, "results": results}, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
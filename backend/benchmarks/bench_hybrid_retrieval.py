@@ -0,0 +1,92 @@
+"""
+Retrieval quality and latency of vector, keyword (BM25) and hybrid (RRF) modes on
+spreadsheet-like rows full of part numbers and acronyms.
+
+Each query asks for one row by its part number. The vector side uses the
+deterministic hashing embedder without IDF fitting, which, like real embedding
+models, gives an opaque code such as "PN48213Z" no special weight.
+
+Run from the backend directory:
+    python -m benchmarks.bench_hybrid_retrieval --rows 20000 --queries 500
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    from langchain_community.vectorstores import FAISS
+    from app.services.hybrid_search import KeywordIndex, HybridRetriever
+    from benchmarks.fakes import HashingEmbeddings
+
+    rng = random.Random(0)
+    products = ["bracket", "valve", "gasket", "sensor", "pump", "relay", "bearing", "hose"]
+    sites = ["ERP", "MRO", "QA", "OEM", "RMA"]
+    rows = [
+        f"Part PN{10000 + i}Z | {rng.choice(products)} | {rng.choice(sites)} | qty {rng.randint(1, 900)} | "
+        f"supplier Vendor{rng.randint(1, 40)}"
+        for i in range(args.rows)
+    ]
+    ids = [f"row{i}" for i in range(args.rows)]
+
+    embeddings = HashingEmbeddings()
+    store = FAISS.from_embeddings(list(zip(rows, embeddings.embed_documents(rows))), embeddings, ids=ids)
+    keyword_index = KeywordIndex()
+    keyword_index.add(ids, rows)
+
+    targets = rng.sample(range(args.rows), args.queries)
+    queries = [(f"Who supplies the {rows[i].split(' | ')[1]} with part number PN{10000 + i}Z?", rows[i]) for i in targets]
+
+    results = []
+    for mode in ("vector", "keyword", "hybrid"):
+        retriever = HybridRetriever(vectorstore=store, keyword_index=keyword_index, mode=mode, k=3)
+        embeddings.requests = 0
+        hits, latencies = 0, []
+        for question, answer in queries:
+            start = time.perf_counter()
+            docs = retriever.invoke(question)
+            latencies.append(time.perf_counter() - start)
+            hits += any(doc.page_content == answer for doc in docs)
+        results.append({
+            "mode": mode,
+            "hit_at_3": round(hits / len(queries), 3),
+            "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+            "embedding_requests": embeddings.requests,
+        })
+
+    # The bare inverted-index lookup, without the retriever and callback overhead, for the
+    # full questions and for the part numbers alone
+    lookups = {"question": [], "part_number": []}
+    for question, answer in queries:
+        for kind, text in (("question", question), ("part_number", answer.split(" | ")[0])):
+            start = time.perf_counter()
+            keyword_index.search(text, 3)
+            lookups[kind].append(time.perf_counter() - start)
+
+    json.dump({
+        "rows": args.rows,
+        "queries": len(queries),
+        "results": results,
+        "keyword_lookup_ms": {
+            kind: {"p50": round(statistics.median(values) * 1000, 4), "p99": round(percentile(values, 0.99) * 1000, 4)}
+            for kind, values in lookups.items()
+        },
+    }, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
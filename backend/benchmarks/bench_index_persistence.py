@@ -0,0 +1,79 @@
+"""
+Upload latency against index size: appending to the index log versus writing a full
+snapshot on every upload (the save_local-per-write behaviour), plus the cost of the
+compaction that the log amortises.
+
+Run from the backend directory:
+    python -m benchmarks.bench_index_persistence --sizes 10000 50000 200000 --dim 768
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+import numpy as np
+
+from benchmarks.fakes import HashingEmbeddings
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000, 200000])
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--uploads", type=int, default=20)
+    parser.add_argument("--chunks", type=int, default=50, help="chunks per upload")
+    args = parser.parse_args()
+
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    from app.services import vector_store
+
+    embeddings = HashingEmbeddings(size=args.dim)
+    vector_store.get_embeddings = lambda: embeddings
+    rng = np.random.default_rng(0)
+
+    def upload(manager, name):
+        chunks = [f"{name} chunk {i} " + "filler text " * 60 for i in range(args.chunks)]
+        vectors = rng.standard_normal((args.chunks, args.dim)).astype(np.float32)
+        manager.add_embeddings(chunks, vectors, [{"filename": name}] * args.chunks)
+
+    results = []
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as workdir:
+            vector_store.FAISS_INDEX_PATH = Path(workdir)
+            manager = vector_store.VectorStoreManager()
+            manager._load()
+            chunks = [f"seed chunk {i} " + "filler text " * 60 for i in range(size)]
+            vectors = rng.standard_normal((size, args.dim)).astype(np.float32)
+            manager.add_embeddings(chunks, vectors, [{"filename": f"seed{i // 100}.pdf"} for i in range(size)])
+
+            start = time.perf_counter()
+            manager.compact()
+            compact_seconds = time.perf_counter() - start
+
+            for mode in ("log", "full_save"):
+                latencies = []
+                for n in range(args.uploads):
+                    start = time.perf_counter()
+                    upload(manager, f"{mode}{n}.pdf")
+                    if mode == "full_save":
+                        manager.compact()
+                    latencies.append(time.perf_counter() - start)
+                results.append({
+                    "index_chunks": size,
+                    "mode": mode,
+                    "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+                    "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+                    "compaction_seconds": round(compact_seconds, 2),
+                })
+            manager._log.close()
+
+    json.dump({"dim": args.dim, "chunks_per_upload": args.chunks, "results": results}, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
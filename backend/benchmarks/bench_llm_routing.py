@@ -0,0 +1,87 @@
+"""
+Answer latency with every question on the reasoning model, with routing between
+the fast and the reasoning model, and with routing plus hedged requests, using
+fake chat models with log-normal latencies and occasional stalls.
+
+`--lookups` is the share of questions that are plain lookups; the others ask for
+analysis and are routed to the reasoning model. Latencies are in seconds before
+`--scale`, which shrinks them so a run takes seconds rather than minutes.
+
+Run from the backend directory:
+    python -m benchmarks.bench_llm_routing --questions 400 --concurrency 8
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+async def run(manager, questions, concurrency):
+    latencies = []
+
+    async def client(offset):
+        for question in questions[offset::concurrency]:
+            start = time.perf_counter()
+            await manager.agenerate_response("", question)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(client(i) for i in range(concurrency)))
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--lookups", type=float, default=0.7)
+    parser.add_argument("--scale", type=float, default=0.05)
+    args = parser.parse_args()
+
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    from app.services.llm_setup import LLMManager
+    from app.services import metrics
+    from benchmarks.fakes import LatencyFakeChatModel
+
+    rng = random.Random(0)
+    questions = [
+        f"What is the notice period in contract {i}?" if rng.random() < args.lookups
+        else f"Why did the revenue of unit {i} fall compared to last year?"
+        for i in range(args.questions)
+    ]
+
+    results = []
+    for name, routing, hedge in (("reasoning_only", "reasoning", False), ("routed", "auto", False),
+                                 ("routed_hedged", "auto", True)):
+        manager = LLMManager()
+        manager.routing, manager.hedge, manager.timeout = routing, hedge, 60 * args.scale
+        # Same seeds in every run, so each configuration sees the same latency draws
+        manager.fast_llm = LatencyFakeChatModel(median=0.4 * args.scale, sigma=0.3, tail_probability=0.03,
+                                                tail_seconds=4 * args.scale, seed=1)
+        manager.llm = LatencyFakeChatModel(median=3 * args.scale, sigma=0.4, tail_probability=0.05,
+                                           tail_seconds=12 * args.scale, seed=2)
+        hedges_before = sum(metrics.LLM_HEDGES.value(route=route) for route in ("fast", "reasoning"))
+        start = time.perf_counter()
+        latencies = asyncio.run(run(manager, questions, args.concurrency))
+        elapsed = time.perf_counter() - start
+        results.append({
+            "mode": name,
+            "p50_ms": round(percentile(latencies, 0.5) * 1000 / args.scale, 1),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000 / args.scale, 1),
+            "questions_per_second": round(len(questions) / elapsed * args.scale, 2),
+            "reasoning_calls": manager.llm.calls,
+            "fast_calls": manager.fast_llm.calls,
+            "hedges": sum(metrics.LLM_HEDGES.value(route=route) for route in ("fast", "reasoning")) - hedges_before,
+        })
+
+    # Times are reported unscaled, as the models' real latencies would give them
+    json.dump({"questions": args.questions, "concurrency": args.concurrency, "lookups": args.lookups,
+               "results": results}, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
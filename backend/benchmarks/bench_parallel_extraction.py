@@ -0,0 +1,67 @@
+"""
+Extraction throughput of DocumentProcessor.extract_parallel on a mixed batch of
+PDFs and workbooks, in-thread versus process pools of increasing size.
+
+Run from the backend directory (speedup is bounded by the cores available):
+    python -m benchmarks.bench_parallel_extraction --pdfs 16 --pages 100 --workbooks 4
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+def run(files, executor):
+    from app.services.document_processor import DocumentProcessor
+
+    start = time.perf_counter()
+    results = list(DocumentProcessor.extract_parallel(files, executor))
+    seconds = time.perf_counter() - start
+    assert all(error is None for _, _, error in results), results
+    return seconds, sum(len(chunks) for _, chunks, _ in results)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pdfs", type=int, default=16)
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--workbooks", type=int, default=4)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--workers", type=int, nargs="*", help="Pool sizes to try (default: 1, 2, 4, ... up to the CPU count)")
+    args = parser.parse_args()
+
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    from benchmarks.corpus import sentences, write_pdf, write_workbook
+
+    rng = random.Random(0)
+    vocabulary = [f"term{i}" for i in range(4000)]
+    workdir = tempfile.mkdtemp(prefix="bench_parallel_")
+    files = []
+    for i in range(args.pdfs):
+        path = os.path.join(workdir, f"report{i}.pdf")
+        write_pdf(path, ([sentences(rng, vocabulary, 1) for _ in range(40)] for _ in range(args.pages)))
+        files.append((path, f"report{i}.pdf"))
+    for i in range(args.workbooks):
+        path = os.path.join(workdir, f"orders{i}.xlsx")
+        write_workbook(path, args.rows, rng, vocabulary)
+        files.append((path, f"orders{i}.xlsx"))
+
+    cpus = os.cpu_count() or 1
+    workers = args.workers or sorted({min(2 ** i, cpus) for i in range(cpus.bit_length() + 1)})
+
+    baseline, chunks = run(files, None)
+    results = [{"workers": 0, "seconds": round(baseline, 3), "speedup": 1.0}]
+    for count in workers:
+        with ProcessPoolExecutor(max_workers=count) as executor:
+            # Start the workers before timing so process spawn is not counted
+            list(executor.map(abs, range(count)))
+            seconds, _ = run(files, executor)
+        results.append({"workers": count, "seconds": round(seconds, 3), "speedup": round(baseline / seconds, 2)})
+
+    json.dump({"files": len(files), "chunks": chunks, "cpus": cpus, "results": results}, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Throughput and latency of concurrent chat retrievals with and without
+micro-batching, on a synthetic vector index.
+
+Each of `--concurrency` clients sends `--queries` questions one after another,
+the way parallel /chat requests reach one worker. Without batching every question
+makes its own embedding request and its own faiss search; with batching the
+questions that arrive within QUERY_BATCH_WAIT_MS share both. `--latency` is the
+simulated round trip of one embedding request.
+
+Run from the backend directory:
+    python -m benchmarks.bench_query_batching --vectors 100000 --concurrency 32
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import numpy as np
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+async def run(retriever, questions, concurrency):
+    latencies = []
+
+    async def client(offset):
+        for question in questions[offset::concurrency]:
+            start = time.perf_counter()
+            await retriever.ainvoke(question)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(concurrency)))
+    return time.perf_counter() - start, latencies
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=512)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--wait-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_core.documents import Document
+    from app.services.ann_index import ANNVectorStore
+    from app.services.hybrid_search import KeywordIndex, HybridRetriever
+    from app.services.query_batcher import QueryBatcher
+    from benchmarks.fakes import HashingEmbeddings
+    import faiss
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((args.vectors, args.dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = faiss.IndexFlatL2(args.dim)
+    index.add(vectors)
+    ids = [str(i) for i in range(args.vectors)]
+    docstore = InMemoryDocstore({i: Document(page_content=f"chunk {i}", id=i) for i in ids})
+    questions = [f"question {i} about topic {i % 97}" for i in range(args.queries)]
+
+    results = []
+    for name in ("unbatched", "batched"):
+        embeddings = HashingEmbeddings(size=args.dim, latency=args.latency)
+        store = ANNVectorStore(embeddings, index, docstore, dict(enumerate(ids)))
+        batcher = QueryBatcher(args.concurrency, args.wait_ms) if name == "batched" else None
+        retriever = HybridRetriever(vectorstore=store, keyword_index=KeywordIndex(), mode="vector",
+                                    batcher=batcher, k=4)
+        elapsed, latencies = asyncio.run(run(retriever, questions, args.concurrency))
+        result = {
+            "mode": name,
+            "queries_per_second": round(len(questions) / elapsed, 1),
+            "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "embedding_requests": embeddings.requests,
+        }
+        if batcher is not None:
+            result["mean_batch_size"] = batcher.stats()["search"]["mean_batch_size"]
+        results.append(result)
+
+    json.dump({"vectors": args.vectors, "dim": args.dim, "concurrency": args.concurrency,
+               "results": results}, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Prompt tokens and answer relevance with and without the re-ranking stage, on a
+small labelled set: each question has exactly one chunk holding its answer.
+
+The corpus mimics what fills the context window with noise in practice: every
+handbook is uploaded twice (an original and a re-exported copy), each section
+also exists in a lightly edited revision, and every page carries the same
+boilerplate header. The chat endpoint puts the first 3 retrieved chunks in the
+prompt; prompt_tokens counts them with the chunker's token estimate.
+
+Run from the backend directory:
+    python -m benchmarks.bench_rerank --topics 60
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def build_corpus(rng: random.Random, topics: int):
+    subjects = ["travel", "expense", "laptop", "badge", "parking", "leave", "training", "overtime", "remote", "visitor"]
+    verbs = ["approved by", "submitted to", "reviewed by", "escalated to", "signed off by"]
+    owners = ["the line manager", "finance", "the IT desk", "facilities", "HR", "the security office"]
+    chunks, questions = [], []
+    for topic in range(topics):
+        subject = f"{rng.choice(subjects)} {rng.choice(['request', 'claim', 'policy', 'form'])} {topic}"
+        deadline = rng.randint(2, 30)
+        owner = rng.choice(owners)
+        answer = (f"Every {subject} must be {rng.choice(verbs)} {owner} within {deadline} working days, "
+                  f"and late {subject} cases are logged in register R{topic:03d}.")
+        revision = answer.replace("Every", "Each") + " Updated in the latest revision."
+        header = f"Company handbook, confidential, internal use only. Section {subject}."
+        background = (f"The {subject} process exists so that {owner} can plan ahead; questions about "
+                      f"the {subject} go to the policy team first.")
+        for name in (f"handbook{topic}.pdf", f"handbook{topic} copy.pdf"):
+            chunks += [(header, name), (answer, name), (revision, name), (background, name)]
+        questions.append((f"Within how many working days must a {subject} be handled and by whom?", answer))
+    return chunks, questions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--topics", type=int, default=60)
+    parser.add_argument("--dim", type=int, default=768)
+    args = parser.parse_args()
+
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    from app.services.ann_index import ANNVectorStore
+    from app.services.document_processor import DocumentProcessor
+    from app.services.hybrid_search import KeywordIndex, HybridRetriever
+    from app.services.reranker import Reranker
+    from benchmarks.fakes import HashingEmbeddings
+
+    chunks, questions = build_corpus(random.Random(0), args.topics)
+    texts = [text for text, _ in chunks]
+    ids = [f"chunk{i}" for i in range(len(chunks))]
+    embeddings = HashingEmbeddings(size=args.dim).fit(texts)
+    store = ANNVectorStore.from_embeddings(list(zip(texts, embeddings.embed_documents(texts))), embeddings,
+                                           metadatas=[{"filename": name} for _, name in chunks], ids=ids)
+    keyword_index = KeywordIndex()
+    keyword_index.add(ids, texts)
+
+    configurations = {
+        "none": None,
+        "mmr": Reranker(min_relevance=0.0),
+        "mmr_min_relevance": Reranker(),
+        "budget_exhausted": Reranker(budget_ms=0),
+    }
+    results = []
+    for mode in ("vector", "hybrid"):
+        for name, reranker in configurations.items():
+            retriever = HybridRetriever(vectorstore=store, keyword_index=keyword_index, reranker=reranker,
+                                        mode=mode, k=4)
+            hits, tokens, duplicates, latencies = 0, [], 0, []
+            for question, answer in questions:
+                start = time.perf_counter()
+                docs = retriever.invoke(question)[:3]
+                latencies.append(time.perf_counter() - start)
+                context = "\n".join(doc.page_content for doc in docs)
+                hits += answer in [doc.page_content for doc in docs]
+                tokens.append(DocumentProcessor.count_tokens(context))
+                duplicates += len(docs) - len({doc.page_content for doc in docs})
+            results.append({
+                "mode": mode,
+                "reranker": name,
+                "answer_in_context": round(hits / len(questions), 3),
+                "prompt_tokens_mean": round(statistics.mean(tokens), 1),
+                "duplicate_chunks_per_answer": round(duplicates / len(questions), 2),
+                "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+                "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            })
+
+    json.dump({"chunks": len(chunks), "questions": len(questions), "results": results}, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Cold start against index size: time to import the app, to load the index and to
+answer the first query, and the memory held afterwards, for
+
+    pickle  the previous layout: index read into memory, docstore unpickled in full
+    sqlite  SQLite docstore read on demand, index read into memory (INDEX_MMAP=false)
+    mmap    SQLite docstore and a memory-mapped index (the default)
+
+Each measurement runs in a fresh interpreter (peak_rss_mb is VmHWM, which unlike
+ru_maxrss is not inherited from the parent). rss_anon_mb is private memory;
+rss_file_mb is mapped index pages, which the kernel can drop and share between workers.
+
+Run from the backend directory:
+    python -m benchmarks.bench_startup --vectors 1000000 --dim 768
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+import numpy as np
+
+from benchmarks.fakes import HashingEmbeddings
+
+def memory_mb():
+    status = dict(line.split(":", 1) for line in Path("/proc/self/status").read_text().splitlines())
+    return {key: round(int(status[field].split()[0]) / 1024, 1)
+            for key, field in (("peak_rss_mb", "VmHWM"), ("rss_anon_mb", "RssAnon"), ("rss_file_mb", "RssFile"))}
+
+def child(dim):
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    start = time.perf_counter()
+    import app.main  # noqa: F401
+    from app.services import vector_store
+    import_seconds = time.perf_counter() - start
+
+    embeddings = HashingEmbeddings(size=dim)
+    vector_store.get_embeddings = lambda: embeddings
+    manager = vector_store.VectorStoreManager()
+    start = time.perf_counter()
+    manager.refresh()
+    load_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    docs = manager.retriever.invoke("seed chunk 12345")
+    query_seconds = time.perf_counter() - start
+    json.dump({
+        "import_seconds": round(import_seconds, 2),
+        "load_seconds": round(load_seconds, 2),
+        "first_query_ms": round(query_seconds * 1000, 1),
+        "results": len(docs),
+        **memory_mb(),
+        "index": manager._vectorstore.index_stats(),
+    }, sys.stdout)
+
+def build(workdir: Path, vectors: int, dim: int) -> Path:
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    from app.services import vector_store
+
+    embeddings = HashingEmbeddings(size=dim)
+    vector_store.get_embeddings = lambda: embeddings
+    vector_store.FAISS_INDEX_PATH = workdir / "index"
+    manager = vector_store.VectorStoreManager()
+    rng = np.random.default_rng(0)
+    for start in range(0, vectors, 20000):
+        count = min(20000, vectors - start)
+        chunks = [f"seed chunk {start + i} about topic {(start + i) % 977}" for i in range(count)]
+        metadatas = [{"filename": f"seed{(start + i) // 100}.pdf"} for i in range(count)]
+        manager.add_embeddings(chunks, rng.standard_normal((count, dim)).astype(np.float32), metadatas)
+    manager.compact()
+    return vector_store.snapshot_path(vector_store.FAISS_INDEX_PATH, manager._generation)
+
+def write_pickle_layout(snapshot: Path, target: Path):
+    # What FAISS.save_local wrote before: the index plus the whole docstore in index.pkl
+    import faiss
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    from app.services.docstore import DOCSTORE_FILE, SQLiteDocstore
+
+    docstore = SQLiteDocstore(snapshot / DOCSTORE_FILE)
+    positions = SQLiteDocstore.read_positions(snapshot / DOCSTORE_FILE)
+    documents = InMemoryDocstore({doc_id: docstore.search(doc_id) for doc_id in positions.values()})
+    FAISS(None, faiss.read_index(str(snapshot / "index.faiss")), documents, positions).save_local(str(target))
+    for name in ("doc_ids.json", "bm25.json"):
+        shutil.copy(snapshot / name, target / name)
+
+def measure(index_path: Path, mmap: bool, dim: int, workdir: Path):
+    env = dict(os.environ, FAISS_INDEX_PATH=str(index_path), INDEX_MMAP="true" if mmap else "false",
+               EMBEDDING_CACHE_PATH=str(workdir / "cache.sqlite3"), GOOGLE_API_KEY="benchmark")
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_startup", "--child", "--dim", str(dim)],
+        check=True, capture_output=True, text=True, env=env
+    ).stdout
+    return json.loads(output)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--child", action="store_true")
+    args = parser.parse_args()
+    if args.child:
+        child(args.dim)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        start = time.perf_counter()
+        snapshot = build(workdir, args.vectors, args.dim)
+        write_pickle_layout(snapshot, workdir / "pickle")
+        build_seconds = time.perf_counter() - start
+        index_mb = (snapshot / "index.faiss").stat().st_size / (1024 * 1024)
+
+        results = {
+            "pickle": measure(workdir / "pickle", False, args.dim, workdir),
+            "sqlite": measure(workdir / "index", False, args.dim, workdir),
+            "mmap": measure(workdir / "index", True, args.dim, workdir),
+        }
+    json.dump({"vectors": args.vectors, "dim": args.dim, "index_mb": round(index_mb, 1),
+               "build_seconds": round(build_seconds, 1), "results": results}, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Synthetic documents for the offline benchmarks, written without any extra dependencies.
+"""
+import random
+from typing import Iterable, List
+
+def sentences(rng: random.Random, vocabulary: List[str], count: int) -> str:
+    return " ".join(" ".join(rng.choices(vocabulary, k=rng.randint(8, 16))).capitalize() + "." for _ in range(count))
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def write_pdf(path: str, pages: Iterable[List[str]]):
+    """
+    Write a minimal text PDF, one page per item of `pages` (a list of lines each).
+    """
+    offsets, objects = [], []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_ids = []
+    pages_id_placeholder = len(objects) + 1
+    add(b"")  # Pages tree, filled in once all pages are known
+    for lines in pages:
+        stream = "BT /F1 10 Tf 12 TL 40 800 Td " + " ".join(f"({_pdf_escape(line)}) '" for line in lines) + " ET"
+        content = add(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream".encode("latin-1"))
+        page_ids.append(add(
+            f"<< /Type /Page /Parent {pages_id_placeholder} 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 {font} 0 R >> >> /Contents {content} 0 R >>".encode("latin-1")
+        ))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[pages_id_placeholder - 1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode("latin-1")
+    catalog = add(f"<< /Type /Catalog /Pages {pages_id_placeholder} 0 R >>".encode("latin-1"))
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(f"{number} 0 obj\n".encode("latin-1") + body + b"\nendobj\n")
+        xref = f.tell()
+        f.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1"))
+        for offset in offsets:
+            f.write(f"{offset:010d} 00000 n \n".encode("latin-1"))
+        f.write(f"trailer\n<< /Size {len(objects) + 1} /Root {catalog} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1"))
+
+def write_workbook(path: str, rows: int, rng: random.Random, vocabulary: List[str]):
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Data")
+    sheet.append(["Id", "Customer", "Product", "Quantity", "Notes"])
+    for i in range(rows):
+        sheet.append([i, rng.choice(vocabulary), rng.choice(vocabulary), rng.randint(1, 500),
+                      " ".join(rng.choices(vocabulary, k=8))])
+    workbook.save(path)
+
+def write_document(path: str, paragraphs: Iterable[str]):
+    import docx
+
+    document = docx.Document()
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    document.save(path)
+
+def write_presentation(path: str, slides: Iterable[List[str]]):
+    """
+    Write a deck with one title-and-content slide per item of `slides`: its first
+    line is the title, the rest the body.
+    """
+    from pptx import Presentation
+
+    deck = Presentation()
+    for lines in slides:
+        slide = deck.slides.add_slide(deck.slide_layouts[1])
+        slide.shapes.title.text = lines[0]
+        slide.placeholders[1].text = "\n".join(lines[1:])
+    deck.save(path)
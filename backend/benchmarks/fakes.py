@@ -0,0 +1,123 @@
+import re
+import math
+import time
+import asyncio
+import hashlib
+from collections import Counter
+from typing import Iterable, List, Optional
+import numpy as np
+from pydantic import PrivateAttr
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic offline embedder: hashed bag of words, L2-normalised.
+
+    Texts sharing words get similar vectors, so retrieval quality can be measured
+    without the Google API. After `fit` tokens are IDF-weighted, which makes rare
+    terms such as part numbers dominate the way they do for real embedding models.
+    `latency` is added per request to mimic a remote call.
+    """
+
+    def __init__(self, size: int = 768, latency: float = 0.0):
+        self.size = size
+        self.latency = latency
+        self.requests = 0
+        self.texts = 0
+        self.idf = None
+
+    def fit(self, texts: Iterable[str]) -> "HashingEmbeddings":
+        document_frequency = Counter()
+        count = 0
+        for text in texts:
+            document_frequency.update(set(TOKEN_PATTERN.findall(text.lower())))
+            count += 1
+        self.idf = {token: math.log((1 + count) / (1 + df)) + 1 for token, df in document_frequency.items()}
+        return self
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.size, dtype=np.float32)
+        for token, tf in Counter(TOKEN_PATTERN.findall(text.lower())).items():
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.size
+            weight = 1 + math.log(tf)
+            if self.idf is not None:
+                # Words the corpus never uses cannot match anything; they would only add hash noise
+                weight *= self.idf.get(token, 0.0)
+            vector[bucket] += weight if digest[4] & 1 else -weight
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.requests += 1
+        self.texts += len(texts)
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+class LatencyFakeChatModel(BaseChatModel):
+    """
+    Offline chat model whose calls take a time drawn from a latency distribution:
+    log-normal around `median` seconds, plus `tail_seconds` with probability
+    `tail_probability`, the way a remote model now and then stalls. `latencies`
+    replaces the distribution with fixed per-call values, used in turn. A stream
+    waits that long for its first token and `token_delay` for each further word.
+    """
+    answer: str = "fake answer"
+    median: float = 0.1
+    sigma: float = 0.3
+    tail_probability: float = 0.0
+    tail_seconds: float = 0.0
+    latencies: Optional[List[float]] = None
+    token_delay: float = 0.0
+    seed: int = 0
+    calls: int = 0
+    cancelled: int = 0
+    _rng: np.random.Generator = PrivateAttr()
+
+    def model_post_init(self, __context):
+        self._rng = np.random.default_rng(self.seed)
+
+    @property
+    def _llm_type(self):
+        return "latency-fake"
+
+    def _latency(self) -> float:
+        self.calls += 1
+        if self.latencies is not None:
+            return self.latencies[(self.calls - 1) % len(self.latencies)]
+        latency = self.median * math.exp(self.sigma * self._rng.standard_normal())
+        if self._rng.random() < self.tail_probability:
+            latency += self.tail_seconds
+        return latency
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self._latency())
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.answer))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        try:
+            await asyncio.sleep(self._latency())
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.answer))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        try:
+            await asyncio.sleep(self._latency())
+            for i, word in enumerate(self.answer.split(" ")):
+                if i:
+                    await asyncio.sleep(self.token_delay)
+                yield ChatGenerationChunk(message=AIMessageChunk(content=f" {word}" if i else word))
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
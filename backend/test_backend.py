@@ -1,15 +1,33 @@
 # test_backend.py
 import io
 import os
+import hashlib
+import json
 import shutil
+import time
+import threading
+import asyncio
+import httpx
 import pytest
+import numpy as np
+
+# The Google clients refuse to construct without a key; tests never reach the API
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
 
 from fastapi.testclient import TestClient
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
 from app.main import app  # Assuming your FastAPI app is created in app/main.py
 from app.config import DOCUMENT_PATH, MAX_FILE_SIZE
+from app.services import vector_store
 from app.services.document_processor import DocumentProcessor
+from app.services.index_log import log_path, snapshot_path
+from app.services.ingestion import IngestionManager
 
 client = TestClient(app)
+REAL_EXTRACT_CHUNKS = DocumentProcessor.extract_chunks
 
 # Ensure a clean documents directory before and after tests
 @pytest.fixture(autouse=True)
@@ -21,11 +39,66 @@ def cleanup_documents_dir():
     if DOCUMENT_PATH.exists():
         shutil.rmtree(DOCUMENT_PATH)
 
+class CountingFakeEmbeddings(DeterministicFakeEmbedding):
+    """
+    Offline embedding backend that records every text it is asked to embed.
+    """
+    embedded_texts: list = []
+
+    def embed_documents(self, texts):
+        self.embedded_texts.extend(texts)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        self.embedded_texts.append(text)
+        return super().embed_query(text)
+
+# Replace the Google embedding backend and start every test from an empty index in tmp_path
+@pytest.fixture(autouse=True)
+def fake_embeddings(monkeypatch, tmp_path):
+    embeddings = CountingFakeEmbeddings(size=32, embedded_texts=[])
+    monkeypatch.setattr(vector_store, "get_embeddings", lambda: embeddings)
+    monkeypatch.setattr(vector_store, "FAISS_INDEX_PATH", tmp_path / "faiss_index")
+    monkeypatch.setattr(vector_store, "EMBEDDING_CACHE_PATH", tmp_path / "embedding_cache.sqlite3")
+    manager = vector_store.VectorStoreManager()
+    manager.clear_index()
+    yield embeddings
+    manager.clear_index()
+
 # Patch DocumentProcessor methods to avoid processing real files
 @pytest.fixture(autouse=True)
 def patch_document_processor(monkeypatch):
+    # Extract in the job thread so the monkeypatched extractors below are used
+    monkeypatch.setattr(IngestionManager(), "extraction_pool", None)
     monkeypatch.setattr(DocumentProcessor, "extract_text", lambda file_path, filename: "dummy text")
     monkeypatch.setattr(DocumentProcessor, "chunk_text", lambda text, chunk_size=3500: ["dummy chunk"])
+    monkeypatch.setattr(DocumentProcessor, "extract_chunks", lambda file_path, filename: [("dummy chunk", {"page": 1})])
+
+@pytest.fixture(autouse=True)
+def clear_answer_cache():
+    from app.routers.chat import answer_cache
+    answer_cache.clear()
+    yield
+    answer_cache.clear()
+
+def wait_for_job(job_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f"/documents/jobs/{job_id}").json()
+        if job["stage"] in ("done", "failed"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"Ingestion job {job_id} did not finish")
+
+def upload_and_wait(filename, content=b"%PDF-1.4 dummy pdf content"):
+    response = client.post(
+        "/documents/upload",
+        files={"file": (filename, io.BytesIO(content), "application/pdf")}
+    )
+    assert response.status_code == 202, response.text
+    job = wait_for_job(response.json()["job_id"])
+    assert job["stage"] == "done", job
+    return job
 
 def test_upload_valid_file():
     """
@@ -38,9 +111,12 @@ def test_upload_valid_file():
             "file": ("test.pdf", io.BytesIO(file_content), "application/pdf")
         }
     )
-    assert response.status_code == 200, response.text
+    assert response.status_code == 202, response.text
     json_data = response.json()
-    assert "processed successfully" in json_data["message"]
+    assert "accepted for processing" in json_data["message"]
+    job = wait_for_job(json_data["job_id"])
+    assert job["stage"] == "done", job
+    assert job["progress"] == 1.0
 
 def test_upload_unsupported_file_type():
     """
@@ -95,12 +171,13 @@ def test_get_files_after_upload():
             "file": (filename, io.BytesIO(file_content), "application/pdf")
         }
     )
-    assert upload_response.status_code == 200, upload_response.text
+    assert upload_response.status_code == 202, upload_response.text
 
     response = client.get("/documents/getfile")
     assert response.status_code == 200, response.text
     json_data = response.json()
     assert filename in json_data["files"]
+    wait_for_job(upload_response.json()["job_id"])
 
 def test_delete_file_not_found():
     """
@@ -119,13 +196,7 @@ def test_delete_file_success():
     file_content = b"%PDF-1.4 dummy pdf content"
     filename = "test_delete.pdf"
     # Upload the file first
-    upload_response = client.post(
-        "/documents/upload",
-        files={
-            "file": (filename, io.BytesIO(file_content), "application/pdf")
-        }
-    )
-    assert upload_response.status_code == 200, upload_response.text
+    upload_and_wait(filename, file_content)
 
     # Now delete the file
     delete_response = client.delete(f"/documents/{filename}")
@@ -135,17 +206,1335 @@ def test_delete_file_success():
 
 def test_chat_endpoint(monkeypatch):
     """
-    Test the /chat/ endpoint by overriding the LLMManager.generate_response
+    Test the /chat/ endpoint by overriding the LLMManager.agenerate_response
     to return a fixed string.
     """
     from app.routers.chat import llm_manager
 
-    def fake_generate_response(context, user_message):
+    async def fake_generate_response(context, user_message):
         return "Fake response from LLM."
 
-    monkeypatch.setattr(llm_manager, "generate_response", fake_generate_response)
+    monkeypatch.setattr(llm_manager, "agenerate_response", fake_generate_response)
 
     response = client.post("/chat/", json={"user_message": "What is the status?"})
     assert response.status_code == 200, response.text
     json_data = response.json()
     assert json_data["response"] == "Fake response from LLM."
+
+def test_delete_file_only_touches_its_own_embeddings(monkeypatch, fake_embeddings):
+    """
+    Test that deleting a file removes only its vectors and re-embeds nothing.
+    """
+    monkeypatch.setattr(DocumentProcessor, "extract_chunks",
+                        lambda file_path, filename: [(f"{filename} chunk {i}", {"page": i + 1}) for i in range(3)])
+
+    for filename in ("keep.pdf", "remove.pdf"):
+        upload_and_wait(filename)
+
+    fake_embeddings.embedded_texts.clear()
+    response = client.delete("/documents/remove.pdf")
+    assert response.status_code == 200, response.text
+
+    # No embedding calls at all, and only the untouched document is left in the store
+    assert fake_embeddings.embedded_texts == []
+    store = vector_store.VectorStoreManager()._vectorstore
+    remaining = [store.docstore.search(doc_id) for doc_id in store.index_to_docstore_id.values()]
+    assert len(remaining) == 3
+    assert {doc.metadata["filename"] for doc in remaining} == {"keep.pdf"}
+
+def test_stale_doc_id_map_is_rebuilt_on_load(monkeypatch):
+    """
+    Test that a doc_ids.json out of step with the index is rebuilt from the docstore metadata.
+    """
+    monkeypatch.setattr(DocumentProcessor, "extract_chunks", lambda file_path, filename: [("one", {}), ("two", {})])
+    for filename in ("a.pdf", "b.pdf"):
+        upload_and_wait(filename)
+
+    # Simulate a snapshot whose mapping was written half-way, then reload it
+    manager = vector_store.VectorStoreManager()
+    manager.compact()
+    snapshot = snapshot_path(vector_store.FAISS_INDEX_PATH, manager._generation)
+    (snapshot / vector_store.DOC_ID_MAP_FILE).write_text(json.dumps({"a.pdf": ["missing-id"]}))
+    manager._load()
+    assert sorted(manager._doc_ids) == ["a.pdf", "b.pdf"]
+    assert all(len(ids) == 2 for ids in manager._doc_ids.values())
+
+    response = client.delete("/documents/a.pdf")
+    assert response.status_code == 200, response.text
+    assert list(manager._doc_ids) == ["b.pdf"]
+
+def test_embedding_cache_skips_known_chunks(tmp_path):
+    """
+    Test that the embedding cache only embeds unseen chunks and evicts beyond its bound.
+    """
+    from app.services.embedding_cache import CachedEmbeddings
+
+    backend = CountingFakeEmbeddings(size=8, embedded_texts=[])
+    cache = CachedEmbeddings(backend, model="fake-model", path=tmp_path / "cache.sqlite3", max_entries=3)
+
+    first = cache.embed_documents(["a", "b", "a"])
+    assert backend.embedded_texts == ["a", "b"]
+    assert cache.embed_documents(["b", "a"]) == [first[1], first[0]]
+    assert backend.embedded_texts == ["a", "b"]
+    assert cache.stats()["hits"] == 3 and cache.stats()["misses"] == 2
+
+    # A different embedding model never reuses vectors from another one
+    other = CachedEmbeddings(backend, model="other-model", path=tmp_path / "cache.sqlite3", max_entries=3)
+    other.embed_documents(["a"])
+    assert backend.embedded_texts == ["a", "b", "a"]
+
+    cache.embed_documents(["c", "d"])
+    assert cache.stats()["entries"] == 3
+
+    # Questions are cached in memory only and never evict chunk vectors
+    assert cache.embed_query("question") == cache.embed_query("question")
+    assert backend.embedded_texts.count("question") == 1
+    assert cache.stats()["entries"] == 3
+    cache.embed_queries(["question", "other question", "other question"])
+    stats = cache.stats()
+    assert (stats["query_hits"], stats["query_misses"]) == (3, 2) and stats["query_hit_rate"] == 0.6
+    # Chunk figures only count chunk lookups
+    assert stats["hits"] == 3 and stats["misses"] == 4
+
+class SlowFakeLLM:
+    """
+    Stand-in chat model whose async call takes a fixed time without blocking the loop.
+    """
+    def __init__(self, latency):
+        self.latency = latency
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def ainvoke(self, prompt):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.latency)
+        self.in_flight -= 1
+        return type("Message", (), {"content": "slow answer"})()
+
+def test_concurrent_chats_do_not_block_each_other(monkeypatch):
+    """
+    Test that N concurrent chats finish in about one LLM latency and respect the concurrency limit.
+    """
+    from app.routers.chat import llm_manager, answer_cache
+
+    async def run_chats(count):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+            start = time.perf_counter()
+            responses = await asyncio.gather(*[
+                async_client.post("/chat/", json={"user_message": f"question {i}"})
+                for i in range(count)
+            ])
+            return time.perf_counter() - start, responses
+
+    fake_llm = SlowFakeLLM(latency=0.3)
+    monkeypatch.setattr(llm_manager, "llm", fake_llm)
+    monkeypatch.setattr(llm_manager, "fast_llm", fake_llm)
+    # Every chat has to reach the LLM, including the repeated questions of the second round
+    monkeypatch.setattr(answer_cache, "max_entries", 0)
+
+    elapsed, responses = asyncio.run(run_chats(5))
+    assert all(r.status_code == 200 for r in responses)
+    assert elapsed < 2 * fake_llm.latency
+
+    fake_llm.max_in_flight = 0
+    monkeypatch.setattr(llm_manager, "max_concurrency", 2)
+    elapsed, responses = asyncio.run(run_chats(4))
+    assert all(r.status_code == 200 for r in responses)
+    assert fake_llm.max_in_flight == 2
+    assert elapsed >= 2 * fake_llm.latency
+
+class DelayedFakeChatModel(BaseChatModel):
+    """
+    Local chat model that streams a fixed list of tokens with a delay before each one.
+    """
+    tokens: list
+    delay: float = 0.0
+
+    @property
+    def _llm_type(self):
+        return "delayed-fake"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(self.tokens)))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        for token in self.tokens:
+            await asyncio.sleep(self.delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+def test_chat_stream_sends_sources_before_tokens(monkeypatch):
+    """
+    Test that /chat/stream emits the source filenames first and then streams tokens as SSE.
+    """
+    from app.routers.chat import llm_manager
+
+    upload_and_wait("source.pdf")
+    fake_llm = DelayedFakeChatModel(tokens=["Hel", "lo", "!"], delay=0.2)
+    monkeypatch.setattr(llm_manager, "llm", fake_llm)
+    monkeypatch.setattr(llm_manager, "fast_llm", fake_llm)
+
+    async def stream_chat():
+        # Drive the ASGI app directly so the arrival time of every body chunk is observable
+        body = json.dumps({"user_message": "hello"}).encode()
+        received = []
+        start = time.perf_counter()
+
+        requests = [{"type": "http.request", "body": body, "more_body": False}]
+
+        async def receive():
+            if requests:
+                return requests.pop()
+            # Client stays connected: block like a real server would until the response ends
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                received.append((time.perf_counter() - start, message["body"].decode()))
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+            "scheme": "http", "path": "/chat/stream", "raw_path": b"/chat/stream", "root_path": "",
+            "query_string": b"", "headers": [(b"content-type", b"application/json")],
+            "client": ("test", 1), "server": ("test", 80),
+        }
+        await app(scope, receive, send)
+        return received
+
+    received = asyncio.run(stream_chat())
+    events = [chunk for _, chunk in received]
+    assert events[0] == 'event: sources\ndata: {"sources": ["source.pdf"]}\n\n'
+    tokens = [json.loads(e.split("data: ")[1])["token"] for e in events if e.startswith("event: token")]
+    assert "".join(tokens) == "Hello!"
+    assert events[-1].startswith("event: done")
+    # Time to first byte does not wait for the generation to finish
+    assert received[0][0] < 0.2 <= received[-1][0] - received[0][0]
+
+def test_upload_returns_before_ingestion_finishes(monkeypatch):
+    """
+    Test that uploads hand off to the background pipeline and expose stage, progress and timings.
+    """
+    release = threading.Event()
+
+    def slow_extract(file_path, filename):
+        release.wait(5)
+        return [("slow text", {"page": 1})]
+
+    monkeypatch.setattr(DocumentProcessor, "extract_chunks", slow_extract)
+    start = time.perf_counter()
+    response = client.post(
+        "/documents/upload",
+        files={"file": ("slow.pdf", io.BytesIO(b"%PDF-1.4"), "application/pdf")}
+    )
+    assert response.status_code == 202, response.text
+    assert time.perf_counter() - start < 1
+
+    job_id = response.json()["job_id"]
+    job = client.get(f"/documents/jobs/{job_id}").json()
+    assert job["stage"] in ("queued", "extracting")
+    assert job["finished_at"] is None
+
+    release.set()
+    job = wait_for_job(job_id)
+    assert job["stage"] == "done"
+    assert job["chunks"] == 1
+    assert set(job["timings"]) == {"queued", "extracting", "embedding", "indexing"}
+
+    assert client.get("/documents/jobs/unknown").status_code == 404
+
+def test_failed_ingestion_is_reported_on_the_job(monkeypatch):
+    """
+    Test that an extraction error marks the job as failed instead of being lost.
+    """
+    monkeypatch.setattr(DocumentProcessor, "extract_chunks", lambda file_path, filename: [])
+    response = client.post(
+        "/documents/upload",
+        files={"file": ("empty.pdf", io.BytesIO(b"%PDF-1.4"), "application/pdf")}
+    )
+    job = wait_for_job(response.json()["job_id"])
+    assert job["stage"] == "failed"
+    assert "No text" in job["error"]
+
+def test_batch_upload_commits_all_files_with_one_save(monkeypatch):
+    """
+    Test that /documents/upload/batch indexes plain files and zip members in one job and one index write.
+    """
+    import zipfile
+    from app.services.index_log import IndexLog
+
+    monkeypatch.setattr(DocumentProcessor, "extract_chunks", lambda file_path, filename: [(f"{filename} chunk", {})])
+    manager = vector_store.VectorStoreManager()
+    saves = []
+    original_append = IndexLog.append
+    monkeypatch.setattr(IndexLog, "append",
+                        lambda self, *args: saves.append(1) or original_append(self, *args))
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("nested/c.docx", b"docx bytes")
+        zf.writestr("d.pptx", b"pptx bytes")
+    archive.seek(0)
+
+    response = client.post(
+        "/documents/upload/batch",
+        files=[
+            ("files", ("a.pdf", io.BytesIO(b"%PDF-1.4"), "application/pdf")),
+            ("files", ("b.pdf", io.BytesIO(b"%PDF-1.4"), "application/pdf")),
+            ("files", ("bundle.zip", archive, "application/zip")),
+        ]
+    )
+    assert response.status_code == 202, response.text
+    assert response.json()["files"] == ["a.pdf", "b.pdf", "c.docx", "d.pptx"]
+
+    job = wait_for_job(response.json()["job_id"])
+    assert job["stage"] == "done", job
+    assert job["chunks"] == 4
+    assert len(saves) == 1
+    assert sorted(manager._doc_ids) == ["a.pdf", "b.pdf", "c.docx", "d.pptx"]
+    assert sorted(client.get("/documents/getfile").json()["files"]) == ["a.pdf", "b.pdf", "c.docx", "d.pptx"]
+
+def test_batch_upload_rejects_unsupported_zip_members():
+    """
+    Test that a batch containing an unsupported zip member is rejected before anything is saved.
+    """
+    import zipfile
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("script.py", b"print('hi')")
+    archive.seek(0)
+
+    response = client.post(
+        "/documents/upload/batch",
+        files=[
+            ("files", ("a.pdf", io.BytesIO(b"%PDF-1.4"), "application/pdf")),
+            ("files", ("bundle.zip", archive, "application/zip")),
+        ]
+    )
+    assert response.status_code == 415, response.text
+    assert client.get("/documents/getfile").json()["files"] == []
+
+def test_chunker_respects_token_budget_overlap_and_boundaries():
+    """
+    Test that chunks stay within the token budget, overlap inside paragraphs and break at blank lines.
+    """
+    paragraph = " ".join(f"Sentence number {i} talks about topic {i}." for i in range(60))
+    text = f"{paragraph}\n\nSlide two title\nFirst bullet\nSecond bullet"
+
+    chunks = list(DocumentProcessor.iter_chunks(text, chunk_size=50, chunk_overlap=10))
+
+    assert all(DocumentProcessor.count_tokens(chunk) <= 50 for chunk in chunks)
+    # Consecutive chunks of the long paragraph share a trailing sentence
+    assert chunks[0].split(". ")[-1] in chunks[1]
+    # The short block after the blank line is its own chunk, not glued to the paragraph tail
+    assert chunks[-1] == "Slide two title\nFirst bullet\nSecond bullet"
+    # Nothing is lost: every sentence appears in some chunk
+    assert all(any(f"Sentence number {i} " in chunk for chunk in chunks) for i in range(60))
+
+def test_extraction_streams_segments_with_locators(tmp_path):
+    """
+    Test that workbooks and decks are read as located segments and chunks keep their source locator.
+    """
+    import openpyxl
+    from pptx import Presentation
+
+    workbook_path = tmp_path / "sales.xlsx"
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Sales")
+    sheet.append(["Region", "Units"])
+    for i in range(450):
+        sheet.append([f"region{i}", i])
+    workbook.save(workbook_path)
+
+    segments = list(DocumentProcessor.iter_segments(str(workbook_path), "sales.xlsx"))
+    assert [locator for locator, _ in segments] == [
+        {"sheet": "Sales", "row": 2}, {"sheet": "Sales", "row": 202}, {"sheet": "Sales", "row": 402}
+    ]
+    # Every segment repeats the header row so its chunks stay self-describing
+    assert all(text.startswith("Region | Units\n") for _, text in segments)
+    assert segments[1][1].splitlines()[1] == "region200 | 200"
+
+    deck_path = tmp_path / "deck.pptx"
+    deck = Presentation()
+    for title in ("Quarterly results", "Hiring plan"):
+        slide = deck.slides.add_slide(deck.slide_layouts[5])
+        slide.shapes.title.text = title
+    deck.save(deck_path)
+
+    chunks = list(DocumentProcessor.iter_segment_chunks(DocumentProcessor.iter_segments(str(deck_path), "deck.pptx")))
+    # Small slides share a chunk, which records the slide range it covers
+    assert chunks == [("Quarterly results\n\nHiring plan", {"slide": 1, "slide_end": 2})]
+
+def test_parallel_extraction_keeps_page_order(monkeypatch, tmp_path):
+    """
+    Test that a PDF split into page ranges over a process pool comes back in page order.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from benchmarks.corpus import write_pdf
+
+    pdf_path = tmp_path / "report.pdf"
+    write_pdf(str(pdf_path), ([f"Page {i} describes component C{i} in detail."] for i in range(1, 121)))
+    broken_path = tmp_path / "broken.pdf"
+    broken_path.write_bytes(b"not a pdf")
+
+    # The autouse fixture replaces extract_chunks with a lambda that worker processes cannot unpickle
+    monkeypatch.setattr(DocumentProcessor, "extract_chunks", REAL_EXTRACT_CHUNKS)
+    assert len(DocumentProcessor.split_parts(str(pdf_path), "report.pdf", pages_per_part=50)) == 3
+    files = [(str(pdf_path), "report.pdf"), (str(broken_path), "broken.pdf")]
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        parallel = list(DocumentProcessor.extract_parallel(files, executor))
+    sequential = list(DocumentProcessor.extract_parallel(files))
+
+    assert [(name, error) for name, _, error in parallel] == [
+        ("report.pdf", None), ("broken.pdf", "Error processing broken.pdf")
+    ]
+    # Each 50-page part starts a new chunk and the parts come back in page order
+    starts = [locator["page"] for _, locator in parallel[0][1]]
+    assert starts == sorted(starts) and {1, 51, 101} <= set(starts)
+    assert all(any(f"component C{i} " in chunk for chunk, _ in parallel[0][1]) for i in range(1, 121))
+    assert sequential[0][1][0][1]["page"] == 1
+    assert sequential[1][2] == "Error processing broken.pdf"
+
+def test_repeated_questions_are_answered_from_the_cache(monkeypatch):
+    """
+    Test that a repeated question skips the LLM until the retrieved chunks change.
+    """
+    from app.routers.chat import llm_manager
+
+    calls = []
+
+    async def fake_generate_response(context, user_message):
+        calls.append(user_message)
+        await asyncio.sleep(0.05)
+        return f"Answer {len(calls)}"
+
+    monkeypatch.setattr(llm_manager, "agenerate_response", fake_generate_response)
+    # Identical chunks from two files would be collapsed into one by the re-ranker
+    monkeypatch.setattr(DocumentProcessor, "extract_chunks",
+                        lambda file_path, filename: [(f"{filename} status report", {"page": 1})])
+    upload_and_wait("first.pdf")
+    before = client.get("/chat/cache/stats").json()
+    scraped_before = client.get("/metrics").text
+
+    answers = [client.post("/chat/", json={"user_message": question}).json()["response"]
+               for question in ("What is the status?", "  what is the STATUS ", "What changed?")]
+    assert answers == ["Answer 1", "Answer 1", "Answer 2"]
+
+    # New chunks change what is retrieved, so the cached answer no longer applies
+    upload_and_wait("second.pdf")
+    assert client.post("/chat/", json={"user_message": "What is the status?"}).json()["response"] == "Answer 3"
+
+    stats = client.get("/chat/cache/stats").json()
+    assert (stats["hits"] - before["hits"], stats["misses"] - before["misses"], stats["entries"]) == (1, 3, 3)
+    assert stats["saved_seconds"] - before["saved_seconds"] >= 0.05
+
+    # The same figures are exported on /metrics
+    def scraped(text, name):
+        return sum(float(line.rsplit(" ", 1)[1]) for line in text.splitlines() if line.startswith(name))
+
+    scraped_after = client.get("/metrics").text
+    assert scraped(scraped_after, 'docbot_answer_cache_hits_total{match="exact"}') \
+        - scraped(scraped_before, 'docbot_answer_cache_hits_total{match="exact"}') == 1
+    assert scraped(scraped_after, "docbot_answer_cache_misses_total") \
+        - scraped(scraped_before, "docbot_answer_cache_misses_total") == 3
+    assert scraped(scraped_after, "docbot_answer_cache_saved_seconds_total") \
+        - scraped(scraped_before, "docbot_answer_cache_saved_seconds_total") >= 0.05
+
+def test_answer_cache_similarity_ttl_and_lru():
+    """
+    Test near-duplicate matching on question embeddings, expiry and the entry bound.
+    """
+    from app.services.answer_cache import AnswerCache
+
+    cache = AnswerCache(max_entries=2, ttl_seconds=60, similarity_threshold=0.95)
+    cache.put("How many units shipped?", ["c1", "c2"], "42", latency=1.5, vector=[1.0, 0.0, 0.0])
+    assert cache.get("How many units were shipped?", ["c1", "c2"], vector=[0.99, 0.05, 0.0]) == "42"
+    # Similar wording with different retrieved chunks, or a dissimilar question, misses
+    assert cache.get("How many units were shipped?", ["c3"], vector=[0.99, 0.05, 0.0]) is None
+    assert cache.get("Who shipped them?", ["c1", "c2"], vector=[0.0, 1.0, 0.0]) is None
+    assert cache.stats()["similar_hits"] == 1
+    assert cache.stats()["saved_seconds"] == 1.5
+
+    cache.put("b", ["c1"], "B", latency=0.1)
+    cache.put("c", ["c1"], "C", latency=0.1)
+    assert cache.get("How many units shipped?", ["c1", "c2"]) is None
+    assert cache.stats()["entries"] == 2
+
+    expiring = AnswerCache(max_entries=10, ttl_seconds=0.05)
+    expiring.put("q", [], "A", latency=0.1)
+    assert expiring.get("q", []) == "A"
+    time.sleep(0.1)
+    assert expiring.get("q", []) is None
+
+def test_hybrid_retrieval_finds_exact_terms_and_keyword_mode_skips_embeddings(monkeypatch, fake_embeddings):
+    """
+    Test that BM25 results are fused with vector results, survive a reload and follow deletes.
+    """
+    from app.services.hybrid_search import KeywordIndex
+
+    chunks = [f"Widget W{i} uses part number PN-{1000 + i} from the regional supplier." for i in range(50)]
+    monkeypatch.setattr(DocumentProcessor, "extract_chunks",
+                        lambda file_path, filename: [(chunk, {}) for chunk in chunks] if filename == "parts.pdf"
+                        else [("Unrelated meeting notes about budgets.", {})])
+    upload_and_wait("parts.pdf")
+    upload_and_wait("notes.pdf")
+    manager = vector_store.VectorStoreManager()
+
+    # The fake embeddings are random; only the keyword ranking knows about 1042, and fusion keeps it near the top
+    docs = manager.retriever.invoke("1042")
+    assert chunks[42] in [doc.page_content for doc in docs[:2]]
+    assert {doc.id for doc in docs} <= set(manager._doc_ids["parts.pdf"] + manager._doc_ids["notes.pdf"])
+
+    fake_embeddings.embedded_texts.clear()
+    monkeypatch.setattr(manager._retriever, "mode", "keyword")
+    docs = asyncio.run(manager.retriever.ainvoke("PN-1007"))
+    assert docs[0].page_content == chunks[7]
+    assert fake_embeddings.embedded_texts == []
+
+    # The snapshotted index matches the in-memory one; a stale file is rebuilt from the docstore
+    manager.compact()
+    snapshot = snapshot_path(vector_store.FAISS_INDEX_PATH, manager._generation)
+    reloaded = manager._load_keyword_index(manager._vectorstore, snapshot)
+    assert reloaded.search("pn 1042", 1) == manager._keyword_index.search("pn 1042", 1)
+    KeywordIndex().save(snapshot / vector_store.KEYWORD_INDEX_FILE)
+    assert len(manager._load_keyword_index(manager._vectorstore, snapshot)) == 51
+
+    client.delete("/documents/parts.pdf")
+    assert manager._keyword_index.search("PN-1042", 5) == []
+    assert len(manager._keyword_index) == 1
+
+@pytest.mark.parametrize("kind", ["ivf_flat", "ivf_pq", "hnsw"])
+def test_ann_index_trains_migrates_and_deletes(monkeypatch, fake_embeddings, kind):
+    """
+    Test that the store retrains into the configured index type and stays consistent across deletes and reloads.
+    """
+    from app.services import ann_index
+
+    # Small enough to train in a test: 4 IVF lists, 16-centroid PQ codebooks
+    monkeypatch.setattr(ann_index, "VECTOR_INDEX_TYPE", kind)
+    monkeypatch.setattr(ann_index, "VECTOR_INDEX_NLIST", 4)
+    monkeypatch.setattr(ann_index, "VECTOR_INDEX_NPROBE", 4)
+    monkeypatch.setattr(ann_index, "PQ_BITS", 4)
+    monkeypatch.setattr(DocumentProcessor, "extract_chunks",
+                        lambda file_path, filename: [(f"{filename} chunk {i}", {}) for i in range(400)])
+
+    manager = vector_store.VectorStoreManager()
+    upload_and_wait("big.pdf")
+    assert ann_index.index_type(manager._vectorstore.index) == ("flat" if kind == "ivf_pq" else kind)
+    upload_and_wait("other.pdf")
+    assert ann_index.index_type(manager._vectorstore.index) == kind
+    assert manager._vectorstore.index_stats()["vectors"] == 800
+
+    # The delete is replayed from the log onto the migrated snapshot on reload
+    assert client.delete("/documents/big.pdf").status_code == 200
+    live = manager._vectorstore
+    manager._load()
+    for current in (live, manager._vectorstore):
+        assert ann_index.index_type(current.index) == kind
+        # HNSW keeps the deleted nodes as tombstones until compaction; the other types renumber at once
+        assert len(current.index_to_docstore_id) == 400
+        assert current.index.ntotal == (800 if kind == "hnsw" else 400)
+        assert current.index_stats()["tombstones"] == (400 if kind == "hnsw" else 0)
+        # A chunk's own vector still finds the chunk, and deleted chunks are never returned
+        vector = fake_embeddings.embed_query("other.pdf chunk 17")
+        found = [doc.page_content for doc in current.similarity_search_by_vector(vector, k=10)]
+        assert "other.pdf chunk 17" in (found if kind == "ivf_pq" else found[:1])
+        assert not any(text.startswith("big.pdf") for text in found)
+
+    def finds(filename, i):
+        vector = fake_embeddings.embed_query(f"{filename} chunk {i}")
+        found = [doc.page_content for doc in manager._vectorstore.similarity_search_by_vector(vector, k=10)]
+        return f"{filename} chunk {i}" in (found if kind == "ivf_pq" else found[:1])
+
+    # Chunks added after a tombstoned delete are numbered after the dead nodes
+    upload_and_wait("more.pdf")
+    assert finds("more.pdf", 5) and finds("other.pdf", 17)
+    retrieved = manager.retriever.invoke("more.pdf chunk 5")
+    assert retrieved and {doc.metadata["filename"] for doc in retrieved} <= {"more.pdf", "other.pdf"}
+    manager.compact()
+    current = manager._vectorstore
+    assert current.index.ntotal == len(current.index_to_docstore_id) == 800
+    assert current.index_stats()["tombstones"] == 0 and finds("more.pdf", 5)
+
+    # Once dead nodes would outnumber live ones the graph is rebuilt without waiting for compaction
+    upload_and_wait("last.pdf")
+    assert client.delete("/documents/other.pdf").status_code == 200
+    assert manager._vectorstore.index.ntotal == (1200 if kind == "hnsw" else 800)
+    assert client.delete("/documents/more.pdf").status_code == 200
+    current = manager._vectorstore
+    assert current.index.ntotal == len(current.index_to_docstore_id) == 400 and finds("last.pdf", 3)
+
+def indexed_filenames(manager) -> set:
+    store = manager._vectorstore
+    if store is None:
+        return set()
+    return {store.docstore.search(doc_id).metadata["filename"] for doc_id in store.index_to_docstore_id.values()}
+
+def test_writes_are_logged_and_replayed_after_a_torn_tail(monkeypatch):
+    """
+    Test that uploads and deletes only append to the log and survive a reload with a torn last record.
+    """
+    monkeypatch.setattr(DocumentProcessor, "extract_chunks",
+                        lambda file_path, filename: [(f"{filename} chunk {i}", {}) for i in range(3)])
+    manager = vector_store.VectorStoreManager()
+    generation = manager._generation
+    for filename in ("a.pdf", "b.pdf", "c.pdf"):
+        upload_and_wait(filename)
+    assert client.delete("/documents/a.pdf").status_code == 200
+
+    # Nothing was snapshotted; the writes are in the log
+    assert manager._generation == generation
+    log = log_path(vector_store.FAISS_INDEX_PATH, generation)
+    size = log.stat().st_size
+    with log.open("ab") as f:
+        f.write(b"\x40\x00\x00\x00torn")
+
+    manager._load()
+    assert sorted(manager._doc_ids) == ["b.pdf", "c.pdf"]
+    assert indexed_filenames(manager) == {"b.pdf", "c.pdf"}
+    assert len(manager._keyword_index) == manager._vectorstore.index.ntotal == 6
+    assert log.stat().st_size == size
+
+    # Appends continue after the truncated tail
+    upload_and_wait("d.pdf")
+    manager._load()
+    assert sorted(manager._doc_ids) == ["b.pdf", "c.pdf", "d.pdf"]
+
+def test_compaction_swaps_generations_atomically(monkeypatch):
+    """
+    Test that a large log is compacted into a new snapshot and a failed compaction loses nothing.
+    """
+    from app.services import index_log
+
+    monkeypatch.setattr(vector_store, "INDEX_COMPACT_MIN_BYTES", 0)
+    monkeypatch.setattr(vector_store, "INDEX_COMPACT_RATIO", 0)
+    manager = vector_store.VectorStoreManager()
+    generation = manager._generation
+    upload_and_wait("a.pdf")
+    upload_and_wait("b.pdf")
+    assert manager._generation == generation + 2
+    root = vector_store.FAISS_INDEX_PATH
+    assert sorted(path.name for path in root.iterdir()) == [
+        "CURRENT", "LOCK", snapshot_path(root, generation + 2).name, log_path(root, generation + 2).name]
+
+    def crash(root, generation):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(vector_store, "write_generation", crash)
+    with pytest.raises(OSError):
+        manager.compact()
+    assert index_log.read_generation(root) == generation + 2
+
+    monkeypatch.setattr(vector_store, "write_generation", index_log.write_generation)
+    manager._load()
+    assert sorted(manager._doc_ids) == ["a.pdf", "b.pdf"]
+    assert not snapshot_path(root, generation + 3).exists()
+
+KILLED_WRITER = """
+import sys
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from app.services import vector_store
+
+embeddings = DeterministicFakeEmbedding(size=32)
+vector_store.get_embeddings = lambda: embeddings
+vector_store.INDEX_COMPACT_MIN_BYTES = 0
+vector_store.INDEX_COMPACT_RATIO = 2
+manager = vector_store.VectorStoreManager()
+i = int(sys.argv[1])
+while True:
+    name = f"doc{i}.pdf"
+    chunks = [f"{name} chunk {j}" for j in range(20)]
+    manager.add_embeddings(chunks, embeddings.embed_documents(chunks), [{"filename": name}] * 20)
+    print(f"added doc{i}.pdf", flush=True)
+    if i % 3 == 2:
+        manager.remove_from_index({"filename": f"doc{i - 1}.pdf"})
+        print(f"removed doc{i - 1}.pdf", flush=True)
+    i += 1
+"""
+
+def test_index_killed_during_writes_stays_loadable(monkeypatch, tmp_path):
+    """
+    Test that SIGKILLing a writer mid-upload, mid-delete or mid-compaction leaves every acknowledged write loadable.
+    """
+    import subprocess
+    import sys
+
+    index_path = tmp_path / "killed_index"
+    env = dict(os.environ, FAISS_INDEX_PATH=str(index_path), EMBEDDING_CACHE_PATH=str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(vector_store, "FAISS_INDEX_PATH", index_path)
+    manager = vector_store.VectorStoreManager()
+    added, removed = set(), set()
+
+    for round_ in range(3):
+        start = 1000 * (round_ + 1)
+        writer = subprocess.Popen([sys.executable, "-c", KILLED_WRITER, str(start)], env=env,
+                                  cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  stdout=subprocess.PIPE, text=True)
+        acknowledged = 0
+        last = None
+        while acknowledged < 12 + 5 * round_:
+            line = writer.stdout.readline()
+            assert line, "writer exited early"
+            action, name = line.split()
+            (added if action == "added" else removed).add(name)
+            acknowledged, last = acknowledged + 1, name
+        writer.kill()
+        writer.wait()
+        # Lines written before the kill but not read yet are acknowledged writes too
+        for line in writer.stdout.read().splitlines():
+            action, name = line.split()
+            (added if action == "added" else removed).add(name)
+            last = name
+        writer.stdout.close()
+
+        # At most the write after the last acknowledged one was in flight and may or may not have landed
+        number = max(int(name[3:-4]) for name in added)
+        in_flight_add = f"doc{number + 1}.pdf"
+        in_flight_remove = f"doc{number - 1}.pdf" if number % 3 == 2 and last == f"doc{number}.pdf" else None
+
+        manager._load()
+        filenames = indexed_filenames(manager)
+        assert (added - removed - {in_flight_remove}) <= filenames <= (added - removed) | {in_flight_add}
+        assert sorted(manager._doc_ids) == sorted(filenames)
+        assert all(len(ids) == 20 for ids in manager._doc_ids.values())
+        assert len(manager._keyword_index) == manager._vectorstore.index.ntotal == 20 * len(filenames)
+        if in_flight_add in filenames:
+            added.add(in_flight_add)
+        if in_flight_remove not in filenames:
+            removed.add(in_flight_remove)
+
+def test_index_loads_lazily_from_a_mapped_snapshot(monkeypatch):
+    """
+    Test that the index is read on first use, memory-mapped with an on-demand docstore, and copied before a write.
+    """
+    from app.services.docstore import SQLiteDocstore
+
+    monkeypatch.setattr(DocumentProcessor, "extract_chunks",
+                        lambda file_path, filename: [(f"{filename} chunk {i}", {"page": i}) for i in range(5)])
+    upload_and_wait("a.pdf")
+    upload_and_wait("b.pdf")
+    manager = vector_store.VectorStoreManager()
+    manager.compact()
+
+    # As in a fresh process: nothing is loaded until the retriever is needed
+    manager._loaded = False
+    manager._vectorstore = None
+    retriever = manager.retriever
+    store = manager._vectorstore
+    assert store._mapped and isinstance(store.docstore, SQLiteDocstore)
+    docs = retriever.invoke("b.pdf chunk 3")
+    assert docs and all(doc.id in manager._doc_ids[doc.metadata["filename"]] for doc in docs)
+    metadata = store.docstore.search(manager._doc_ids["a.pdf"][2]).metadata
+    assert (metadata["filename"], metadata["page"]) == ("a.pdf", 2)
+
+    # The first write swaps the mapping for a private copy
+    upload_and_wait("c.pdf")
+    assert not store._mapped and store.index.ntotal == 15
+    assert client.delete("/documents/a.pdf").status_code == 200
+    manager._load()
+    assert sorted(manager._doc_ids) == ["b.pdf", "c.pdf"]
+    assert manager._vectorstore.index.ntotal == 10
+
+def test_pickled_index_is_loaded_and_converted(fake_embeddings):
+    """
+    Test that an index saved by FAISS.save_local with a pickled docstore loads and moves to SQLite on compaction.
+    """
+    from langchain_community.vectorstores import FAISS
+    from app.services.docstore import DOCSTORE_FILE
+
+    chunks = [f"legacy chunk {i}" for i in range(4)]
+    legacy = FAISS.from_texts(chunks, fake_embeddings, metadatas=[{"filename": "old.pdf"}] * 4)
+    root = vector_store.FAISS_INDEX_PATH
+    for path in root.iterdir():
+        shutil.rmtree(path) if path.is_dir() else path.unlink()
+    legacy.save_local(str(root))
+
+    manager = vector_store.VectorStoreManager()
+    manager._load()
+    assert manager._doc_ids == {"old.pdf": list(legacy.index_to_docstore_id.values())}
+    manager.compact()
+    snapshot = snapshot_path(root, manager._generation)
+    assert (snapshot / DOCSTORE_FILE).exists() and not (root / "index.pkl").exists()
+    manager._load()
+    assert manager._vectorstore._mapped
+    assert [doc.page_content for doc in manager.retriever.invoke("legacy chunk 2")][:1] == ["legacy chunk 2"]
+
+SHARED_WRITER = """
+import sys
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from app.services import vector_store
+
+embeddings = DeterministicFakeEmbedding(size=32)
+vector_store.get_embeddings = lambda: embeddings
+vector_store.INDEX_COMPACT_MIN_BYTES = 0
+vector_store.INDEX_COMPACT_RATIO = 1
+manager = vector_store.VectorStoreManager()
+prefix, count = sys.argv[1], int(sys.argv[2])
+for i in range(count):
+    name = f"{prefix}{i}.pdf"
+    chunks = [f"{name} chunk {j}" for j in range(10)]
+    manager.add_embeddings(chunks, embeddings.embed_documents(chunks), [{"filename": name}] * 10)
+    if i % 4 == 3:
+        manager.remove_from_index({"filename": f"{prefix}{i - 2}.pdf"})
+"""
+
+SHARED_COMPACTOR = """
+import sys
+import time
+from pathlib import Path
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from app.services import vector_store
+
+vector_store.get_embeddings = lambda: DeterministicFakeEmbedding(size=32)
+manager = vector_store.VectorStoreManager()
+while not Path(sys.argv[1]).exists():
+    manager.compact()
+    time.sleep(0.02)
+"""
+
+def test_worker_processes_share_one_consistent_index(tmp_path):
+    """
+    Test that concurrent uploads and deletes from two processes all land and a third process querying follows them,
+    while a fourth keeps compacting the index under the queries.
+    """
+    import subprocess
+    import sys
+    from app.services.index_log import read_generation
+
+    manager = vector_store.VectorStoreManager()
+    env = dict(os.environ, FAISS_INDEX_PATH=str(vector_store.FAISS_INDEX_PATH),
+               EMBEDDING_CACHE_PATH=str(tmp_path / "cache.sqlite3"))
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    count = 12
+    writers = [subprocess.Popen([sys.executable, "-c", SHARED_WRITER, prefix, str(count)], env=env, cwd=cwd)
+               for prefix in ("a", "b")]
+    stop = tmp_path / "stop"
+    compactor = subprocess.Popen([sys.executable, "-c", SHARED_COMPACTOR, str(stop)], env=env, cwd=cwd)
+
+    def check_consistent():
+        # Every reload or replay leaves the FAISS index, id map and keyword index in step
+        store = manager._vectorstore
+        ids = [doc_id for doc_ids in manager._doc_ids.values() for doc_id in doc_ids]
+        assert all(len(doc_ids) == 10 for doc_ids in manager._doc_ids.values())
+        assert len(manager._keyword_index) == (store.index.ntotal if store else 0) == len(ids)
+        if store:
+            assert set(store.index_to_docstore_id.values()) == set(ids)
+
+    seen, overtaken = set(), 0
+    try:
+        while any(writer.poll() is None for writer in writers):
+            retriever = manager.retriever
+            check_consistent()
+            if retriever is not None:
+                # Keep the query in flight until another process has compacted away the snapshot it reads
+                deadline = time.time() + 1
+                while read_generation(vector_store.FAISS_INDEX_PATH) == manager._generation and time.time() < deadline:
+                    time.sleep(0.005)
+                overtaken += read_generation(vector_store.FAISS_INDEX_PATH) != manager._generation
+                for doc in retriever.invoke("chunk 3"):
+                    assert doc.id in manager._doc_ids[doc.metadata["filename"]]
+                    assert doc.page_content.startswith(doc.metadata["filename"])
+            seen.update(manager._doc_ids)
+    finally:
+        stop.touch()
+    assert compactor.wait(timeout=60) == 0
+    assert [writer.returncode for writer in writers] == [0, 0]
+    assert overtaken
+
+    manager.refresh()
+    check_consistent()
+    removed = {f"{prefix}{i - 2}.pdf" for prefix in "ab" for i in range(count) if i % 4 == 3}
+    assert set(manager._doc_ids) == {f"{prefix}{i}.pdf" for prefix in "ab" for i in range(count)} - removed
+    # The reader followed the writers while they ran instead of only seeing the end state
+    assert seen - set(manager._doc_ids)
+
+def test_chat_can_be_scoped_to_files_and_file_types(monkeypatch):
+    """
+    Test that chunks carry file metadata and that /chat searches only the selected files or types.
+    """
+    from app.routers.chat import llm_manager
+    from app.services import ann_index
+
+    monkeypatch.setattr(DocumentProcessor, "extract_chunks", lambda file_path, filename: [
+        (f"{filename} section {i} on quarterly revenue", {"page": i + 1}) for i in range(30)
+    ])
+    upload_and_wait("alpha.pdf")
+    upload_and_wait("beta.pdf")
+    response = client.post("/documents/upload", files={"file": (
+        "deck.pptx", io.BytesIO(b"pptx"),
+        "application/vnd.openxmlformats-officedocument.presentationml.presentation")})
+    assert wait_for_job(response.json()["job_id"])["stage"] == "done"
+
+    manager = vector_store.VectorStoreManager()
+    doc = manager._vectorstore.docstore.search(manager._doc_ids["deck.pptx"][3])
+    assert doc.metadata["file_type"] == "pptx" and doc.metadata["page"] == 4
+    assert doc.metadata["uploaded_at"] <= time.time()
+
+    contexts = []
+
+    async def fake_generate_response(context, user_message):
+        contexts.append(context)
+        return "ok"
+
+    monkeypatch.setattr(llm_manager, "agenerate_response", fake_generate_response)
+    beta, deck, nothing = [
+        client.post("/chat/", json={"user_message": "quarterly revenue", **scope}).json()["citations"]
+        for scope in ({"files": ["beta.pdf"]}, {"file_types": [".PPTX"]},
+                      {"files": ["alpha.pdf"], "file_types": ["pptx"]})
+    ]
+    assert len(beta) == vector_store.RETRIEVAL_K and {citation["filename"] for citation in beta} == {"beta.pdf"}
+    assert len(deck) == vector_store.RETRIEVAL_K and {citation["filename"] for citation in deck} == {"deck.pptx"}
+    assert nothing == [] and contexts[2].startswith("No uploaded documents match")
+
+    # The allowlist is applied inside the search: the exact scan and the faiss selector agree
+    allowed = set(manager._doc_ids["alpha.pdf"][:7])
+    vector = manager._vectorstore._embed_query("quarterly revenue")
+    exact = manager._vectorstore.similarity_search_among(vector, allowed, k=5)
+    monkeypatch.setattr(ann_index, "VECTOR_FILTER_EXACT_MAX", 0)
+    selected = manager._vectorstore.similarity_search_among(vector, allowed, k=5)
+    assert [d.id for d in exact] == [d.id for d in selected] and {d.id for d in exact} <= allowed
+    assert {doc_id for doc_id, _ in manager._keyword_index.search("section", 90, allowed)} == allowed
+
+def test_reranker_drops_duplicates_uses_stored_vectors_and_respects_its_budget(monkeypatch, fake_embeddings):
+    """
+    Test that re-ranking picks diverse chunks from stored vectors and falls back to relevance order past its budget.
+    """
+    from langchain_core.documents import Document
+    from app.services.reranker import Reranker
+
+    documents = [Document(id=str(i), page_content=text) for i, text in
+                 enumerate(["alpha", "alpha", "alpha revised", "beta", "gamma", "unrelated"])]
+    vectors = np.array([[1, 0, 0], [1, 0, 0], [0.99, 0.1, 0], [0.6, 0.8, 0], [0.6, 0, 0.8], [0, 0, 1]])
+    query = [1, 0, 0.1]
+    picked = Reranker(duplicate_similarity=0.95).rerank("q", query, documents, vectors, k=4)
+    # The copy and the near-identical revision never make it; the weakly related chunk is below min_relevance
+    assert [doc.id for doc in picked] == ["0", "4", "3"]
+    assert [doc.id for doc in Reranker(budget_ms=0).rerank("q", query, documents, vectors, k=3)] == ["0", "2", "4"]
+    # Without a query vector the retrieval order is the relevance
+    assert [doc.id for doc in Reranker(min_relevance=0).rerank("q", None, documents, vectors, k=6)][:2] == ["0", "3"]
+
+    monkeypatch.setattr(DocumentProcessor, "extract_chunks", lambda file_path, filename: [
+        (f"{filename} note {i % 3} about the shipping schedule", {"page": i + 1}) for i in range(9)
+    ])
+    upload_and_wait("copy1.pdf")
+    manager = vector_store.VectorStoreManager()
+    fake_embeddings.embedded_texts.clear()
+    docs = manager.retriever.invoke("shipping schedule")
+    assert fake_embeddings.embedded_texts == ["shipping schedule"]
+    assert len({doc.page_content for doc in docs}) == len(docs) <= 3
+
+def test_hybrid_reranking_scores_relevance_by_cosine_of_stored_vectors(monkeypatch, fake_embeddings):
+    """
+    Test that hybrid re-ranking scores candidates by cosine to their stored vectors and by BM25, dropping only weak ones.
+    """
+    from app.services.reranker import Reranker
+
+    words = ["harbour", "invoice", "glacier", "turbine", "orchard", "ledger", "canyon", "tariff", "meadow", "quarry"]
+    texts = [f"{word} {word}s" for word in words]
+    monkeypatch.setattr(DocumentProcessor, "extract_chunks", lambda file_path, filename: [
+        (text, {"page": i + 1}) for i, text in enumerate(texts)
+    ])
+    upload_and_wait("words.pdf")
+    retriever = vector_store.VectorStoreManager().retriever
+    monkeypatch.setattr(retriever, "reranker", Reranker(fetch_k=10, min_relevance=0.5))
+    assert retriever.mode == "hybrid"
+
+    # The fake embedding of a chunk's own text is its stored vector, the others' cosines are near zero: rank
+    # positions in the fused list no longer keep the top half of the candidates regardless of content
+    assert [doc.page_content for doc in retriever.invoke(texts[7])] == [texts[7]]
+    # An exact-term match with an unrelated embedding is kept on its BM25 score
+    assert texts[3] in [doc.page_content for doc in retriever.invoke("turbine maintenance schedule")]
+
+    # Keyword mode has no query vector: relevance is the retrieval order and nothing is dropped for it
+    monkeypatch.setattr(retriever, "mode", "keyword")
+    assert {doc.page_content for doc in retriever.invoke("glacier orchard canyon")} == {texts[2], texts[4], texts[6]}
+
+def test_context_is_packed_into_a_token_budget_with_citations(monkeypatch):
+    """
+    Test that overlapping chunks are deduplicated, the budget is cut at a sentence, and answers carry citations and usage.
+    """
+    from langchain_core.documents import Document
+    from app.routers import chat
+    from app.services.context_builder import ContextBuilder
+
+    first = "The audit starts in March. Findings are due to the board by June. Owners reply within ten days."
+    # The chunker repeats the tail of the previous chunk at the start of the next one
+    second = "Owners reply within ten days. Late replies are escalated to the audit committee chair."
+    documents = [
+        Document(id="a", page_content=first, metadata={"filename": "audit.pdf", "page": 2, "page_end": 3}),
+        Document(id="b", page_content=second, metadata={"filename": "audit.pdf", "page": 3}),
+        Document(id="c", page_content="Q3 | 120 | EMEA", metadata={"filename": "sales.xlsx", "sheet": "Q3", "row": 2}),
+    ]
+    packed = ContextBuilder(max_tokens=1000).build(documents)
+    assert packed.text.count("Owners reply within ten days.") == 1
+    assert packed.text.startswith("[1] audit.pdf, pages 2-3\nThe audit starts in March.")
+    assert "[3] sales.xlsx, sheet Q3, row 2\nQ3 | 120 | EMEA" in packed.text
+    assert [citation["chunk_id"] for citation in packed.citations] == ["a", "b", "c"]
+    assert packed.citations[0] == {"id": 1, "chunk_id": "a", "filename": "audit.pdf", "page": 2, "page_end": 3}
+    assert not packed.truncated and packed.tokens == DocumentProcessor.count_tokens(packed.text)
+
+    # The second sentence fits, the third does not; later snippets are dropped
+    packed = ContextBuilder(max_tokens=30).build(documents)
+    assert packed.truncated and packed.tokens <= 30 and len(packed.citations) == 1
+    assert packed.text.endswith("Findings are due to the board by June.")
+    # A first chunk larger than the whole budget still gives some context
+    assert ContextBuilder(max_tokens=13).build(documents).text == "[1] audit.pdf, pages 2-3\nThe audit"
+
+    async def fake_generate_response(context, user_message):
+        await asyncio.sleep(0.01)
+        return "Due by June [1]."
+
+    monkeypatch.setattr(chat.llm_manager, "agenerate_response", fake_generate_response)
+    monkeypatch.setattr(DocumentProcessor, "extract_chunks", lambda file_path, filename: [(first, {"page": 2})])
+    upload_and_wait("audit.pdf")
+    before = client.get("/chat/stats").json()
+    body = client.post("/chat/", json={"user_message": "When are findings due?"}).json()
+    assert body["citations"] == [{"id": 1, "chunk_id": body["citations"][0]["chunk_id"],
+                                  "filename": "audit.pdf", "page": 2}]
+    usage = body["usage"]
+    assert usage["context_tokens"] < usage["prompt_tokens"] and usage["llm_seconds"] >= 0.01 and not usage["cached"]
+    assert client.post("/chat/", json={"user_message": "When are findings due?"}).json()["usage"]["cached"]
+    stats = client.get("/chat/stats").json()
+    assert stats["calls"] == before["calls"] + 1 and stats["avg_prompt_tokens"] > 0
+
+def test_context_packs_as_many_retrieved_chunks_as_the_budget_allows(monkeypatch, fake_embeddings):
+    """
+    Test that every retrieved chunk reaches the prompt when the budget allows it, and a small budget packs fewer.
+    """
+    from app.routers import chat
+    from app.services.context_builder import ContextBuilder
+
+    contexts = []
+
+    async def fake_generate_response(context, user_message):
+        contexts.append(context)
+        return "Noted."
+
+    monkeypatch.setattr(chat.llm_manager, "agenerate_response", fake_generate_response)
+    monkeypatch.setattr(vector_store, "RETRIEVAL_K", 6)
+    monkeypatch.setattr(vector_store, "get_reranker", lambda: None)
+    monkeypatch.setattr(DocumentProcessor, "extract_chunks", lambda file_path, filename: [
+        (f"Clause {i} sets the fee for region {i} at {i * 10} euros.", {"page": i + 1}) for i in range(8)
+    ])
+    upload_and_wait("fees.pdf")
+
+    monkeypatch.setattr(chat, "context_builder", ContextBuilder(max_tokens=1000))
+    body = client.post("/chat/", json={"user_message": "What are the regional fees?"}).json()
+    assert len(body["citations"]) == 6
+    assert contexts[-1].count("Clause") == 6
+
+    monkeypatch.setattr(chat, "context_builder", ContextBuilder(max_tokens=40))
+    body = client.post("/chat/", json={"user_message": "Which fees apply per region?"}).json()
+    assert 1 <= len(body["citations"]) < 6
+
+def test_concurrent_retrievals_are_embedded_and_searched_in_one_batch(monkeypatch, fake_embeddings):
+    """
+    Test that concurrent async retrievals share one embedding request and one faiss search with unchanged results.
+    """
+    from app.services.ann_index import ANNVectorStore
+    from app.services.query_batcher import QueryBatcher
+
+    monkeypatch.setattr(DocumentProcessor, "extract_chunks", lambda file_path, filename: [
+        (f"{filename} topic {i} covers item {i * 7}", {"page": i + 1}) for i in range(40)
+    ])
+    upload_and_wait("items.pdf")
+    manager = vector_store.VectorStoreManager()
+    questions = [f"item {i * 7}" for i in range(8)]
+    expected = [[doc.id for doc in manager.retriever.invoke(question)] for question in questions]
+
+    batcher = QueryBatcher(max_size=32, max_wait_ms=50)
+    retriever = manager.retriever.model_copy(update={"batcher": batcher})
+    scoped = manager.scoped_retriever(files=["items.pdf"]).model_copy(update={"batcher": batcher})
+    embed_calls, searches = [], []
+    real_embed = CountingFakeEmbeddings.embed_documents
+    monkeypatch.setattr(CountingFakeEmbeddings, "embed_documents",
+                        lambda self, texts: embed_calls.append(list(texts)) or real_embed(self, texts))
+    real_search = ANNVectorStore.similarity_search_by_vectors
+    monkeypatch.setattr(ANNVectorStore, "similarity_search_by_vectors",
+                        lambda self, vectors, k=4: searches.append(len(vectors)) or real_search(self, vectors, k))
+
+    async def ask_all():
+        return await asyncio.gather(*[retriever.ainvoke(question) for question in questions],
+                                    scoped.ainvoke(questions[0]))
+
+    *results, scoped_result = asyncio.run(ask_all())
+    assert [[doc.id for doc in docs] for docs in results] == expected
+    assert [doc.id for doc in scoped_result] == expected[0]
+    # One embedding request, the repeated question embedded once; the scoped one searches on its own
+    assert embed_calls == [questions]
+    assert searches == [8]
+    assert batcher.stats()["search"] == {"batches": 1, "items": 9, "mean_batch_size": 9.0}
+
+    def failing(self, texts):
+        raise RuntimeError("embedding backend down")
+
+    monkeypatch.setattr(CountingFakeEmbeddings, "embed_documents", failing)
+
+    async def ask_failing():
+        return await asyncio.gather(retriever.ainvoke("new question a"), retriever.ainvoke("new question b"),
+                                    return_exceptions=True)
+
+    assert [str(e) for e in asyncio.run(ask_failing())] == ["embedding backend down"] * 2
+
+def test_stages_are_timed_per_request_and_exposed_as_metrics(monkeypatch, tmp_path):
+    """
+    Test that requests carry an id and Server-Timing, and stage histograms show up on /metrics.
+    """
+    from app.routers.chat import llm_manager
+    from app.services import metrics
+
+    async def fake_generate_response(context, user_message):
+        return "Fake response from LLM."
+
+    monkeypatch.setattr(llm_manager, "agenerate_response", fake_generate_response)
+    monkeypatch.setattr(DocumentProcessor, "extract_chunks", REAL_EXTRACT_CHUNKS)
+    from benchmarks.corpus import write_pdf
+    pdf_path = tmp_path / "source.pdf"
+    write_pdf(str(pdf_path), [["The audit is due in June."]])
+    before = metrics.STAGE_SECONDS.count(stage="extraction", format="pdf")
+    upload_and_wait("metrics.pdf", pdf_path.read_bytes())
+    assert metrics.STAGE_SECONDS.count(stage="extraction", format="pdf") == before + 1
+
+    response = client.post("/chat/", json={"user_message": "When is the audit?"},
+                           headers={"X-Request-ID": "trace-42"})
+    assert response.status_code == 200, response.text
+    assert response.headers["x-request-id"] == "trace-42"
+    timing = response.headers["server-timing"]
+    assert "retrieval;dur=" in timing and "llm;dur=" in timing and timing.endswith(tuple("0123456789"))
+
+    # Ids that could break a log line are replaced
+    forged = client.get("/documents/getfile", headers={"X-Request-ID": "a b\tc"}).headers["x-request-id"]
+    assert forged != "a b\tc" and len(forged) == 32
+
+    body = client.get("/metrics").text
+    for line in (
+        'docbot_stage_seconds_count{stage="upload_save",format="pdf"}',
+        'docbot_stage_seconds_count{stage="chunking",format="pdf"}',
+        'docbot_stage_seconds_count{stage="embedding"}',
+        'docbot_stage_seconds_count{stage="index_write"}',
+        'docbot_stage_seconds_count{stage="retrieval"}',
+        'docbot_stage_seconds_bucket{stage="llm",le="+Inf"}',
+        'docbot_embedding_batch_size_count{kind="document"}',
+        # Routes are reported by template, not by path
+        'docbot_http_request_seconds_count{method="GET",route="/documents/jobs/{job_id}",status="200"}',
+    ):
+        assert line in body, line
+
+def test_manifest_skips_unchanged_uploads_replaces_changed_ones_and_reconciles(monkeypatch, fake_embeddings):
+    """
+    Test that re-uploads cost nothing unless the content changed, and startup reconcile indexes only the difference.
+    """
+    monkeypatch.setattr(DocumentProcessor, "extract_chunks",
+                        lambda file_path, filename: [(f"{filename}: {open(file_path, 'rb').read()!r}", {"page": 1})])
+    manager = vector_store.VectorStoreManager()
+    upload_and_wait("a.pdf", b"first version")
+    ids = manager._doc_ids["a.pdf"]
+    embedded = len(fake_embeddings.embedded_texts)
+
+    # Same bytes again: no extraction, embedding or index write
+    job = upload_and_wait("a.pdf", b"first version")
+    assert job["skipped_files"] == ["a.pdf"] and job["chunks"] == 0
+    assert manager._doc_ids["a.pdf"] == ids and len(fake_embeddings.embedded_texts) == embedded
+
+    # Changed bytes: the file's old chunks are replaced, not added to
+    upload_and_wait("a.pdf", b"second version")
+    assert len(manager._doc_ids["a.pdf"]) == 1 and manager._doc_ids["a.pdf"] != ids
+    assert manager._vectorstore.index.ntotal == 1
+    entry = client.get("/documents/manifest").json()["files"]["a.pdf"]
+    assert entry["sha256"] == hashlib.sha256(b"second version").hexdigest()
+    assert entry["chunk_ids"] == manager._doc_ids["a.pdf"] and entry["size"] == len(b"second version")
+
+    # The replacement is one logged step and the manifest survives a reload
+    manager._load()
+    assert manager._manifest["a.pdf"]["sha256"] == entry["sha256"] and manager._vectorstore.index.ntotal == 1
+
+    # Out-of-band changes: a new file, a deleted one and one rewritten with the same bytes
+    upload_and_wait("gone.pdf", b"old")
+    (DOCUMENT_PATH / "gone.pdf").unlink()
+    (DOCUMENT_PATH / "b.pdf").write_bytes(b"new file")
+    (DOCUMENT_PATH / "notes.tmp").write_bytes(b"not a document")
+    os.utime(DOCUMENT_PATH / "a.pdf", ns=(1, 1))
+    job = IngestionManager().reconcile()
+    assert job.filenames == ["a.pdf", "b.pdf"]
+    job = wait_for_job(job.id)
+    assert job["skipped_files"] == ["a.pdf"] and job["chunks"] == 1
+    assert sorted(manager._doc_ids) == ["a.pdf", "b.pdf"]
+    # Everything now matches by size and mtime, so nothing is hashed or queued
+    assert IngestionManager().reconcile() is None
+
+def test_uploads_stream_to_disk_and_oversized_bodies_are_cut_off_early(monkeypatch):
+    """
+    Test that an upload is hashed while it streams in, too large bodies stop being read, and files change atomically.
+    """
+    from app.services import manifest
+
+    upload_and_wait("report.pdf", b"%PDF-1.4 original")
+
+    # The job uses the hash taken during the upload instead of reading the file again
+    monkeypatch.setattr(manifest, "fingerprint", lambda path: pytest.fail("stored upload was hashed again"))
+    job = upload_and_wait("report.pdf", b"%PDF-1.4 original")
+    assert job["skipped_files"] == ["report.pdf"]
+
+    def post_upload(declare_length: bool):
+        boundary = "testboundary"
+        head = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"report.pdf\"\r\n"
+                f"Content-Type: application/pdf\r\n\r\n").encode()
+        piece = b"x" * 64 * 1024
+        pieces = MAX_FILE_SIZE // len(piece) * 4
+        received = []
+
+        async def receive():
+            received.append(1)
+            if len(received) == 1:
+                return {"type": "http.request", "body": head, "more_body": True}
+            return {"type": "http.request", "body": piece, "more_body": len(received) < pieces}
+
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        headers = [(b"content-type", f"multipart/form-data; boundary={boundary}".encode())]
+        if declare_length:
+            headers.append((b"content-length", str(len(head) + pieces * len(piece)).encode()))
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+            "scheme": "http", "path": "/documents/upload", "raw_path": b"/documents/upload", "root_path": "",
+            "query_string": b"", "headers": headers, "client": ("test", 1), "server": ("test", 80),
+        }
+        asyncio.run(app(scope, receive, send))
+        return messages[0]["status"], len(received)
+
+    # Declared too large: refused before any of the body is read
+    assert post_upload(declare_length=True) == (413, 0)
+    # Chunked: reading stops just past the limit, not at the end of the body
+    status_code, messages_read = post_upload(declare_length=False)
+    assert status_code == 413 and messages_read == 1 + MAX_FILE_SIZE // (64 * 1024) + 1
+
+    # The stored file was never touched and no temporary file is left behind
+    assert (DOCUMENT_PATH / "report.pdf").read_bytes() == b"%PDF-1.4 original"
+    assert os.listdir(DOCUMENT_PATH) == ["report.pdf"]
+
+def test_collections_are_separate_shards_searched_together(monkeypatch):
+    """
+    Test that uploads go to their collection's own index and that /chat can search several collections at once.
+    """
+    from app.routers.chat import llm_manager
+    from app.services.hybrid_search import FanOutRetriever
+
+    # Named collections' managers must not outlive this test's index directory
+    monkeypatch.setattr(vector_store.VectorStoreManager, "_instances",
+                        dict(vector_store.VectorStoreManager._instances))
+    monkeypatch.setattr(DocumentProcessor, "extract_chunks", lambda file_path, filename: [
+        (f"{filename} clause {i} on termination notice", {"page": i + 1}) for i in range(10)
+    ])
+
+    def upload(filename, collection=None):
+        response = client.post("/documents/upload", params={"collection": collection} if collection else None,
+                               files={"file": (filename, io.BytesIO(b"%PDF-1.4 " + filename.encode()),
+                                               "application/pdf")})
+        assert response.status_code == 202, response.text
+        assert wait_for_job(response.json()["job_id"])["stage"] == "done"
+
+    upload("main.pdf")
+    upload("contract.pdf", "legal")
+    upload("handbook.pdf", "hr")
+    assert client.get("/documents/collections").json() == {"collections": ["default", "hr", "legal"]}
+    assert (DOCUMENT_PATH / "collections" / "legal" / "contract.pdf").is_file()
+    assert client.get("/documents/getfile", params={"collection": "hr"}).json() == {"files": ["handbook.pdf"]}
+
+    # Each collection only indexes its own files, in its own directory
+    default, legal = vector_store.VectorStoreManager(), vector_store.VectorStoreManager("legal")
+    assert set(default.manifest()) == {"main.pdf"} and set(legal.manifest()) == {"contract.pdf"}
+    assert legal.path == vector_store.FAISS_INDEX_PATH / "collections" / "legal"
+    assert list(client.get("/documents/manifest", params={"collection": "hr"}).json()["files"]) == ["handbook.pdf"]
+
+    async def fake_generate_response(context, user_message):
+        return "ok"
+
+    monkeypatch.setattr(llm_manager, "agenerate_response", fake_generate_response)
+
+    def cited(**scope):
+        response = client.post("/chat/", json={"user_message": "termination notice", **scope})
+        assert response.status_code == 200, response.text
+        return {citation["filename"] for citation in response.json()["citations"]}
+
+    # Every collection's best hit makes the merged top three
+    assert cited(collections=["legal", "hr"]) == {"contract.pdf", "handbook.pdf"}
+    assert cited(collections=["legal"]) == {"contract.pdf"}
+    assert cited() == {"main.pdf"}
+    assert client.post("/chat/", json={"user_message": "hi", "collections": ["nope"]}).status_code == 404
+    assert client.post("/chat/", json={"user_message": "hi", "collections": ["../x"]}).status_code == 400
+    assert not (vector_store.FAISS_INDEX_PATH / "collections" / "nope").exists()
+
+    hr = vector_store.VectorStoreManager("hr")
+    fan_out = FanOutRetriever(retrievers=[legal.retriever, hr.retriever], k=4)
+    assert {doc.metadata["filename"] for doc in fan_out.invoke("termination notice")} == {"contract.pdf",
+                                                                                           "handbook.pdf"}
+
+    # A delete only touches its own collection
+    assert client.delete("/documents/contract.pdf").status_code == 404
+    assert client.delete("/documents/contract.pdf", params={"collection": "legal"}).status_code == 200
+    assert legal.manifest() == {} and set(hr.manifest()) == {"handbook.pdf"}
+    assert set(default.manifest()) == {"main.pdf"}
+
+def test_llm_calls_are_routed_hedged_and_bounded_by_a_deadline(monkeypatch):
+    """
+    Test that lookups go to the fast model, slow calls are hedged with the fast model and stuck calls time out.
+    """
+    from app.routers.chat import llm_manager
+    from app.services import llm_setup, metrics
+    from app.services.llm_setup import LLMManager, LLMTimeout, FAST, REASONING
+    from benchmarks.fakes import LatencyFakeChatModel
+
+    manager = LLMManager()
+    manager.routing = "auto"
+    assert manager.route("", "What is the notice period?") == FAST
+    assert manager.route("", "Why did revenue fall compared to Q2?") == REASONING
+    assert manager.route("revenue " * 5000, "What is the notice period?") == REASONING
+
+    # A stuck call ends at the deadline; the hedge delay is unknown until the model has a few calls
+    manager.llm = LatencyFakeChatModel(answer="slow", latencies=[5.0])
+    manager.fast_llm = LatencyFakeChatModel(answer="fast", latencies=[0.02])
+    manager.timeout = 0.2
+    start = time.perf_counter()
+    with pytest.raises(LLMTimeout):
+        asyncio.run(manager.agenerate_response("", "Explain the trend"))
+    assert time.perf_counter() - start < 1 and manager.llm.cancelled == 1
+
+    monkeypatch.setattr(llm_setup, "LLM_HEDGE_MIN_SAMPLES", 3)
+    for _ in range(3):
+        manager._observe(REASONING, "answer", 0.05)
+        manager._observe(REASONING, "first_token", 0.05)
+    assert manager.hedge_delay(REASONING) == 0.05
+    manager.timeout = 10
+    hedges = metrics.LLM_HEDGES.value(route=REASONING)
+    won = metrics.LLM_REQUESTS.value(route=FAST, outcome="won")
+
+    # Past the reasoning model's p95 the fast model is asked too, and its earlier answer is used
+    start = time.perf_counter()
+    assert asyncio.run(manager.agenerate_response("", "Explain the trend")) == "fast"
+    assert time.perf_counter() - start < 1
+    assert manager.llm.cancelled == 2 and manager.fast_llm.calls == 1
+
+    async def stream():
+        return [token async for token in manager.astream_response("", "Compare both offers")]
+
+    manager.fast_llm = LatencyFakeChatModel(answer="fast streamed answer", latencies=[0.02], token_delay=0.01)
+    assert "".join(asyncio.run(stream())) == "fast streamed answer" and manager.llm.cancelled == 3
+    assert metrics.LLM_HEDGES.value(route=REASONING) == hedges + 2
+    assert metrics.LLM_REQUESTS.value(route=FAST, outcome="won") == won + 2
+    assert manager.stats()["routes"][FAST]["recent_calls"] == 2
+
+    # Without hedging the reasoning model answers in its own time
+    manager.hedge = False
+    manager.llm = LatencyFakeChatModel(answer="reasoned", latencies=[0.1])
+    assert asyncio.run(manager.agenerate_response("", "Explain the trend")) == "reasoned"
+
+    # /chat turns a missed deadline into a 504
+    monkeypatch.setattr(llm_manager, "llm", LatencyFakeChatModel(latencies=[5.0]))
+    monkeypatch.setattr(llm_manager, "fast_llm", LatencyFakeChatModel(latencies=[5.0]))
+    monkeypatch.setattr(llm_manager, "timeout", 0.1)
+    response = client.post("/chat/", json={"user_message": "What is the notice period?"})
+    assert response.status_code == 504 and "did not answer" in response.json()["detail"]